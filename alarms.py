@@ -0,0 +1,149 @@
+# alarms.py — stateful alarm engine: edge-triggered, cooldown, hysteresis; history/state persisted in batches
+#
+# מפתח לכל התראה: (metric, cond) — למשל ('AirEnv_Temperature', 'high').
+# פרסום רק במעבר מצב (raise / clear), לא בכל הודעה:
+#   תקין → חריגה  : raise  (אלא אם עוד לא עבר ALERT_COOLDOWN מהפרסום הקודם לאותו מפתח → נספר בלבד, בלי פרסום ובלי שורת היסטוריה)
+#   חריגה → תקין  : clear  (רק כשהערך חזר מעבר לפס ה-hysteresis; clear מפורסם רק אם ה-raise פורסם)
+#   חריגה נמשכת  : raise שנדחה ב-cooldown מפורסם כשה-cooldown נגמר; repeat כל ALERT_REPEAT_S שניות (0 = אף פעם)
+# ההיסטוריה (iot_alerts) והמצב (alarm_state) נכתבים ב-flush() — מהלולאה המחזורית, לא מהנתיב החם.
+
+import threading
+import time
+
+import data_acq as da
+
+try:
+    from init import ALERT_COOLDOWN, ALERT_HYSTERESIS, ALERT_REPEAT_S
+except ImportError:
+    ALERT_COOLDOWN, ALERT_HYSTERESIS, ALERT_REPEAT_S = 60, 0.05, 0
+
+class AlarmEngine:
+    """
+    Per-(metric, cond) alarm state machine. check() is O(1) and touches no I/O;
+    transitions are queued and written by flush() in one transaction.
+    """
+
+    def __init__(self, cooldown: float = ALERT_COOLDOWN, repeat_s: float = ALERT_REPEAT_S,
+                 db_path: str | None = None):
+        self.cooldown = float(cooldown)
+        self.repeat_s = float(repeat_s or 0)
+        self.db_path = db_path
+        self._schema_ready = False   # ensure_schema פעם אחת לכל engine (לא בכל flush)
+        self.state = {}          # (metric, cond) -> dict(active, since, last_sent, notified, value)
+        self._history = []       # שורות ל-iot_alerts שטרם נכתבו
+        self._dirty = set()      # מפתחות שמצבם השתנה מאז ה-flush האחרון
+        self._lock = threading.Lock()
+        self.counts = {"raise": 0, "clear": 0, "repeat": 0, "suppressed": 0}
+
+    def _ensure_schema(self):
+        if not self._schema_ready:
+            da.ensure_schema(self.db_path)
+            self._schema_ready = True
+
+    def load(self) -> int:
+        """Restore active alarms from alarm_state (אחרי restart — בלי raise כפול)."""
+        self._ensure_schema()
+        rows = da.load_alarm_state(self.db_path)
+        with self._lock:
+            for r in rows:
+                self.state[(r["metric"], r["cond"])] = {
+                    "active": bool(r["active"]), "since": r["since"], "last_sent": r["last_sent"] or 0.0,
+                    "notified": bool(r["notified"]), "value": r["value"],
+                }
+        return len(rows)
+
+    def _record(self, key, st, level, message, now, history=True):
+        if history:   # מהבהבים (suppressed וה-clear השקט שאחריו) — רק מונה + מצב, בלי שורה
+            self._history.append((time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)),
+                                  level, message, key[0], key[1], st["value"]))
+        self._dirty.add(key)
+        self.counts[level] += 1
+
+    def check(self, metric: str, cond: str, value, bad: bool, ok: bool, text=None, text_ok=None,
+              now: float | None = None):
+        """
+        Feed one evaluation. bad = raise condition, ok = clear condition (stricter
+        than `not bad` when there is hysteresis). text / text_ok are callables
+        building the message — called only on a transition.
+        Returns the message to publish, or None.
+        """
+        key = (metric, cond)
+        st = self.state.get(key)
+        if (st is None or not st["active"]) and not bad:
+            return None                                   # הנתיב הנפוץ: תקין ונשאר תקין
+        with self._lock:
+            now = time.time() if now is None else now
+            if st is None:
+                st = self.state[key] = {"active": False, "since": None, "last_sent": 0.0,
+                                        "notified": False, "value": None}
+            st["value"] = value
+            if not st["active"]:
+                st["active"], st["since"] = True, now
+                if now - st["last_sent"] >= self.cooldown:
+                    msg = text() if text else None
+                    st["last_sent"], st["notified"] = now, True
+                    self._record(key, st, "raise", msg, now)
+                    return msg
+                st["notified"] = False                    # מהבהב — בתוך ה-cooldown
+                self._record(key, st, "suppressed", None, now, history=False)
+                return None
+            if ok:
+                st["active"] = False
+                if not st["notified"]:
+                    self._record(key, st, "clear", None, now, history=False)
+                    return None
+                msg = text_ok() if text_ok else None
+                self._record(key, st, "clear", msg, now)
+                return msg
+            if bad and not st["notified"] and now - st["last_sent"] >= self.cooldown:
+                msg = text() if text else None            # חריגה שנדחתה ב-cooldown ועדיין נמשכת — מפורסמת עכשיו
+                st["last_sent"], st["notified"] = now, True
+                self._record(key, st, "raise", msg, now)
+                return msg
+            if bad and self.repeat_s and now - st["last_sent"] >= self.repeat_s:
+                st["last_sent"], st["notified"] = now, True
+                msg = text() if text else None
+                self._record(key, st, "repeat", msg, now)
+                return msg
+            return None                                   # עדיין בחריגה / בתוך פס ה-hysteresis
+
+    def event(self, metric: str, cond: str, text, value=None, now: float | None = None):
+        """One-shot event (e.g. timer done): published at most once per cooldown."""
+        key = (metric, cond)
+        with self._lock:
+            now = time.time() if now is None else now
+            st = self.state.setdefault(key, {"active": False, "since": None, "last_sent": 0.0,
+                                             "notified": False, "value": None})
+            st["value"] = value
+            if now - st["last_sent"] < self.cooldown:
+                self._record(key, st, "suppressed", None, now, history=False)
+                return None
+            msg = text() if callable(text) else text
+            st["last_sent"], st["since"], st["notified"] = now, now, True
+            self._record(key, st, "raise", msg, now)
+            return msg
+
+    def active(self):
+        """[(metric, cond, since, value)] of alarms currently raised."""
+        with self._lock:
+            return [(k[0], k[1], s["since"], s["value"]) for k, s in self.state.items() if s["active"]]
+
+    def flush(self) -> int:
+        """Write pending history + changed states in one transaction. Returns rows of history written."""
+        with self._lock:
+            history, self._history = self._history, []
+            states = [(k[0], k[1], int(s["active"]), s["since"], s["last_sent"], int(s["notified"]), s["value"])
+                      for k, s in ((k, self.state[k]) for k in self._dirty)]
+            self._dirty = set()
+        if not history and not states:
+            return 0
+        try:
+            self._ensure_schema()
+            da.save_alarms(history, states, self.db_path)
+        except Exception as e:
+            with self._lock:   # נשמר לניסיון הבא
+                self._history[:0] = history
+                self._dirty.update((s[0], s[1]) for s in states)
+            print(f"{da.timestamp()}  alarms|> flush failed ({len(history)} rows kept): {e}")
+            return 0
+        return len(history)
@@ -0,0 +1,144 @@
+# bench_ingest.py — offline ingestion benchmark: manager.insert_and_evaluate + data_acq writer
+# מריץ הודעות סינתטיות (בפורמט של האמולטורים) דרך המנהל, עם לקוח MQTT מזויף וקובץ SQLite זמני.
+#
+#   python bench_ingest.py --messages 20000
+#   python bench_ingest.py --messages 50000 --min-rate 2000   # exit 1 אם מתחת לסף (gate לרגרסיות)
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from icecream import ic
+
+import data_acq as da
+import instrument as im
+import manager
+
+# ------------------ לקוח MQTT מזויף ------------------
+class FakeClient:
+    """Stands in for paho's Client: records publishes, never touches the network."""
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+# ------------------ הודעות סינתטיות ------------------
+def synthetic_messages(n, seed=0):
+    """Yield (topic, payload) in the exact formats emulators_gui.py publishes."""
+    rnd = random.Random(seed)
+    base = manager.TOPIC_BASE
+    rem = 900
+    for i in range(n):
+        k = i % 5
+        if k == 0:
+            yield (f"{base}/env-1/pub",
+                   f"From: AirEnv Temperature: {rnd.uniform(25, 34):.1f} Humidity: {rnd.uniform(65, 90):.1f}")
+        elif k == 1:
+            yield (f"{base}/doughH-1/pub", f"Dough Moisture: {rnd.uniform(50, 80):.1f}")
+        elif k == 2:
+            yield (f"{base}/rise-1/pub", f"Dough Rise: {rnd.uniform(0, 100):.0f}")
+        elif k == 3:
+            rem = rem - 1 if rem > 0 else 900
+            yield (f"{base}/timer-1/pub", f"Timer remaining: {rem}")
+        else:
+            yield (f"{base}/timer-1/pub", "Oven Ready: 1")
+
+def _pct(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(p / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+def _db_stats(path):
+    size = sum(os.path.getsize(path + ext) for ext in ("", "-wal") if os.path.exists(path + ext))
+    conn = da.connect(path)
+    try:
+        rows = conn.execute("SELECT COUNT(*) FROM iot_data").fetchone()[0]
+    finally:
+        conn.close()
+    return size, rows
+
+# ------------------ הרצה ------------------
+def run_bench(n_messages, seed=0, db_path=None):
+    """Replay n_messages through the manager; returns a dict of results."""
+    own_tmp = db_path is None
+    if own_tmp:
+        fd, db_path = tempfile.mkstemp(prefix="bench_", suffix=".db"); os.close(fd)
+
+    da.close_IOT_writer()
+    da._latest.clear()
+    im.reset()
+    manager.ALARMS = manager.AlarmEngine()
+    da.INIT_DB_NAME = db_path
+    conn = da.connect(db_path); da.create_schema(conn, force_drop_iot_devices=False); conn.close()
+    size0, rows0 = _db_stats(db_path)
+
+    client = FakeClient()
+    msgs = list(synthetic_messages(n_messages, seed))
+    lat = []
+    t0 = time.perf_counter()
+    for topic, payload in msgs:
+        s = time.perf_counter()
+        manager.insert_and_evaluate(client, topic, payload)
+        lat.append(time.perf_counter() - s)
+    t_enqueue = time.perf_counter() - t0
+    da.flush_IOT_data()
+    t_total = time.perf_counter() - t0
+    manager.ALARMS.flush()
+    da.close_IOT_writer()
+
+    size1, rows1 = _db_stats(db_path)
+    lat.sort()
+    res = {
+        "messages": n_messages,
+        "seconds": t_total,
+        "rate": n_messages / t_total if t_total else 0.0,
+        "enqueue_rate": n_messages / t_enqueue if t_enqueue else 0.0,
+        "p50_us": _pct(lat, 50) * 1e6,
+        "p99_us": _pct(lat, 99) * 1e6,
+        "rows": rows1 - rows0,
+        "db_bytes": size1 - size0,
+        "alarms_published": len(client.published),
+        "alarm_transitions": dict(manager.ALARMS.counts),
+        "stages": im.summary(),   # stage -> (count, p50_s, p99_s) — גבולות bucket
+    }
+    if own_tmp:
+        for ext in ("", "-wal", "-shm"):
+            try: os.remove(db_path + ext)
+            except OSError: pass
+    return res
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline ingest throughput benchmark for the manager pipeline")
+    ap.add_argument("--messages", type=int, default=20000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--db", default=None, help="SQLite file to write (default: temp file, removed after)")
+    ap.add_argument("--min-rate", type=float, default=0.0, help="fail (exit 1) if msgs/s is below this")
+    args = ap.parse_args(argv)
+
+    ic.disable()   # לוג לכל הודעה מודד את stderr, לא את המנהל
+    r = run_bench(args.messages, args.seed, args.db)
+    print(f"messages      : {r['messages']}")
+    print(f"throughput    : {r['rate']:.0f} msg/s  (enqueue {r['enqueue_rate']:.0f} msg/s)")
+    print(f"latency p50   : {r['p50_us']:.1f} us")
+    print(f"latency p99   : {r['p99_us']:.1f} us")
+    print(f"rows written  : {r['rows']}  ({r['rows'] / max(1, r['messages']):.2f} per msg)")
+    print(f"db growth     : {r['db_bytes'] / 1024:.1f} KiB  ({r['db_bytes'] / max(1, r['rows']):.1f} B/row)")
+    print(f"alarm engine  : {r['alarm_transitions']}")
+    for stage, (n, p50, p99) in sorted(r["stages"].items()):
+        print(f"stage {stage:<16}: n={n:<7} p50<={p50 * 1e6:g} us  p99<={p99 * 1e6:g} us")
+    if args.min_rate and r["rate"] < args.min_rate:
+        print(f"FAIL: {r['rate']:.0f} msg/s < --min-rate {args.min_rate:.0f}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,427 @@
+# broker.py — minimal local MQTT 3.1.1 broker (asyncio) for offline runs and benchmarks
+#
+#   python broker.py                        # 127.0.0.1:1883, דוח קצבים לכל topic כל broker_report_s
+#   python broker.py --port 1884 --metrics-port 9109
+#   init.py: nb = 3  (127.0.0.1)  ו/או  embedded_broker = True  → המנהל/הדשבורד/האמולטורים מפעילים אותו בעצמם
+#
+# נתמך: CONNECT/CONNACK, PUBLISH QoS 0/1 (QoS 2 מתקבל ומועבר כ-1), SUBSCRIBE/UNSUBSCRIBE עם + ו-#,
+# retained (payload ריק מוחק), will, keepalive, PINGREQ, $share/<group>/<filter> (round-robin בתוך קבוצה).
+# לא נתמך: sessions מתמשכים (clean_session=False מתנהג כמו True), אימות משתמשים, TLS, MQTT v5.
+# QoS 1 למנויים הוא at-most-once: PUBACK מהלקוח לא נדרש ואין שליחה חוזרת (DUP) — בלי sessions מתמשכים
+# אין למי לשלוח מחדש אחרי ניתוק, ובתוך חיבור פעיל TCP כבר מבטיח מסירה. ה-PUBACK לפרסומים הנכנסים נשלח כרגיל.
+
+import argparse
+import asyncio
+import itertools
+import struct
+import threading
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+import instrument as im
+
+try:
+    from init import broker_port, broker_report_s
+except Exception:
+    broker_port, broker_report_s = 1883, 10.0
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+WRITE_BUFFER_MAX = 8 * 1024 * 1024   # לקוח איטי: מעבר לזה הודעות QoS 0 אליו נזרקות (ונספרות)
+
+# ------------------ קידוד ------------------
+def _varint(n):
+    out = bytearray()
+    while True:
+        b, n = n % 128, n // 128
+        out.append(b | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+def _str(s):
+    b = s.encode("utf-8") if isinstance(s, str) else s
+    return struct.pack("!H", len(b)) + b
+
+def _packet(ptype, flags, body=b""):
+    return bytes([(ptype << 4) | flags]) + _varint(len(body)) + body
+
+def publish_packet(topic, payload, qos=0, retain=False, pid=0):
+    body = _str(topic) + (struct.pack("!H", pid) if qos else b"") + payload
+    return _packet(PUBLISH, (qos << 1) | int(retain), body)
+
+class _Reader:
+    __slots__ = ("b", "i")
+
+    def __init__(self, b):
+        self.b, self.i = b, 0
+
+    def u8(self):
+        self.i += 1
+        return self.b[self.i - 1]
+
+    def u16(self):
+        self.i += 2
+        return struct.unpack_from("!H", self.b, self.i - 2)[0]
+
+    def raw(self):
+        n = self.u16()
+        self.i += n
+        return self.b[self.i - n:self.i]
+
+    def str(self):
+        return self.raw().decode("utf-8", "replace")
+
+    def rest(self):
+        return self.b[self.i:]
+
+    def more(self):
+        return self.i < len(self.b)
+
+# ------------------ session ------------------
+class Session:
+    __slots__ = ("cid", "writer", "subs", "will", "pid", "dropped", "closed")
+
+    def __init__(self, cid, writer):
+        self.cid, self.writer = cid, writer
+        self.subs = {}       # filter -> (qos, share group | None, מסנן בלי $share)
+        self.will = None     # (topic, payload, qos, retain)
+        self.pid = itertools.cycle(range(1, 65536))
+        self.dropped = 0
+        self.closed = False
+
+    def send(self, data, droppable=False):
+        t = self.writer.transport
+        if self.closed or t.is_closing():   # נותק — לא לכתוב ל-transport סגור
+            return False
+        if droppable and t.get_write_buffer_size() > WRITE_BUFFER_MAX:
+            self.dropped += 1
+            return False
+        self.writer.write(data)
+        return True
+
+# ------------------ broker ------------------
+class Broker:
+    """In-process MQTT 3.1.1 broker. run with `await serve()` or start_in_thread()."""
+
+    def __init__(self, host="127.0.0.1", port=None, report_s=broker_report_s):
+        self.host, self.port = host, int(port or broker_port)
+        self.report_s = float(report_s or 0)
+        self.sessions = {}        # client id -> Session
+        self.retained = {}        # topic -> (payload, qos)
+        self._route = {}          # topic -> (plain [(session, qos)], groups) (מטמון; מתאפס בכל שינוי מנויים)
+        self._rr = {}             # (group, filter) -> מונה round-robin
+        self.n_in = self.n_out = self.n_dropped = 0
+        self.topic_in = {}        # topic -> הודעות נכנסות
+        self.topic_out = {}       # topic -> עותקים שנשלחו למנויים
+        self._last = (time.monotonic(), {}, 0)
+        self.server = None
+        self.loop = None
+
+    # ---- ניתוב ----
+    def _invalidate(self):
+        self._route = {}
+
+    def subscribers(self, topic):
+        """[(session, qos)] for a topic — plain subs once per session, one member per $share group."""
+        r = self._route.get(topic)
+        if r is None:
+            plain, groups = {}, {}
+            for s in self.sessions.values():
+                for qos, group, flt in s.subs.values():
+                    if not topic_matches_sub(flt, topic):
+                        continue
+                    if group:
+                        groups.setdefault((group, flt), []).append((s, qos))
+                    else:   # כמה מסננים תואמים → עותק אחד, ב-QoS הגבוה (MQTT 3.1.1 §3.3.5)
+                        plain[s] = max(qos, plain.get(s, 0))
+            r = self._route[topic] = (list(plain.items()), list(groups.items()))
+        plain, groups = r
+        if not groups:
+            return plain
+        out = list(plain)
+        for g, members in groups:
+            i = self._rr.get(g, 0)
+            self._rr[g] = i + 1
+            out.append(members[i % len(members)])
+        return out
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Route one message (also used for wills and by embedding code)."""
+        self.n_in += 1
+        self.topic_in[topic] = self.topic_in.get(topic, 0) + 1
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        pkt0 = None
+        for s, sq in self.subscribers(topic):
+            q = min(qos, sq, 1)
+            if q:
+                ok = s.send(publish_packet(topic, payload, 1, False, next(s.pid)))
+            else:
+                if pkt0 is None:
+                    pkt0 = publish_packet(topic, payload)
+                ok = s.send(pkt0, droppable=True)
+            if ok:
+                self.n_out += 1
+                self.topic_out[topic] = self.topic_out.get(topic, 0) + 1
+            else:
+                self.n_dropped += 1
+
+    def _send_retained(self, sess, new):
+        """Retained messages matching the new [(filter, granted qos)], at min(stored qos, granted qos)."""
+        for t, (payload, qos) in list(self.retained.items()):
+            granted = [q for f, q in new if topic_matches_sub(f, t)]
+            if not granted:
+                continue
+            q = min(qos, max(granted))
+            if sess.send(publish_packet(t, payload, q, True, next(sess.pid) if q else 0)):
+                self.n_out += 1
+                self.topic_out[t] = self.topic_out.get(t, 0) + 1
+            else:
+                self.n_dropped += 1
+
+    # ---- חיבור לקוח ----
+    @staticmethod
+    async def _packets(reader, timeout):
+        """
+        Yield (type, flags, body) from a stream: one read() per chunk, then every
+        complete packet in it is parsed (לא await לכל בית/פקט). timeout[0] is re-read per read.
+        """
+        buf = bytearray()
+        while True:
+            pos, n_buf = 0, len(buf)
+            while n_buf - pos >= 2:
+                mult, n, k = 1, 0, pos + 1
+                while True:
+                    if k >= n_buf:
+                        n = -1
+                        break
+                    b = buf[k]; k += 1
+                    n += (b & 0x7F) * mult
+                    if not b & 0x80:
+                        break
+                    mult *= 128
+                    if mult > 128 ** 3:
+                        raise ValueError("malformed remaining length")
+                if n < 0 or k + n > n_buf:
+                    break
+                h = buf[pos]
+                yield h >> 4, h & 0x0F, bytes(buf[k:k + n])
+                pos = k + n
+            if pos:
+                del buf[:pos]
+            data = await asyncio.wait_for(reader.read(65536), timeout[0])
+            if not data:
+                raise ConnectionError("client closed")
+            buf += data
+
+    async def _client(self, reader, writer):
+        sess = None
+        clean = False
+        try:
+            timeout = [10.0]
+            packets = self._packets(reader, timeout)
+            ptype, _, body = await packets.__anext__()
+            if ptype != CONNECT:
+                return
+            r = _Reader(body)
+            r.str()                              # "MQTT" / "MQIsdp"
+            level, flags, keepalive = r.u8(), r.u8(), r.u16()
+            if level not in (3, 4):
+                writer.write(_packet(CONNACK, 0, b"\x00\x01"))   # unacceptable protocol version
+                return
+            cid = r.str() or f"anon-{id(writer):x}"
+            will = None
+            if flags & 0x04:
+                will = (r.str(), r.raw(), (flags >> 3) & 3, bool(flags & 0x20))
+            old = self.sessions.get(cid)
+            if old is not None:                  # takeover — החיבור הקודם נסגר
+                old.closed = True
+                old.writer.close()
+            sess = self.sessions[cid] = Session(cid, writer)
+            sess.will = will
+            self._invalidate()
+            writer.write(_packet(CONNACK, 0, b"\x00\x00"))
+            timeout[0] = keepalive * 1.5 if keepalive else None
+            async for ptype, pflags, body in packets:
+                if ptype == PUBLISH:
+                    r = _Reader(body)
+                    topic = r.str()
+                    qos = (pflags >> 1) & 3
+                    pid = r.u16() if qos else 0
+                    if qos == 1:
+                        writer.write(_packet(PUBACK, 0, struct.pack("!H", pid)))
+                    elif qos == 2:
+                        writer.write(_packet(PUBREC, 0, struct.pack("!H", pid)))
+                    self.publish(topic, bytes(r.rest()), min(qos, 1), bool(pflags & 1))
+                elif ptype == PUBREL:
+                    writer.write(_packet(PUBCOMP, 0, body[:2]))
+                elif ptype == SUBSCRIBE:
+                    r = _Reader(body)
+                    pid, granted, new = r.u16(), bytearray(), []
+                    while r.more():
+                        f, q = r.str(), min(r.u8() & 3, 1)
+                        group, flt = None, f
+                        if f.startswith("$share/"):
+                            _, group, flt = f.split("/", 2)
+                        sess.subs[f] = (q, group, flt)
+                        granted.append(q)
+                        new.append((flt, q))
+                    self._invalidate()
+                    writer.write(_packet(SUBACK, 0, struct.pack("!H", pid) + bytes(granted)))
+                    self._send_retained(sess, new)
+                elif ptype == UNSUBSCRIBE:
+                    r = _Reader(body)
+                    pid = r.u16()
+                    while r.more():
+                        sess.subs.pop(r.str(), None)
+                    self._invalidate()
+                    writer.write(_packet(UNSUBACK, 0, struct.pack("!H", pid)))
+                elif ptype == PINGREQ:
+                    writer.write(_packet(PINGRESP, 0))
+                elif ptype == DISCONNECT:
+                    clean = True
+                    break
+                # PUBACK / PUBREC / PUBCOMP מלקוחות — אין מה לעשות (QoS 1 למנויים: at-most-once, ראה למעלה)
+                if writer.transport.get_write_buffer_size() > WRITE_BUFFER_MAX:
+                    await writer.drain()
+        except (StopAsyncIteration, asyncio.TimeoutError, ConnectionError, ValueError, IndexError, struct.error):
+            pass
+        finally:
+            if sess is not None and self.sessions.get(sess.cid) is sess:
+                del self.sessions[sess.cid]
+                self._invalidate()
+                if sess.will and not clean:
+                    self.publish(*sess.will)
+            if sess is not None:
+                sess.closed = True
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    # ---- דוח קצבים ----
+    def rates(self, top=10):
+        """Message rates since the previous call: (in msg/s, out msg/s, [(topic, in msg/s), ...top])."""
+        now = time.monotonic()
+        t_prev, prev_in, prev_out = self._last
+        dt = max(now - t_prev, 1e-9)
+        cur = dict(self.topic_in)
+        per = sorted(((t, (n - prev_in.get(t, 0)) / dt) for t, n in cur.items()), key=lambda x: -x[1])
+        rin = (self.n_in - sum(prev_in.values())) / dt
+        rout = (self.n_out - prev_out) / dt
+        self._last = (now, cur, self.n_out)
+        return rin, rout, [p for p in per[:top] if p[1] > 0]
+
+    def stats(self):
+        return {"clients": len(self.sessions), "in": self.n_in, "out": self.n_out, "dropped": self.n_dropped,
+                "retained": len(self.retained), "topics": len(self.topic_in)}
+
+    async def _reporter(self):
+        while True:
+            await asyncio.sleep(self.report_s)
+            rin, rout, top = self.rates()
+            if not rin and not rout:
+                continue
+            s = self.stats()
+            print(f"broker|> {s['clients']} clients  in {rin:.0f} msg/s  out {rout:.0f} msg/s  "
+                  f"dropped {s['dropped']}  topics {s['topics']}", flush=True)
+            for t, r in top[:5]:
+                print(f"broker|>    {r:8.1f} msg/s  {t}", flush=True)
+
+    def register_gauges(self):
+        im.gauge("broker_clients", lambda: len(self.sessions), "connected MQTT clients")
+        im.gauge("broker_messages_in", lambda: self.n_in, "PUBLISH packets received")
+        im.gauge("broker_messages_out", lambda: self.n_out, "PUBLISH copies delivered to subscribers")
+        im.gauge("broker_messages_dropped", lambda: self.n_dropped, "QoS 0 copies dropped for slow clients")
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._client, self.host, self.port)
+        if self.report_s:
+            self.loop.create_task(self._reporter())
+        return self
+
+    async def serve(self):
+        await self.start()
+        print(f"broker|> listening on {self.host}:{self.port}", flush=True)
+        async with self.server:
+            await self.server.serve_forever()
+
+    def stop(self):
+        """Thread-safe shutdown (for start_in_thread)."""
+        if self.loop is None:
+            return
+        def _close():
+            self.server.close()
+            for s in list(self.sessions.values()):
+                s.writer.close()
+            self.loop.stop()
+        self.loop.call_soon_threadsafe(_close)
+
+def start_in_thread(host="127.0.0.1", port=None, report_s=broker_report_s) -> Broker:
+    """Run a Broker on a daemon thread; returns once it listens. Raises OSError if the port is taken."""
+    b = Broker(host, port, report_s)
+    ready, err = threading.Event(), []
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(b.start())
+        except Exception as e:
+            err.append(e)
+            ready.set()
+            return
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="mqtt-broker", daemon=True).start()
+    ready.wait(10)
+    if err:
+        raise err[0]
+    return b
+
+_EMBEDDED = None
+
+def ensure_broker():
+    """
+    When init.embedded_broker is set and the selected broker is local, start the
+    in-process broker unless another process already listens on the port.
+    """
+    global _EMBEDDED
+    try:
+        from init import embedded_broker, broker_host, broker_port as port
+    except Exception:
+        return None
+    if not embedded_broker or _EMBEDDED is not None or broker_host not in ("127.0.0.1", "localhost"):
+        return _EMBEDDED
+    try:
+        _EMBEDDED = start_in_thread("127.0.0.1", port)
+        print(f"broker|> embedded broker on 127.0.0.1:{port}")
+    except OSError:
+        pass   # כבר רץ (תהליך אחר הפעיל אותו) — מתחברים אליו כרגיל
+    return _EMBEDDED
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Minimal local MQTT 3.1.1 broker")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=broker_port)
+    ap.add_argument("--report-s", dest="report_s", type=float, default=broker_report_s)
+    ap.add_argument("--metrics-port", dest="metrics_port", type=int, default=0, help="serve /metrics (0 = off)")
+    args = ap.parse_args(argv)
+    b = Broker(args.host, args.port, args.report_s)
+    if args.metrics_port:
+        b.register_gauges()
+        im.serve(args.metrics_port)
+    try:
+        asyncio.run(b.serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -6,39 +6,119 @@ from scipy.spatial import distance
 import statistics
 import matplotlib.pyplot as plt
 import numpy as np
+from functools import lru_cache
+from collections import deque
 from data_acq import *
 from init import *
+import data_acq as da
+import instrument as im
 
 
 def thrh_comp(Y):
     ''' Used for Dynamic Threshold calculation and therein carries scattered energy info'''
     #percen_thr=0.05 # 5% of max energy holds - defined in init.py
-    return np.mean(np.sort(abs(Y))[-int(len(Y)*percen_thr):-1])
- 
+    # ממוצע ה-top 5% (בלי המקסימום) — partial selection במקום מיון מלא
+    return _topk_mean(np.abs(Y)[np.newaxis, :])[0]
+
+
+def _topk_mean(A):
+    ''' Row-wise mean of the top int(len*percen_thr) magnitudes, excluding the largest
+    (same as np.mean(np.sort(a)[-k:-1])), using np.partition instead of a full sort.'''
+    n = A.shape[-1]
+    k = int(n*percen_thr)
+    if k < 2:   # מקרה קצה — נשמרת ההתנהגות המקורית
+        return np.array([np.mean(np.sort(a)[-k:-1]) for a in A])
+    top = np.partition(A, n-k, axis=-1)[:, n-k:]
+    return (top.sum(axis=-1) - top.max(axis=-1)) / (k-1)
+
+
+@lru_cache(maxsize=8)
+def _window(kind, n):
+    ''' Cached analysis window (None = rectangular, as in the original fft_block).'''
+    if kind is None:
+        return None
+    w = {'hann': np.hanning, 'hamming': np.hamming, 'blackman': np.blackman}[kind](n)
+    w.setflags(write=False)
+    return w
+
+
+class FFTEngine:
+    ''' Batched spectrum/threshold engine for a fixed block length n.
+    Axes are stacked into one (axes, n) array and transformed with a single rfft call;
+    the window and frequency bins are computed once per engine.'''
+
+    def __init__(self, n, fs=Fs, window=None):
+        if n < 2:
+            raise ValueError(f"FFT block needs at least 2 samples per axis, got {n} "
+                             "(no vibration samples — is a vib-1 device publishing?)")
+        self.n = n
+        self.fs = fs
+        self.win = _window(window, n)
+        self.frq = np.arange(n//2) * (fs/n)  # one side frequency range
+        self.frq.setflags(write=False)
+
+    def spectrum(self, X):
+        ''' |Y(freq)| for every row of X (shape (axes, n)), normalized like fft_block.'''
+        X = np.asarray(X, dtype=float)
+        y = X - X.mean(axis=-1, keepdims=True)
+        if self.win is not None:
+            y = y * self.win
+        return np.abs(np.fft.rfft(y, axis=-1)[:, :self.n//2]) / self.n
+
+    def thresholds(self, X):
+        ''' Per-axis dynamic thresholds (×10000, as fft_block returns).'''
+        return _topk_mean(self.spectrum(X)) * 10000
+
+
+@lru_cache(maxsize=8)
+def get_engine(n, fs=Fs, window=None):
+    return FFTEngine(n, fs, window)
+
+
+class StreamingFFT:
+    ''' Overlapping-block thresholds as samples arrive: push() (axes, m) chunks and get
+    one thresholds row per completed block of `n` samples, advancing by `hop`.'''
+
+    def __init__(self, n, hop=None, axes=3, fs=Fs, window=None):
+        self.engine = get_engine(n, fs, window)
+        self.n = n
+        self.hop = hop or n//2
+        self._buf = np.empty((axes, 0))
+
+    def push(self, samples):
+        samples = np.atleast_2d(np.asarray(samples, dtype=float))
+        self._buf = np.concatenate((self._buf, samples), axis=1)
+        nblocks = 0 if self._buf.shape[1] < self.n else 1 + (self._buf.shape[1]-self.n)//self.hop
+        if not nblocks:
+            return np.empty((0, self._buf.shape[0]))
+        starts = np.arange(nblocks) * self.hop
+        # (blocks, axes, n) — כל הבלוקים בקריאת rfft אחת
+        blocks = np.stack([self._buf[:, s:s+self.n] for s in starts])
+        A = self.engine.spectrum(blocks.reshape(-1, self.n))
+        out = _topk_mean(A).reshape(nblocks, -1) * 10000
+        self._buf = self._buf[:, nblocks*self.hop:]
+        return out
+
 
 def fft_block(Xdata, isplot, issave, fname='data/AxisX_pass.png'):
     #Fs = 2048.0  # sampling rate - defined in init.py
-    Ts = 1.0/Fs # sampling interval
-    t = np.arange(0,len(Xdata)/Fs,Ts) # time vector
-    y = Xdata - np.mean(Xdata)
-    n = len(y) # length of the signal
-    k = np.arange(n)
-    T = n/Fs
-    frq = k/T # two sides frequency range    
-    frq = frq[range(int(n/2))] # one side frequency range
-    Y = np.fft.fft(y)/n # fft computing and normalization
-    Y = Y[range(int(n/2))]    
-    thrh=thrh_comp(Y)
+    eng = get_engine(len(Xdata))
+    absY = eng.spectrum(np.asarray(Xdata, dtype=float)[np.newaxis, :])[0]
+    thrh = _topk_mean(absY[np.newaxis, :])[0]
     if isplot:
+        Ts = 1.0/Fs # sampling interval
+        t = np.arange(0,len(Xdata)/Fs,Ts) # time vector
+        y = Xdata - np.mean(Xdata)
+        frq = eng.frq
         fig, ax = plt.subplots(2, 1)
         ax[0].plot(t,y)
         ax[0].set_xlabel('Time')
         ax[0].set_ylabel('Amplitude')
-        ax[1].plot(frq,abs(Y),'b',frq,thrh+abs(Y)*0,'r') # plotting the spectrum
-        ax[1].vlines([230, 240 ], 0, np.max(abs(Y)),  colors='g')
-        ax[1].vlines([ 470, 480 ], 0, np.max(abs(Y)),  colors='g')
-        ax[1].vlines([ 710, 720 ], 0, np.max(abs(Y)),  colors='g')
-        ax[1].vlines([ 565, 630 ], 0, np.max(abs(Y)),  colors='g')
+        ax[1].plot(frq,absY,'b',frq,thrh+absY*0,'r') # plotting the spectrum
+        ax[1].vlines([230, 240 ], 0, np.max(absY),  colors='g')
+        ax[1].vlines([ 470, 480 ], 0, np.max(absY),  colors='g')
+        ax[1].vlines([ 710, 720 ], 0, np.max(absY),  colors='g')
+        ax[1].vlines([ 565, 630 ], 0, np.max(absY),  colors='g')
         ax[1].set_xlabel('Freq (Hz)')
         ax[1].set_ylabel('|Y(freq)|')
         ax[0].grid(True)
@@ -48,25 +128,157 @@ def fft_block(Xdata, isplot, issave, fname='data/AxisX_pass.png'):
         plt.show()
     return thrh*10000 # 1000 - imperical normalization factor   
 
+# ------------------ מקור נתונים: דגימות ויברציה מ-iot_data ------------------
+VIB_AXES = ('AxisX', 'AxisY', 'AxisZ')
+
+def acq_data(n=None, axes=VIB_AXES, db_path=None):
+    ''' Last n samples per axis from iot_data as a DataFrame of NumPy columns (AxisX/AxisY/AxisZ).
+    Default n = acqtime*Fs. Range scans on the (metric_id, ts) key; history size does not matter.'''
+    n = int(n or acqtime*Fs)
+    conn = da.connect(db_path or da.INIT_DB_NAME)
+    try:
+        cols = {ax: da.read_samples(conn, ax, newest=n)[2] for ax in axes}
+    finally:
+        conn.close()
+    m = min(len(v) for v in cols.values())
+    return da._pd.DataFrame({ax: v[len(v)-m:] for ax, v in cols.items()})
+
+
+class SampleSource:
+    ''' Incremental reader: each read() returns only samples written since the previous call,
+    as an (axes, m) array aligned across axes (leftovers are kept for the next read).'''
+
+    def __init__(self, axes=VIB_AXES, db_path=None):
+        self.axes = axes
+        self.db_path = db_path
+        self._cursor = {ax: (-1, 0) for ax in axes}   # (last ts_ms, last id)
+        self._pending = {ax: np.empty(0) for ax in axes}
+
+    def read(self, limit=65536):
+        conn = da.connect(self.db_path or da.INIT_DB_NAME)
+        try:
+            for ax in self.axes:
+                ids, ts, vals = da.read_samples(conn, ax, after=self._cursor[ax], limit=limit)
+                if len(ids):
+                    self._cursor[ax] = (int(ts[-1]), int(ids[-1]))
+                    self._pending[ax] = np.concatenate((self._pending[ax], vals))
+        finally:
+            conn.close()
+        m = min(len(v) for v in self._pending.values())
+        out = np.vstack([self._pending[ax][:m] for ax in self.axes])
+        for ax in self.axes:
+            self._pending[ax] = self._pending[ax][m:]
+        return out
+
+
 def fft_main():
+    ''' Per-axis thresholds of the last acqtime*Fs samples; None when there are none yet.'''
     data = acq_data()
-    datapool=[  data.AxisX.to_numpy(),
-                data.AxisY.to_numpy(),
-                data.AxisZ.to_numpy()]
-    Ax_thrh=[]
-    for cnt, Xdata in enumerate(datapool):
-        Ax_thrh.append(fft_block(Xdata, isplot, issave, fname='data/Axis'+str(cnt)+'.png'))
-    return Ax_thrh
+    if len(data) < 2:
+        if im.log_on("info"):
+            ic(f"no vibration samples in iot_data yet "
+               f"({'/'.join(VIB_AXES)} — published by vib-1 devices, e.g. loadgen.py --kinds vib)")
+        return None
+    X = np.vstack([data.AxisX.to_numpy(),
+                   data.AxisY.to_numpy(),
+                   data.AxisZ.to_numpy()])
+    if isplot:
+        return [fft_block(Xdata, isplot, issave, fname='data/Axis'+str(cnt)+'.png')
+                for cnt, Xdata in enumerate(X)]
+    # שלושת הצירים בקריאת rfft אחת
+    return list(get_engine(X.shape[1]).thresholds(X))
+
+
+# ------------------ גלאי אנומליות בחלון נע ------------------
+class VibrationDetector:
+    ''' vib_dsp's Euclidean-distance / stdev test against a baseline, kept incrementally.
+    Baseline = Axes_Threshold if configured, else the mean of the last `window` normal
+    blocks, maintained with a running sum (O(axes) per block). Deviations are taken
+    relative to the baseline, so max_eucl / deviation_percentage do not depend on the
+    ×10000 scale of the thresholds.'''
+
+    def __init__(self, window=vib_window_blocks, baseline=None, warmup=3):
+        fixed = baseline if baseline is not None else Axes_Threshold
+        self.fixed = None if fixed is None else np.asarray(fixed, dtype=float)
+        self.window = window
+        self.warmup = min(warmup, window)
+        self._hist = deque()
+        self._sum = None
+        self.anomalous = False
 
+    def baseline(self):
+        if self.fixed is not None:
+            return self.fixed
+        if len(self._hist) < self.warmup:
+            return None
+        return self._sum / len(self._hist)
+
+    def _learn(self, current):
+        if self.fixed is not None:
+            return
+        self._hist.append(current)
+        self._sum = current.copy() if self._sum is None else self._sum + current
+        if len(self._hist) > self.window:
+            self._sum -= self._hist.popleft()
+
+    def update(self, current):
+        ''' Returns (is_anomaly, euclidean distance, stdev); (False, 0, 0) while warming up.'''
+        current = np.asarray(current, dtype=float)
+        base = self.baseline()
+        if base is None:
+            self._learn(current)
+            return False, 0.0, 0.0
+        rel = (current - base) / np.where(base == 0, 1.0, base)
+        d = float(np.linalg.norm(rel))
+        std = float(np.std(np.abs(rel), ddof=1)) if len(rel) > 1 else 0.0
+        bad = d > max_eucl or std*100 > deviation_percentage
+        if not bad:
+            self._learn(current)   # אנומליות לא מזהמות את ה-baseline
+        return bad, d, std
+
+
+_detector = None
 
 def vib_dsp():
+   global _detector
+   if _detector is None:
+      _detector = VibrationDetector()
    current = fft_main()
-   d = distance.euclidean(current, Axes_Threshold)
-   print("Euclidean distance: ",d)
-   std = statistics.stdev([abs(j-i) for i,j in zip(current , Axes_Threshold)])
-   print("Standard Deviation of sample is % s " 
-                % (std))
-   if d > max_eucl or std*100 > deviation_percentage:
-      return True
-   return False
-   
+   if current is None:
+      return False
+   bad, d, std = _detector.update(current)
+   if im.log_on("debug"):
+      ic(f"vibration: euclidean distance {d:.3f}, stdev {std:.3f}")
+   return bad
+
+
+def vib_verdict(client, msg):
+    ''' Publish a vibration verdict to the alarm topic (vib_alarm_publish — not SEND_EXTERNAL_ALARMS).'''
+    if vib_alarm_publish:
+        enable(client, ALARM_TOPIC, msg, retain=ALARM_RETAIN)
+    elif im.log_on("info"):
+        ic(f"[vibration verdict not published] {msg}")
+
+
+def vib_monitor(client, n=int(Fs), hop=None, poll_s=1.0, stop=None, db_path=None):
+    ''' Streaming loop: new samples -> StreamingFFT blocks -> VibrationDetector.
+    Publishes to the alarm topic on verdict changes only (manager.start_vib_monitor runs it).'''
+    src = SampleSource(db_path=db_path)
+    fft = StreamingFFT(n, hop=hop, axes=len(src.axes))
+    det = VibrationDetector()
+    while stop is None or not stop.is_set():
+        try:
+            for current in fft.push(src.read()):
+                bad, d, std = det.update(current)
+                if bad != det.anomalous:
+                    det.anomalous = bad
+                    if bad:
+                        vib_verdict(client, f"Vibration anomaly: distance {d:.2f}, deviation {std*100:.1f}%")
+                    else:
+                        vib_verdict(client, "Vibration back to normal")
+        except Exception as e:   # DB נעול / סכימה חסרה — ממשיכים בסבב הבא
+            ic(f"vib_monitor error: {e}")
+        if stop is None:
+            time.sleep(poll_s)
+        else:
+            stop.wait(poll_s)
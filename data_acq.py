@@ -1,10 +1,26 @@
 # data_acq.py — DB bootstrap & seeding (drops iot_devices on init)
 import os
+import time
+import queue
+import atexit
 import sqlite3
-from datetime import datetime
+import calendar
+import math
+import threading
+from datetime import datetime, timedelta
 from contextlib import closing
 
+import numpy as _np
+import instrument as _im   # מוני שלבים (db_enqueue / db_write)
+
 from init import db_name as INIT_DB_NAME, db_init as INIT_DB_INIT, comm_topic as COMM_TOPIC
+from init import db_batch_rows as INIT_BATCH_ROWS, db_batch_ms as INIT_BATCH_MS, db_queue_max as INIT_QUEUE_MAX
+from init import (db_journal_mode as INIT_JOURNAL_MODE, db_synchronous as INIT_SYNCHRONOUS,
+                  db_cache_size as INIT_CACHE_SIZE, db_mmap_size as INIT_MMAP_SIZE)
+from init import rollup_resolutions as INIT_ROLLUP_RES
+from init import (retention_raw_days as INIT_RET_RAW, retention_rollup_days as INIT_RET_ROLLUP,
+                  retention_alert_days as INIT_RET_ALERTS, prune_period_s as INIT_PRUNE_PERIOD,
+                  prune_chunk_rows as INIT_PRUNE_CHUNK, prune_vacuum_pages as INIT_VACUUM_PAGES)
 
 def timestamp() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -14,10 +30,18 @@ def ensure_parent_dir(path: str) -> None:
     if parent and not os.path.exists(parent):
         os.makedirs(parent, exist_ok=True)
 
+def apply_pragmas(conn: sqlite3.Connection) -> None:
+    """Per-connection tuning from init.py (journal_mode=WAL נשמר בקובץ עצמו)."""
+    conn.execute(f"PRAGMA journal_mode={INIT_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous={INIT_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size={int(INIT_CACHE_SIZE)}")
+    conn.execute(f"PRAGMA mmap_size={int(INIT_MMAP_SIZE)}")
+
 def connect(db_path: str) -> sqlite3.Connection:
     ensure_parent_dir(db_path)
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
+    apply_pragmas(conn)
     return conn
 
 DROP_IOT_DEVICES_TABLE = "DROP TABLE IF EXISTS iot_devices;"
@@ -91,6 +115,287 @@ ON CONFLICT(name) DO UPDATE SET
     special         = excluded.special
 """
 
+# ===== rollups: צבירה אינקרמנטלית לכל (metric, רזולוציה, bucket) =====
+CREATE_IOT_ROLLUPS_TABLE = """
+CREATE TABLE IF NOT EXISTS iot_rollups (
+    metric   TEXT    NOT NULL,
+    res_s    INTEGER NOT NULL,
+    bucket   TEXT    NOT NULL,     -- תחילת ה-bucket, באותו פורמט כמו iot_data.ts
+    n        INTEGER NOT NULL,
+    vmin     REAL,
+    vmax     REAL,
+    vsum     REAL,
+    vlast    REAL,
+    last_ts  TEXT,
+    PRIMARY KEY (metric, res_s, bucket)
+) WITHOUT ROWID
+"""
+
+UPSERT_ROLLUP = """
+INSERT INTO iot_rollups (metric, res_s, bucket, n, vmin, vmax, vsum, vlast, last_ts)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(metric, res_s, bucket) DO UPDATE SET
+    n       = n + excluded.n,
+    vmin    = MIN(vmin, excluded.vmin),
+    vmax    = MAX(vmax, excluded.vmax),
+    vsum    = vsum + excluded.vsum,
+    vlast   = CASE WHEN excluded.last_ts >= last_ts THEN excluded.vlast ELSE vlast END,
+    last_ts = MAX(last_ts, excluded.last_ts)
+"""
+
+def rollup_bucket(ts: str, res_s: int) -> str | None:
+    """Start of the res_s bucket holding ts ('%Y-%m-%d %H:%M:%S'); None if ts is malformed."""
+    try:
+        sec = int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + int(ts[17:19])
+    except (ValueError, TypeError):
+        return None
+    sec -= sec % res_s
+    return f"{ts[:10]} {sec // 3600:02d}:{sec % 3600 // 60:02d}:{sec % 60:02d}"
+
+def update_rollups(conn: sqlite3.Connection, rows, resolutions=INIT_ROLLUP_RES) -> int:
+    """Fold iot_data rows (ts, device_name, metric, value, units) into iot_rollups.
+    Aggregates in memory first, so one UPSERT per touched bucket. Call inside a transaction."""
+    acc = {}
+    for ts, _dev, metric, value, _units, *_ in rows:
+        if value is None:
+            continue
+        for res in resolutions:
+            b = rollup_bucket(ts, res)
+            if b is None:
+                break
+            a = acc.get((metric, res, b))
+            if a is None:
+                acc[(metric, res, b)] = [1, value, value, value, value, ts]
+            else:
+                a[0] += 1
+                if value < a[1]: a[1] = value
+                if value > a[2]: a[2] = value
+                a[3] += value
+                if ts >= a[5]:
+                    a[4] = value; a[5] = ts
+    conn.executemany(UPSERT_ROLLUP, [(m, r, b, *a) for (m, r, b), a in acc.items()])
+    return len(acc)
+
+def _fold_iot_data(conn: sqlite3.Connection, chunk: int = 5000) -> int:
+    rows_seen = 0
+    cur = conn.execute("SELECT ts, device_name, metric, value, units FROM iot_data ORDER BY id")
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            break
+        update_rollups(conn, [tuple(r) for r in rows])
+        rows_seen += len(rows)
+    return rows_seen
+
+def rebuild_rollups(conn: sqlite3.Connection, chunk: int = 5000) -> int:
+    """Recompute iot_rollups from iot_data (compaction / backfill). Streams in chunks."""
+    with conn:
+        conn.execute("DELETE FROM iot_rollups")
+        return _fold_iot_data(conn, chunk)
+
+# ===== פריסת אחסון v2: ts כ-epoch-ms שלם, metric כמזהה קטן, מפתח מקובץ (metric_id, ts) =====
+# ts_ms = מילישניות מ-1970-01-01 באותו שעון "נאיבי" (מקומי) שבו נשמר ה-TEXT הישן — בלי המרות אזור זמן.
+CREATE_METRICS_TABLE = """
+CREATE TABLE IF NOT EXISTS metrics (
+    id           INTEGER PRIMARY KEY,
+    metric       TEXT NOT NULL,
+    device_name  TEXT NOT NULL,
+    units        TEXT NOT NULL DEFAULT '',
+    UNIQUE (metric, device_name, units)
+)
+"""
+
+# id נשמר (סדר הכנסה, ייחודי) — מפריד בין קריאות באותה מילישנייה ומשמש cursor ל-export/analyzer
+CREATE_IOT_SAMPLES_TABLE = """
+CREATE TABLE IF NOT EXISTS iot_samples (
+    metric_id  INTEGER NOT NULL REFERENCES metrics(id),
+    ts_ms      INTEGER NOT NULL,
+    id         INTEGER NOT NULL,
+    value      REAL,
+    PRIMARY KEY (metric_id, ts_ms, id)
+) WITHOUT ROWID
+"""
+
+SQL_MS_TO_TS = "strftime('%Y-%m-%d %H:%M:%S', {col} / 1000, 'unixepoch')"
+SQL_TS_TO_MS = "CAST(ROUND((julianday({col}) - 2440587.5) * 86400000.0) AS INTEGER)"
+
+# view תאימות: שאילתות קיימות על iot_data (SELECT/INSERT/DELETE) ממשיכות לעבוד
+CREATE_IOT_DATA_VIEW = f"""
+CREATE VIEW IF NOT EXISTS iot_data AS
+SELECT s.id                              AS id,
+       {SQL_MS_TO_TS.format(col="s.ts_ms")} AS ts,
+       m.device_name                     AS device_name,
+       m.metric                          AS metric,
+       s.value                           AS value,
+       m.units                           AS units,
+       s.ts_ms                           AS ts_ms
+FROM iot_samples s JOIN metrics m ON m.id = s.metric_id
+"""
+
+# מונה ids מונוטוני ל-iot_samples (לא MAX(id)+1: זה חוזר על ids אחרי שה-retention מחק את החדשים ביותר,
+# וצרכנים עם cursor לפי id — export, read_samples — היו מדלגים בשקט על השורות החדשות)
+CREATE_IOT_SEQ_TABLE = """
+CREATE TABLE IF NOT EXISTS iot_seq (
+    name     TEXT PRIMARY KEY,
+    last_id  INTEGER NOT NULL
+)
+"""
+SEQ_SAMPLES = "iot_samples"
+
+CREATE_IOT_DATA_INSERT_TRIGGER = f"""
+CREATE TRIGGER IF NOT EXISTS iot_data_insert INSTEAD OF INSERT ON iot_data
+BEGIN
+    INSERT OR IGNORE INTO metrics (metric, device_name, units)
+    VALUES (NEW.metric, NEW.device_name, COALESCE(NEW.units, ''));
+    UPDATE iot_seq SET last_id = MAX(last_id + 1, COALESCE(NEW.id, 0)) WHERE name = '{SEQ_SAMPLES}';
+    INSERT INTO iot_samples (metric_id, ts_ms, id, value)
+    VALUES ((SELECT id FROM metrics WHERE metric = NEW.metric AND device_name = NEW.device_name
+                                      AND units = COALESCE(NEW.units, '')),
+            COALESCE(NEW.ts_ms, {SQL_TS_TO_MS.format(col="NEW.ts")}),
+            COALESCE(NEW.id, (SELECT last_id FROM iot_seq WHERE name = '{SEQ_SAMPLES}')),
+            NEW.value);
+END
+"""
+
+CREATE_IOT_DATA_DELETE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS iot_data_delete INSTEAD OF DELETE ON iot_data
+BEGIN
+    DELETE FROM iot_samples WHERE id = OLD.id;
+END
+"""
+
+def ts_to_ms(ts: str, _cache={}) -> int | None:
+    """'%Y-%m-%d %H:%M:%S' -> epoch ms (naive clock). Cached: readings share seconds."""
+    ms = _cache.get(ts)
+    if ms is None:
+        try:
+            ms = calendar.timegm(time.strptime(ts, "%Y-%m-%d %H:%M:%S")) * 1000
+        except (ValueError, TypeError):
+            return None
+        if len(_cache) > 4096:
+            _cache.clear()
+        _cache[ts] = ms
+    return ms
+
+def ms_to_ts(ms: int | None) -> str | None:
+    if ms is None:
+        return None
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ms // 1000))
+
+def now_ms() -> int:
+    """Current local wall-clock time as epoch ms (same clock as timestamp())."""
+    now = datetime.now()
+    return calendar.timegm(now.timetuple()) * 1000 + now.microsecond // 1000
+
+def metric_ids(conn: sqlite3.Connection, metric: str) -> list:
+    return [r[0] for r in conn.execute("SELECT id FROM metrics WHERE metric = ?", (metric,))]
+
+# מעבר מ-iot_data (TEXT) ל-iot_samples + metrics, והחלפת הטבלה ב-view
+MIGRATE_TO_V2_LAYOUT = [
+    CREATE_METRICS_TABLE,
+    CREATE_IOT_SAMPLES_TABLE,
+    """INSERT OR IGNORE INTO metrics (metric, device_name, units)
+       SELECT DISTINCT metric, device_name, COALESCE(units, '') FROM iot_data""",
+    f"""INSERT INTO iot_samples (metric_id, ts_ms, id, value)
+        SELECT m.id, {SQL_TS_TO_MS.format(col="d.ts")}, d.id, d.value
+        FROM iot_data d JOIN metrics m
+          ON m.metric = d.metric AND m.device_name = d.device_name AND m.units = COALESCE(d.units, '')""",
+    "DROP TABLE iot_data",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_iot_samples_id ON iot_samples(id)",
+    CREATE_IOT_SEQ_TABLE,
+    f"INSERT OR IGNORE INTO iot_seq (name, last_id) SELECT '{SEQ_SAMPLES}', COALESCE(MAX(id), 0) FROM iot_samples",
+    CREATE_IOT_DATA_VIEW,
+    CREATE_IOT_DATA_INSERT_TRIGGER,
+    CREATE_IOT_DATA_DELETE_TRIGGER,
+]
+
+# מיגרציות לפי PRAGMA user_version — כל שלב רץ פעם אחת, במקום, בלי DROP
+MIGRATIONS = [
+    # 1: אינדקסים לשאילתות לפי metric/device בטווח זמן
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_iot_data_metric_ts ON iot_data(metric, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_iot_data_device_ts ON iot_data(device_name, ts)",
+    ]),
+    # 2: outbox לשינויי iot_devices + cursor לכל צרכן (במקום סריקת special='changed')
+    (2, [
+        """CREATE TABLE IF NOT EXISTS device_events (
+               id         INTEGER PRIMARY KEY AUTOINCREMENT,
+               ts         TEXT NOT NULL,
+               device_id  INTEGER NOT NULL,
+               kind       TEXT
+           )""",
+        """CREATE TABLE IF NOT EXISTS event_cursors (
+               consumer   TEXT PRIMARY KEY,
+               last_id    INTEGER NOT NULL
+           )""",
+        # שורות שסומנו 'changed' לפני המיגרציה הופכות לאירועים
+        """INSERT INTO device_events (ts, device_id, kind)
+           SELECT datetime('now', 'localtime'), id, 'changed' FROM iot_devices WHERE special = 'changed'""",
+    ]),
+    # 3: טבלת rollups + מילוי מההיסטוריה הקיימת
+    (3, [
+        CREATE_IOT_ROLLUPS_TABLE,
+        _fold_iot_data,
+    ]),
+    # 4: auto_vacuum=INCREMENTAL (נכנס לתוקף רק אחרי VACUUM מלא — פעם אחת)
+    (4, [
+        "PRAGMA auto_vacuum=INCREMENTAL",
+        "VACUUM",
+    ]),
+    # 5: פריסת אחסון v2 (iot_samples + metrics), iot_data נשאר כ-view תאימות
+    (5, MIGRATE_TO_V2_LAYOUT),
+    # 6: היסטוריית התראות עם מפתח (metric, cond) + מצב נוכחי לכל מפתח (ראה alarms.AlarmEngine)
+    (6, [
+        "ALTER TABLE iot_alerts ADD COLUMN metric TEXT",
+        "ALTER TABLE iot_alerts ADD COLUMN cond TEXT",
+        "ALTER TABLE iot_alerts ADD COLUMN value REAL",
+        "CREATE INDEX IF NOT EXISTS idx_iot_alerts_metric_ts ON iot_alerts(metric, cond, ts)",
+        """CREATE TABLE IF NOT EXISTS alarm_state (
+               metric     TEXT    NOT NULL,
+               cond       TEXT    NOT NULL,
+               active     INTEGER NOT NULL,
+               since      REAL,              -- epoch sec
+               last_sent  REAL,              -- epoch sec של הפרסום האחרון (cooldown)
+               notified   INTEGER NOT NULL DEFAULT 0,
+               value      REAL,
+               PRIMARY KEY (metric, cond)
+           ) WITHOUT ROWID""",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate_schema(conn: sqlite3.Connection) -> int:
+    """Bring an existing DB up to SCHEMA_VERSION. Returns the resulting version."""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        # מנעול כתיבה לפני בדיקת הגרסה — חיבור אחר שמגר במקביל (כותב/התראות) ממתין ואז מדלג
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version <= current:
+                conn.rollback()
+                continue
+            post = []
+            for step in statements:
+                if callable(step):
+                    step(conn)        # שלב בפייתון (למשל backfill)
+                elif step == "VACUUM":
+                    post.append(step) # לא יכול לרוץ בתוך טרנזקציה
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version={int(version)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        for step in post:
+            conn.execute(step)
+        print(f"{timestamp()}  data acq|> schema migrated to v{version}")
+        current = version
+    return current
+
 def create_schema(conn: sqlite3.Connection, force_drop_iot_devices: bool) -> None:
     with conn:
         if force_drop_iot_devices:
@@ -98,11 +403,26 @@ def create_schema(conn: sqlite3.Connection, force_drop_iot_devices: bool) -> Non
         conn.execute(CREATE_IOT_DEVICES_TABLE)
         conn.execute(CREATE_IOT_DATA_TABLE)
         conn.execute(CREATE_IOT_ALERTS_TABLE)
+    migrate_schema(conn)
+
+def ensure_schema(db_path: str | None = None) -> None:
+    """Create/migrate the schema once at startup (לפני writer/watcher/pruner — לא רק בכתיבה הראשונה)."""
+    path = db_path or INIT_DB_NAME
+    ensure_parent_dir(path)
+    with closing(connect(path)) as conn:
+        create_schema(conn, force_drop_iot_devices=False)
+
+INSERT_DEVICE_EVENT = "INSERT INTO device_events (ts, device_id, kind) VALUES (?, ?, ?)"
+device_changed = threading.Event()   # השכמה בתוך אותו תהליך (ראה DeviceEventWatcher)
 
 def upsert_device(conn: sqlite3.Connection, **kw) -> int:
     with conn:
         conn.execute(INSERT_OR_REPLACE_IOT_DEVICE, kw)
-    row = conn.execute("SELECT id FROM iot_devices WHERE name = ?", (kw["name"],)).fetchone()
+        row = conn.execute("SELECT id FROM iot_devices WHERE name = ?", (kw["name"],)).fetchone()
+        if row and kw.get("special") == "changed":
+            conn.execute(INSERT_DEVICE_EVENT, (timestamp(), row["id"], "changed"))
+    if row and kw.get("special") == "changed":
+        device_changed.set()
     return int(row["id"]) if row else -1
 
 def list_devices(conn: sqlite3.Connection):
@@ -210,34 +530,638 @@ if __name__ == "__main__":
 # ==== helpers for manager.py ====
 import pandas as _pd
 
+INSERT_IOT_DATA = "INSERT INTO iot_data (ts, device_name, metric, value, units) VALUES (?, ?, ?, ?, ?)"
+# נתיב מהיר של הכותב: ישירות ל-iot_samples (בלי ה-trigger של ה-view)
+INSERT_IOT_SAMPLE = "INSERT INTO iot_samples (metric_id, ts_ms, id, value) VALUES (?, ?, ?, ?)"
+# שמירת טווח ids לאצווה שלמה — UPDATE אחד לכל commit, באותה טרנזקציה
+RESERVE_SAMPLE_IDS = f"UPDATE iot_seq SET last_id = last_id + ? WHERE name = '{SEQ_SAMPLES}'"
+SELECT_LAST_SAMPLE_ID = f"SELECT last_id FROM iot_seq WHERE name = '{SEQ_SAMPLES}'"
+
+_STOP = object()   # סימן סגירה לכותב
+
+class IOTDataWriter:
+    """
+    Background writer for iot_data: one long-lived connection owned by a
+    dedicated thread, fed by a bounded queue. Rows are flushed with
+    executemany after `batch_rows` rows or `batch_ms` ms, whichever first.
+    """
+
+    def __init__(self, db_path: str, batch_rows: int = INIT_BATCH_ROWS,
+                 batch_ms: int = INIT_BATCH_MS, max_queue: int = INIT_QUEUE_MAX):
+        self.db_path = db_path
+        self.batch_rows = max(1, int(batch_rows))
+        self.batch_s = max(0, batch_ms) / 1000.0
+        self._q = queue.Queue(maxsize=max_queue)
+        self.rows_written = 0
+        self.batches = 0
+        self.errors = 0
+        self._closed = False
+        self._metric_ids = {}   # (metric, device_name, units) -> metrics.id
+        self._callbacks = []    # on_persisted — ממתינים ל-commit הבא
+        self._thread = threading.Thread(target=self._run, name="iot-data-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, row: tuple) -> None:
+        """Enqueue one (ts, device_name, metric, value, units, ts_ms) row; blocks when the queue is full."""
+        if self._closed:
+            raise RuntimeError("IOTDataWriter is closed")
+        self._q.put(row)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until everything queued before this call is committed."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._q.put(done)
+        return done.wait(timeout)
+
+    def on_persisted(self, fn) -> None:
+        """Call fn(ok) on the writer thread once every row queued before it is committed (לא מאלץ flush)."""
+        if self._closed:
+            fn(False)
+            return
+        self._q.put(fn)
+
+    def _fire(self, ok: bool) -> None:
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(ok)
+            except Exception as e:
+                print(f"{timestamp()}  data acq|> on_persisted callback failed: {e}")
+
+    def close(self, timeout: float | None = None) -> None:
+        """Drain the queue, commit the tail and close the connection."""
+        if self._closed:
+            return
+        self._closed = True
+        self._q.put(_STOP)
+        self._thread.join(timeout)
+
+    def _metric_id(self, conn, metric: str, device_name: str, units) -> int:
+        key = (metric, device_name, units or '')
+        mid = self._metric_ids.get(key)
+        if mid is None:
+            conn.execute("INSERT OR IGNORE INTO metrics (metric, device_name, units) VALUES (?, ?, ?)", key)
+            mid = conn.execute("SELECT id FROM metrics WHERE metric = ? AND device_name = ? AND units = ?",
+                               key).fetchone()[0]
+            self._metric_ids[key] = mid
+        return mid
+
+    def _write(self, conn, batch: list) -> None:
+        if not batch:
+            if self._callbacks:
+                self._fire(True)
+            return
+        t0 = _im.now()
+        try:
+            with conn:
+                conn.execute(RESERVE_SAMPLE_IDS, (len(batch),))
+                first = conn.execute(SELECT_LAST_SAMPLE_ID).fetchone()[0] - len(batch) + 1
+                conn.executemany(INSERT_IOT_SAMPLE, [
+                    (self._metric_id(conn, metric, dev, units), ts_ms, first + i, v)
+                    for i, (_ts, dev, metric, v, units, ts_ms) in enumerate(batch)
+                ])
+                update_rollups(conn, batch)   # באותה טרנזקציה — rollups תמיד תואמים לנתונים
+            self.rows_written += len(batch)
+            self.batches += 1
+            _im.observe("db_write", _im.now() - t0)
+            _im.inc("rows_written_total", len(batch))
+            ok = True
+        except Exception as e:
+            ok = False
+            self.errors += 1
+            _im.inc("writer_errors_total")
+            self._metric_ids.clear()   # ייתכן שמזהים חדשים בוטלו ב-rollback
+            print(f"{timestamp()}  data acq|> writer error ({len(batch)} rows lost): {e}")
+        batch.clear()
+        if self._callbacks:
+            self._fire(ok)
+
+    def _run(self) -> None:
+        conn = connect(self.db_path)
+        create_schema(conn, force_drop_iot_devices=False)
+        batch, deadline = [], None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._q.get(timeout=timeout)
+                except queue.Empty:
+                    item = None   # עבר T מילישניות
+                if item is None:
+                    self._write(conn, batch); deadline = None
+                elif item is _STOP:
+                    self._write(conn, batch)
+                    break
+                elif isinstance(item, threading.Event):
+                    self._write(conn, batch); deadline = None
+                    item.set()
+                elif callable(item):
+                    self._callbacks.append(item)   # נקרא אחרי ה-commit של האצווה שהשורות שלפניו בה
+                    if not batch:
+                        self._fire(True)
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.batch_s
+                    if len(batch) >= self.batch_rows:
+                        self._write(conn, batch); deadline = None
+        finally:
+            conn.close()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer() -> IOTDataWriter:
+    """Process-wide writer for INIT_DB_NAME (נוצר בשימוש הראשון)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer._closed:
+            _writer = IOTDataWriter(INIT_DB_NAME)
+            atexit.register(_writer.close)
+            _im.gauge("writer_queue_depth", lambda: _writer._q.qsize() if _writer else 0,
+                      "rows waiting for the background DB writer")
+        return _writer
+
+def flush_IOT_data(timeout: float | None = None) -> bool:
+    """Wait until all measurements queued so far are in the DB."""
+    return _writer.flush(timeout) if _writer is not None else True
+
+def on_IOT_persisted(fn) -> None:
+    """fn(ok) once all measurements queued so far are committed (tracing — בלי לחכות ובלי לאלץ flush)."""
+    if _writer is None:
+        fn(True)
+    else:
+        _writer.on_persisted(fn)
+
+def close_IOT_writer(timeout: float | None = None) -> None:
+    """Drain and stop the background writer (לקריאה ב-shutdown)."""
+    global _writer
+    with _writer_lock:
+        w, _writer = _writer, None
+    if w is not None:
+        w.close(timeout)
+
+# ---- מטמון ערך אחרון לכל metric (מתעדכן בכל כתיבה; DB רק ב-cold start) ----
+SELECT_LATEST = "SELECT ts_ms, value FROM iot_samples WHERE metric_id = ? ORDER BY ts_ms DESC, id DESC LIMIT 1"
+
+_latest: dict = {}   # metric -> (ts, value)
+
+def get_latest(metric: str, db_path: str | None = None):
+    """Return (ts, value) of the newest reading for metric, or (None, None)."""
+    hit = _latest.get(metric)
+    if hit is not None:
+        return hit
+    best = None
+    conn = connect(db_path or INIT_DB_NAME)
+    try:
+        for mid in metric_ids(conn, metric):   # חיפוש במפתח המקובץ — O(log n) לכל מזהה
+            row = conn.execute(SELECT_LATEST, (mid,)).fetchone()
+            if row and (best is None or row[0] > best[0]):
+                best = (row[0], row[1])
+    except sqlite3.OperationalError:
+        return (None, None)   # DB חדש — הסכימה עוד לא נוצרה (לא נשמר במטמון)
+    finally:
+        conn.close()
+    hit = (ms_to_ts(best[0]), best[1]) if best else (None, None)
+    return _latest.setdefault(metric, hit)
+
+def get_latest_value(metric: str, db_path: str | None = None):
+    """Newest value for metric as float, or None."""
+    return get_latest(metric, db_path)[1]
+
 def add_IOT_data(device_name: str, ts: str, value, units: str = ''):
-    """Insert a single measurement into iot_data. metric=name for תאימות לאחור."""
+    """Queue a single measurement for iot_data. metric=name for תאימות לאחור."""
     try:
         v = float(value)
     except Exception:
         v = None
-    conn = connect(INIT_DB_NAME)
+    t0 = _im.now()
+    _latest[device_name] = (ts, v)
+    # דיוק מילישניות כש-ts הוא השנייה הנוכחית; אחרת — ה-ts שנמסר
+    ms, now = ts_to_ms(ts), now_ms()
+    if ms is None or ms == now - now % 1000:
+        ms = now
+    get_writer().put((ts, device_name, device_name, v, units, ms))
+    _im.observe("db_enqueue", _im.now() - t0)
+
+def _bound_ms(t) -> int | None:
+    """str / datetime bound -> epoch ms in the naive clock of ts_ms."""
+    if t is None:
+        return None
+    if isinstance(t, str):
+        return ts_to_ms(t)
+    return calendar.timegm(t.timetuple()) * 1000 + t.microsecond // 1000
+
+_FRAME_ROW = _np.dtype([("mid", _np.int64), ("ts", _np.int64), ("value", _np.float64)])
+
+def fetch_frame(metrics, start=None, end=None, limit: int | None = None, downsample: int = 1,
+                db_path: str | None = None) -> _pd.DataFrame:
+    """
+    Readings from iot_data with the filtering done in SQL.
+
+    metrics     one name -> columns (ts, value); several -> wide frame indexed by ts, one column each
+    start/end   ts bounds (start inclusive, end exclusive); str or datetime
+    limit       newest `limit` rows per metric (after downsampling)
+    downsample  keep every k-th row per metric
+
+    Columns are filled straight from the cursor by np.fromiter (no list of rows, no zip):
+    ts is datetime64[ms] from ts_ms, value is float64 (NULL -> NaN).
+    """
+    single = isinstance(metrics, str)
+    names = [metrics] if single else list(metrics)
+    conn = connect(db_path or INIT_DB_NAME)
+    conn.row_factory = None   # tuples — בלי אובייקט Row לכל שורה
     try:
-        with conn:
-            conn.execute(
-                "INSERT INTO iot_data (ts, device_name, metric, value, units) VALUES (?, ?, ?, ?, ?)",
-                (ts, device_name, device_name, v, units)
-            )
+        # metric_id -> מיקום ב-names; השאילתה מחזירה רק מספרים, כך שהעמודות נבנות ישר מה-cursor
+        mids = conn.execute(f"SELECT id, metric FROM metrics WHERE metric IN ({','.join('?' * len(names))})",
+                            names).fetchall()
+        where = [f"s.metric_id IN ({','.join('?' * len(mids)) or 'NULL'})"]
+        args = [mid for mid, _ in mids]
+        if start is not None:
+            where.append("s.ts_ms >= ?"); args.append(_bound_ms(start))
+        if end is not None:
+            where.append("s.ts_ms < ?"); args.append(_bound_ms(end))
+        base = (f"SELECT m.metric AS metric, s.metric_id AS mid, s.ts_ms AS ts, s.value AS value, s.id AS id "
+                f"FROM iot_samples s JOIN metrics m ON m.id = s.metric_id WHERE {' AND '.join(where)}")
+        cols = "mid, ts, COALESCE(value, 'nan')"   # NULL -> NaN בתוך float64
+        k = max(1, int(downsample or 1))
+        if k == 1 and not limit:
+            sql = f"SELECT {cols} FROM ({base}) ORDER BY metric, ts, id"
+        else:
+            sql = (f"WITH r AS (SELECT metric, mid, ts, value, id, "
+                   f"ROW_NUMBER() OVER (PARTITION BY metric ORDER BY ts, id) - 1 AS rn FROM ({base})), "
+                   f"d AS (SELECT metric, mid, ts, value, id, "
+                   f"ROW_NUMBER() OVER (PARTITION BY metric ORDER BY ts DESC, id DESC) AS rk "
+                   f"FROM r WHERE rn % ? = 0) "
+                   f"SELECT {cols} FROM d WHERE rk <= ? ORDER BY metric, ts, id")
+            args += [k, int(limit) if limit else 2**63 - 1]
+        rec = _np.fromiter(conn.execute(sql, args), dtype=_FRAME_ROW)
     finally:
         conn.close()
 
+    ts = rec["ts"].astype("datetime64[ms]")
+    if single:
+        return _pd.DataFrame({"ts": ts, "value": rec["value"]})
+    name_of = dict(mids)
+    keys = _np.array(sorted(name_of), dtype=_np.int64)
+    code_of = _np.array([names.index(name_of[mid]) for mid in keys], dtype=_np.int64)
+    codes = code_of[_np.searchsorted(keys, rec["mid"])] if len(rec) else _np.empty(0, dtype=_np.int64)
+    long = _pd.DataFrame({"metric": _pd.Categorical.from_codes(codes, categories=names),
+                          "ts": ts, "value": rec["value"]})
+    wide = long.pivot_table(index="ts", columns="metric", values="value", aggfunc="last", observed=False)
+    return wide.reindex(columns=names)
+
 def fetch_data(db_path: str, table_alias: str, metric: str) -> _pd.DataFrame:
-    """Return a DataFrame of (ts, value) for given metric from iot_data."""
-    conn = connect(INIT_DB_NAME)
+    """Return a DataFrame of (ts, value) for given metric from iot_data at db_path.
+
+    Changed from the original:
+    - ts is datetime64[ms] (it was the TEXT 'YYYY-mm-dd HH:MM:SS' string). Callers that
+      need the old strings can use df.ts.dt.strftime('%Y-%m-%d %H:%M:%S').
+    - table_alias is ignored (it is kept for backward compatibility); readings always live in iot_data.
+    - db_path is honoured (the original always read INIT_DB_NAME).
+    """
+    return fetch_frame(metric, db_path=db_path or None)
+
+# ---- outbox לשינויי התקנים: כתיבה + אירוע באותה טרנזקציה, המנהל קורא רק מעבר ל-cursor ----
+
+def update_device(name: str, db_path: str | None = None, **fields) -> int:
+    """Update iot_devices columns for `name` and record a change event atomically.
+    Returns the new event id (or -1 if the device does not exist)."""
+    cols = [c for c in fields if c not in ("id", "name")]
+    conn = connect(db_path or INIT_DB_NAME)
     try:
+        with conn:
+            row = conn.execute("SELECT id FROM iot_devices WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return -1
+            sets = ", ".join(f"{c} = ?" for c in cols + ["special", "last_updated"])
+            conn.execute(f"UPDATE iot_devices SET {sets} WHERE id = ?",
+                         [fields[c] for c in cols] + ["changed", timestamp(), row["id"]])
+            cur = conn.execute(INSERT_DEVICE_EVENT, (timestamp(), row["id"], "changed"))
+            event_id = cur.lastrowid
+    finally:
+        conn.close()
+    device_changed.set()
+    return event_id
+
+def fetch_device_events(consumer: str, limit: int = 500, db_path: str | None = None):
+    """Return (rows, last_event_id): changed devices with events past the consumer's cursor.
+    Several events for one device collapse to its current row."""
+    conn = connect(db_path or INIT_DB_NAME)
+    try:
+        cur = conn.execute("SELECT last_id FROM event_cursors WHERE consumer = ?", (consumer,)).fetchone()
+        last_id = cur["last_id"] if cur else 0
         rows = conn.execute(
-            "SELECT ts, value FROM iot_data WHERE metric = ? ORDER BY ts ASC",
-            (metric,)
+            "SELECT e.id AS event_id, d.* FROM device_events e "
+            "LEFT JOIN iot_devices d ON d.id = e.device_id "
+            "WHERE e.id > ? ORDER BY e.id LIMIT ?",
+            (last_id, limit)
         ).fetchall()
-        df = _pd.DataFrame([dict(r) for r in rows]) if rows else _pd.DataFrame(columns=['ts','value'])
-        return df
     finally:
         conn.close()
+    if not rows:
+        return [], last_id
+    latest = {}
+    for r in rows:
+        if r["id"] is not None:
+            latest[r["id"]] = dict(r)
+    return list(latest.values()), rows[-1]["event_id"]
+
+def ack_device_events(consumer: str, last_event_id: int, device_ids, db_path: str | None = None) -> None:
+    """Advance the consumer's cursor and clear 'special' on handled devices — one transaction."""
+    now = timestamp()
+    conn = connect(db_path or INIT_DB_NAME)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO event_cursors (consumer, last_id) VALUES (?, ?) "
+                "ON CONFLICT(consumer) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)",
+                (consumer, last_event_id)
+            )
+            conn.executemany(
+                "UPDATE iot_devices SET special = '', last_updated = ? WHERE id = ?",
+                [(now, int(i)) for i in device_ids]
+            )
+    finally:
+        conn.close()
+
+# ---- התראות: היסטוריה + מצב (נכתבים באצווה ע"י alarms.AlarmEngine.flush) ----
+INSERT_ALERT = "INSERT INTO iot_alerts (ts, level, message, metric, cond, value) VALUES (?, ?, ?, ?, ?, ?)"
+UPSERT_ALARM_STATE = """
+INSERT INTO alarm_state (metric, cond, active, since, last_sent, notified, value)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(metric, cond) DO UPDATE SET
+    active = excluded.active, since = excluded.since, last_sent = excluded.last_sent,
+    notified = excluded.notified, value = excluded.value
+"""
+
+def save_alarms(history, states, db_path: str | None = None) -> None:
+    """history: [(ts, level, message, metric, cond, value)], states: [(metric, cond, active, since,
+    last_sent, notified, value)] — שתיהן בטרנזקציה אחת."""
+    if not history and not states:
+        return
+    conn = connect(db_path or INIT_DB_NAME)
+    try:
+        with conn:   # הסכימה כבר קיימת (AlarmEngine → ensure_schema פעם אחת)
+            conn.executemany(INSERT_ALERT, history)
+            conn.executemany(UPSERT_ALARM_STATE, states)
+    finally:
+        conn.close()
+
+def load_alarm_state(db_path: str | None = None) -> list:
+    """All rows of alarm_state (empty list on a DB without the table yet)."""
+    conn = connect(db_path or INIT_DB_NAME)
+    try:
+        return [dict(r) for r in conn.execute("SELECT * FROM alarm_state")]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+def fetch_alerts(metric: str | None = None, limit: int = 100, db_path: str | None = None) -> list:
+    """Newest alert transitions first (optionally for one metric)."""
+    conn = connect(db_path or INIT_DB_NAME)
+    try:
+        if metric:
+            rows = conn.execute("SELECT * FROM iot_alerts WHERE metric = ? ORDER BY id DESC LIMIT ?",
+                                (metric, limit))
+        else:
+            rows = conn.execute("SELECT * FROM iot_alerts ORDER BY id DESC LIMIT ?", (limit,))
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
+class DeviceEventWatcher:
+    """
+    Block until a new device event exists. Wakes immediately for writes from
+    this process (device_changed) and notices other processes' commits through
+    PRAGMA data_version, checking MAX(id) only when something was committed.
+    """
+
+    def __init__(self, db_path: str | None = None, poll_s: float = 0.05):
+        self.poll_s = poll_s
+        self.conn = sqlite3.connect(db_path or INIT_DB_NAME, check_same_thread=False)
+        self._version = None
+        self.seen_id = self._max_id()
+
+    def _max_id(self) -> int:
+        try:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM device_events").fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0   # הטבלה עוד לא נוצרה
+
+    def _changed(self) -> bool:
+        v = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if v == self._version and not device_changed.is_set():
+            return False
+        self._version = v
+        device_changed.clear()
+        m = self._max_id()
+        if m > self.seen_id:
+            self.seen_id = m
+            return True
+        return False
+
+    def wait(self, timeout: float) -> bool:
+        """True if new events arrived within timeout seconds."""
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            if self._changed():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            device_changed.wait(min(self.poll_s, remaining))
+
+    def close(self) -> None:
+        self.conn.close()
+
+def _ts_str(t) -> str | None:
+    if t is None or isinstance(t, str):
+        return t
+    return t.strftime("%Y-%m-%d %H:%M:%S")
+
+def _wanted_s(start, end, resolution_s=None, max_points=None) -> float | None:
+    """Requested bucket width (sec): resolution_s, else (end-start)/max_points."""
+    if resolution_s is None and max_points and start is not None and end is not None:
+        t0 = datetime.strptime(_ts_str(start), "%Y-%m-%d %H:%M:%S")
+        t1 = datetime.strptime(_ts_str(end), "%Y-%m-%d %H:%M:%S")
+        return (t1 - t0).total_seconds() / max_points
+    return resolution_s
+
+def pick_resolution(start, end, resolution_s=None, max_points=None, resolutions=INIT_ROLLUP_RES) -> int:
+    """Coarsest rollup resolution (sec) that is still fine enough; 0 = raw iot_data."""
+    want = _wanted_s(start, end, resolution_s, max_points)
+    if not want:
+        return 0
+    fits = [r for r in resolutions if r <= want]
+    return max(fits) if fits else 0
+
+def fetch_history(metric: str, start=None, end=None, resolution_s=None, max_points=None,
+                  db_path: str | None = None) -> _pd.DataFrame:
+    """
+    History of one metric as columns (ts, min, max, avg, count, last), read from the
+    coarsest rollup that satisfies resolution_s (or (end-start)/max_points).
+    When the wanted width is k >= 2 rollup buckets (e.g. days over the 1h rollup), k buckets
+    are merged in SQL into epoch-aligned buckets of k*res — max_points is honoured (+1 for a
+    partial bucket at each edge). Falls back to raw iot_data rows (count=1) below the finest rollup.
+    """
+    res = pick_resolution(start, end, resolution_s, max_points)
+    lo, hi = _ts_str(start) or "", _ts_str(end) or "9999"
+    if res:
+        where = "WHERE metric = ? AND res_s = ? AND bucket >= ? AND bucket <= ?"
+        args = (metric, res, rollup_bucket(lo, res) or lo, hi)
+        want = _wanted_s(start, end, resolution_s, max_points) / res
+        k = int(want) if resolution_s is not None else math.ceil(want)   # max_points: לא יותר נקודות מהמבוקש
+        if k < 2:
+            sql = f"SELECT bucket, vmin, vmax, vsum / n, n, vlast FROM iot_rollups {where} ORDER BY bucket"
+        else:
+            # vlast ליד MAX(bucket): ב-SQLite עמודה "חשופה" נלקחת מהשורה של ה-MAX — ה-last של הבאקט האחרון
+            sql = ("SELECT strftime('%Y-%m-%d %H:%M:%S', g, 'unixepoch'), MIN(vmin), MAX(vmax), "
+                   "SUM(vsum) / SUM(n), SUM(n), vlast, MAX(bucket) FROM "
+                   f"(SELECT CAST(strftime('%s', bucket) AS INTEGER) / ? * ? AS g, * FROM iot_rollups {where}) "
+                   "GROUP BY g ORDER BY g")
+            args = (k * res, k * res) + args
+    else:
+        sql = (f"SELECT {SQL_MS_TO_TS.format(col='s.ts_ms')}, s.value, s.value, s.value, 1, s.value "
+               "FROM iot_samples s JOIN metrics m ON m.id = s.metric_id "
+               "WHERE m.metric = ? AND s.ts_ms >= ? AND s.ts_ms < ? ORDER BY s.ts_ms, s.id")
+        args = (metric, ts_to_ms(lo) if lo else 0, ts_to_ms(hi) + 1000 if len(hi) == 19 else 2**63 - 1)
+    conn = connect(db_path or INIT_DB_NAME)
+    try:
+        rows = conn.execute(sql, args).fetchall()
+    finally:
+        conn.close()
+    cols = ["ts", "min", "max", "avg", "count", "last"]
+    if not rows:
+        return _pd.DataFrame(columns=cols)
+    return _pd.DataFrame(dict(zip(cols, zip(*rows))))
+
+# ---- retention: מחיקה בטרנזקציות קטנות + incremental VACUUM ----
+
+def _cutoff(now: datetime, days) -> str:
+    return (now - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+def _delete_chunked(conn, sql: str, args: tuple, chunk: int) -> int:
+    """Run a 'DELETE ... LIMIT ?'-style statement until it stops matching; one short transaction per chunk."""
+    total = 0
+    while True:
+        with conn:
+            n = conn.execute(sql, args + (chunk,)).rowcount
+        total += n
+        if n < chunk:
+            return total
+        time.sleep(0)   # לתת לכותב לתפוס את המנעול בין צ'אנקים
+
+def prune_expired(db_path: str | None = None, now: datetime | None = None,
+                  chunk: int = INIT_PRUNE_CHUNK, vacuum_pages: int = INIT_VACUUM_PAGES) -> dict:
+    """Delete rows past their retention (per metric / per rollup resolution / alerts),
+    then reclaim pages with incremental VACUUM. Returns a report dict."""
+    now = now or datetime.now()
+    t0 = time.perf_counter()
+    report = {"iot_data": 0, "iot_rollups": 0, "iot_alerts": 0, "device_events": 0}
+    conn = connect(db_path or INIT_DB_NAME)
+    try:
+        for mid, metric in conn.execute("SELECT id, metric FROM metrics").fetchall():
+            days = INIT_RET_RAW.get(metric, INIT_RET_RAW.get("*"))
+            if days is None:
+                continue
+            report["iot_data"] += _delete_chunked(conn,
+                "DELETE FROM iot_samples WHERE (metric_id, ts_ms, id) IN "
+                "(SELECT metric_id, ts_ms, id FROM iot_samples WHERE metric_id = ? AND ts_ms < ? LIMIT ?)",
+                (mid, ts_to_ms(_cutoff(now, days))), chunk)
+
+        rolled = [r[0] for r in conn.execute("SELECT DISTINCT metric FROM iot_rollups")]
+        for res, days in INIT_RET_ROLLUP.items():
+            for metric in rolled:
+                report["iot_rollups"] += _delete_chunked(conn,
+                    "DELETE FROM iot_rollups WHERE (metric, res_s, bucket) IN "
+                    "(SELECT metric, res_s, bucket FROM iot_rollups "
+                    " WHERE metric = ? AND res_s = ? AND bucket < ? LIMIT ?)",
+                    (metric, int(res), _cutoff(now, days)), chunk)
+
+        if INIT_RET_ALERTS is not None:
+            report["iot_alerts"] = _delete_chunked(conn,
+                "DELETE FROM iot_alerts WHERE id IN "
+                "(SELECT id FROM iot_alerts WHERE ts < ? ORDER BY id LIMIT ?)",
+                (_cutoff(now, INIT_RET_ALERTS),), chunk)
+
+        # אירועים שכל הצרכנים כבר אישרו
+        acked = conn.execute("SELECT MIN(last_id) FROM event_cursors").fetchone()[0]
+        if acked:
+            report["device_events"] = _delete_chunked(conn,
+                "DELETE FROM device_events WHERE id IN "
+                "(SELECT id FROM device_events WHERE id <= ? ORDER BY id LIMIT ?)",
+                (acked,), chunk)
+
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if vacuum_pages:
+            # executescript מריץ את ה-pragma עד הסוף (execute משחרר עמוד אחד בלבד)
+            conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)});")
+        free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+    report["bytes_reclaimed"] = (free_before - free_after) * page_size
+    report["seconds"] = time.perf_counter() - t0
+    return report
+
+class RetentionPruner(threading.Thread):
+    """Background thread: prune_expired() every `period` seconds until stop()."""
+
+    def __init__(self, db_path: str | None = None, period: float = INIT_PRUNE_PERIOD):
+        super().__init__(name="iot-retention", daemon=True)
+        self.db_path = db_path
+        self.period = period
+        self.last_report = None
+        self._stop_evt = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_evt.is_set():
+            try:
+                r = prune_expired(self.db_path)
+                self.last_report = r
+                rows = r["iot_data"] + r["iot_rollups"] + r["iot_alerts"] + r["device_events"]
+                print(f"{timestamp()}  data acq|> retention: {rows} rows "
+                      f"(data {r['iot_data']}, rollups {r['iot_rollups']}, alerts {r['iot_alerts']}, "
+                      f"events {r['device_events']}), {r['bytes_reclaimed'] / 1024:.0f} KiB reclaimed "
+                      f"in {r['seconds']:.2f}s")
+            except Exception as e:
+                print(f"{timestamp()}  data acq|> retention error: {e}")
+            self._stop_evt.wait(self.period)
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop_evt.set()
+        self.join(timeout)
+
+def read_samples(conn: sqlite3.Connection, metric: str, newest: int | None = None,
+                 after: tuple = (-1, 0), limit: int = 65536):
+    """
+    Raw samples of one metric as NumPy arrays (ids, ts_ms, values), in time order.
+    newest=n -> the last n samples; otherwise samples strictly after the (ts_ms, id) cursor.
+    Each query is a range scan on the (metric_id, ts_ms) clustered key.
+    """
+    parts = []
+    for mid in metric_ids(conn, metric):
+        if newest:
+            rows = conn.execute("SELECT id, ts_ms, value FROM iot_samples WHERE metric_id = ? "
+                                "ORDER BY ts_ms DESC, id DESC LIMIT ?", (mid, int(newest))).fetchall()
+        else:
+            rows = conn.execute("SELECT id, ts_ms, value FROM iot_samples WHERE metric_id = ? "
+                                "AND (ts_ms, id) > (?, ?) ORDER BY ts_ms, id LIMIT ?",
+                                (mid, after[0], after[1], int(limit))).fetchall()
+        parts.append(rows)
+    rows = [r for p in parts for r in p]
+    n = len(rows)
+    ids = _np.fromiter((r[0] for r in rows), dtype=_np.int64, count=n)
+    ts = _np.fromiter((r[1] for r in rows), dtype=_np.int64, count=n)
+    vals = _np.fromiter((_np.nan if r[2] is None else r[2] for r in rows), dtype=_np.float64, count=n)
+    order = _np.lexsort((ids, ts))
+    if newest:
+        order = order[-int(newest):]
+    return ids[order], ts[order], vals[order]
 
 def check_changes(table_name: str = 'iot_devices'):
     """Return devices marked as changed."""
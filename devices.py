@@ -0,0 +1,174 @@
+# devices.py — emulated proofing devices: payload formats + value models (GUI-free)
+#
+# מקור יחיד לפורמט ההודעות — emulators_gui.py (חלונות Tk) ו-loadgen.py (headless) משתמשים באותן פונקציות.
+#   env    -> "From: AirEnv Temperature: <t> Humidity: <h>"
+#   dough  -> "Dough Moisture: <m>"
+#   rise   -> "Dough Rise: <r>"
+#   timer  -> "Timer remaining: <sec>"  ובסוף  "Oven Ready: 1"
+#   vib    -> "From: Vibration AxisX: <v>,<v>,... AxisY: ... AxisZ: ..."  (VIB_BLOCK דגימות לציר ב-Fs, ל-dataAnalyzer)
+
+import math
+import random
+
+try:
+    from init import comm_topic
+except Exception:
+    comm_topic = "pr/Proofing/BakeryA/"
+try:
+    from init import Fs as VIB_FS
+except Exception:
+    VIB_FS = 2048.0
+
+TOPIC_BASE = comm_topic.rstrip("/")
+TOPIC_ROOT, HOME_ROOM = TOPIC_BASE.rsplit("/", 1)
+
+DEVICE_SEGMENTS = {"env": "env-1", "dough": "doughH-1", "rise": "rise-1", "timer": "timer-1", "vib": "vib-1"}
+VIB_BLOCK = 256   # דגימות לציר בכל הודעה
+PUB_EVERY_S = {"env": 2.0, "dough": 2.0, "rise": 2.0, "timer": 1.0,   # כמו pub_every_ms של החלונות
+               "vib": VIB_BLOCK / VIB_FS}                            # קצב הדגימה קבוע (Fs)
+VIB_TONES = ((235.0, 1.0), (475.0, 0.5), (715.0, 0.25))   # Hz, משרעת — הפסים המסומנים ב-fft_block
+VIB_GAIN = {"AxisX": 1.0, "AxisY": 0.8, "AxisZ": 0.6}
+
+# ------------------ פורמט הודעות ------------------
+def env_payload(temp, hum):
+    return f"From: AirEnv Temperature: {temp} Humidity: {hum}"
+
+def dough_payload(m):
+    return f"Dough Moisture: {m}"
+
+def rise_payload(r):
+    return f"Dough Rise: {r}"
+
+def timer_payload(rem):
+    return f"Timer remaining: {rem}"
+
+OVEN_READY = "Oven Ready: 1"
+
+def vib_payload(axes):
+    """{'AxisX': [v, ...], ...} -> 'From: Vibration AxisX: v,v,... AxisY: ... AxisZ: ...'."""
+    return "From: Vibration " + " ".join(f"{ax}: " + ",".join(f"{v:.4f}" for v in vals)
+                                         for ax, vals in axes.items())
+
+def device_topic(kind, room=None):
+    """'env', 'BakeryB' -> 'pr/Proofing/BakeryB/env-1/pub'."""
+    return f"{TOPIC_ROOT}/{room or HOME_ROOM}/{DEVICE_SEGMENTS[kind]}/pub"
+
+# ------------------ מודל ערכים ------------------
+class Walk:
+    """Mean-reverting random walk clipped to [lo, hi]: v += theta*(mu - v) + N(0, sigma)."""
+
+    __slots__ = ("v", "mu", "sigma", "theta", "lo", "hi")
+
+    def __init__(self, mu, sigma, theta=0.05, lo=float("-inf"), hi=float("inf")):
+        self.v, self.mu, self.sigma, self.theta, self.lo, self.hi = mu, mu, sigma, theta, lo, hi
+
+    def step(self, rnd):
+        v = self.v + self.theta * (self.mu - self.v) + rnd.gauss(0.0, self.sigma)
+        self.v = min(self.hi, max(self.lo, v))
+        return self.v
+
+class Excursion:
+    """
+    Scenario step: add `delta` to `field` for rooms in the first `frac` of the
+    room list, from start_s for dur_s seconds (0 = until the end). every_s > 0
+    toggles the excursion on/off with that period (flapping).
+    """
+
+    __slots__ = ("field", "delta", "start_s", "dur_s", "frac", "every_s")
+
+    def __init__(self, field, delta, start_s=0.0, dur_s=0.0, frac=1.0, every_s=0.0):
+        self.field, self.delta, self.start_s, self.dur_s = field, float(delta), float(start_s), float(dur_s)
+        self.frac, self.every_s = float(frac), float(every_s)
+
+    def offset(self, t):
+        if t < self.start_s or (self.dur_s and t >= self.start_s + self.dur_s):
+            return 0.0
+        if self.every_s and int((t - self.start_s) // self.every_s) % 2:
+            return 0.0
+        return self.delta
+
+# תרחישי חריגה מוכנים (python loadgen.py --scenario heatwave)
+SCENARIOS = {
+    "steady":   [],
+    "heatwave": [Excursion("temp", +6.0, start_s=20, dur_s=120, frac=0.25)],
+    "dry":      [Excursion("moist", -12.0, start_s=20, dur_s=120, frac=0.25)],
+    "flap":     [Excursion("temp", +2.5, start_s=10, frac=0.10, every_s=15)],
+    "mixed":    [Excursion("temp", +6.0, start_s=20, dur_s=90, frac=0.10),
+                 Excursion("hum", -15.0, start_s=60, dur_s=90, frac=0.10),
+                 Excursion("moist", +10.0, start_s=40, dur_s=60, frac=0.05)],
+    "bearing":  [Excursion("amp", +2.0, start_s=30, dur_s=60, frac=0.25)],   # ויברציה (kind vib)
+}
+
+class Device:
+    """One emulated device: kind + room + value model. step(t) -> [payload, ...]."""
+
+    __slots__ = ("kind", "room", "topic", "period", "next_due", "walks", "excursions", "rem", "sent", "k")
+
+    def __init__(self, kind, room, period=None, excursions=(), timer_s=900):
+        self.kind, self.room = kind, room
+        self.topic = device_topic(kind, room)
+        # vib: מחזור = VIB_BLOCK/Fs תמיד — אחרת הדגימות לא במרווח 1/Fs
+        self.period = float(PUB_EVERY_S[kind] if kind == "vib" else (period or PUB_EVERY_S[kind]))
+        self.k = 0   # vib: אינדקס הדגימה הבאה (פאזה רציפה בין הודעות)
+        self.next_due = 0.0
+        self.excursions = list(excursions)   # [(field, Excursion)] שחלים על החדר הזה
+        self.sent = 0
+        self.rem = timer_s
+        # ערכי התחלה = ברירות המחדל של חלונות ה-GUI
+        if kind == "env":
+            self.walks = {"temp": Walk(30.0, 0.15, lo=-10, hi=60), "hum": Walk(78.0, 0.4, lo=0, hi=100)}
+        elif kind == "dough":
+            self.walks = {"moist": Walk(60.0, 0.3, lo=0, hi=100)}
+        elif kind == "rise":
+            self.walks = {"rise": Walk(40.0, 0.0, theta=0.0, lo=0, hi=100)}
+        elif kind == "vib":
+            self.walks = {"amp": Walk(1.0, 0.01, lo=0, hi=10)}
+        else:
+            self.walks = {}
+
+    def _value(self, field, t, rnd):
+        v = self.walks[field].step(rnd)
+        for f, ex in self.excursions:
+            if f == field:
+                v += ex.offset(t)
+        return v
+
+    def step(self, t, rnd):
+        if self.kind == "env":
+            return [env_payload(f"{self._value('temp', t, rnd):.1f}", f"{self._value('hum', t, rnd):.0f}")]
+        if self.kind == "dough":
+            return [dough_payload(f"{self._value('moist', t, rnd):.0f}")]
+        if self.kind == "rise":
+            w = self.walks["rise"]
+            w.v = 0.0 if w.v >= 100.0 else w.v + rnd.uniform(0.0, 0.5)   # תפיחה עולה; מחזור חדש אחרי 100%
+            return [rise_payload(f"{self._value('rise', t, rnd):.0f}")]
+        if self.kind == "vib":
+            return [vib_payload(self._vib_block(t, rnd))]
+        # timer: ספירה לאחור לפי הזמן שעבר; ב-0 "Oven Ready" ומחזור חדש
+        out = [timer_payload(max(0, int(self.rem)))]
+        self.rem -= self.period
+        if self.rem <= 0:
+            out.append(OVEN_READY)
+            self.rem = 900
+        return out
+
+    def _vib_block(self, t, rnd):
+        amp = self._value("amp", t, rnd)
+        ts = [(self.k + i) / VIB_FS for i in range(VIB_BLOCK)]
+        self.k += VIB_BLOCK
+        base = [sum(a * math.sin(2 * math.pi * f * x) for f, a in VIB_TONES) for x in ts]
+        return {ax: [g * amp * b + rnd.gauss(0.0, 0.05) for b in base] for ax, g in VIB_GAIN.items()}
+
+def build_devices(rooms, kinds=("env", "dough", "rise", "timer"), period=None, scenario="steady", seed=0):
+    """Devices for every (room, kind); the scenario's excursions hit the first `frac` of the rooms."""
+    steps = SCENARIOS[scenario]
+    rnd = random.Random(seed)
+    out = []
+    n = len(rooms)
+    for i, room in enumerate(rooms):
+        hits = [(ex.field, ex) for ex in steps if i < ex.frac * n]
+        for kind in kinds:
+            d = Device(kind, room, period=period, excursions=hits)
+            d.next_due = rnd.uniform(0.0, d.period)   # פיזור — לא כל המכשירים באותו רגע
+            out.append(d)
+    return out
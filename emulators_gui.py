@@ -4,19 +4,20 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import queue, time
-import paho.mqtt.client as mqtt
+
+from mqtt_mux import get_mux                # חיבור MQTT אחד משותף לכל החלונות
+import devices as dv                        # פורמט ההודעות (משותף עם loadgen.py)
+import tracing                              # trace_enabled: חותמת seq + זמן שליחה לכל הודעה
+
+STAMPER = tracing.Stamper()
 
 # ===== ברירת מחדל/ייבוא הגדרות =====
 try:
-    from init import broker_ip, broker_port, comm_topic
+    from init import comm_topic   # broker/port — ב-mqtt_mux (get_mux)
 except Exception:
-    broker_ip  = "broker.hivemq.com"
-    broker_port = "1883"
     comm_topic = "pr/Proofing/BakeryA/"
 
 TOPIC_BASE   = comm_topic.rstrip("/")
-BROKER_HOST  = broker_ip
-BROKER_PORT  = int(str(broker_port))
 
 DEFAULT_TOPICS = {
     "env":   f"{TOPIC_BASE}/env-1/pub",
@@ -26,19 +27,6 @@ DEFAULT_TOPICS = {
     "alarm": f"{TOPIC_BASE}/alarm",
 }
 
-# ---------- MQTT utils ----------
-def make_client(client_id: str, on_message=None, on_log=None):
-    client = mqtt.Client(
-        client_id=client_id,
-        clean_session=True,
-        protocol=mqtt.MQTTv311,
-        transport="tcp",
-        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
-    )
-    if on_message: client.on_message = on_message
-    if on_log:     client.on_log     = on_log
-    return client
-
 # ---------- Base window ----------
 class BaseWindow(tk.Toplevel):
     def __init__(self, root, title="IOT Emulator", size="340x220", default_topic=""):
@@ -46,8 +34,10 @@ class BaseWindow(tk.Toplevel):
         self.title(title); self.geometry(size); self.resizable(False, False)
         self.configure(padx=10, pady=10)
 
-        # מצב פנימי
+        # מצב פנימי — self.mux משותף לכל החלונות (חיבור TCP + thread רשת אחד לתהליך)
+        self.mux = get_mux()
         self.client = None
+        self._subs = []   # מסננים שהחלון נרשם אליהם (לביטול ב-on_close)
         self.connected = False
         self.enabled = False
         self.pub_every_ms = 2000
@@ -82,11 +72,8 @@ class BaseWindow(tk.Toplevel):
     def connect(self):
         if self.connected:
             return
-        self.client = make_client(f"{self.title()}-{int(time.time()*1000)%10000}",
-                                  on_message=self._on_message, on_log=self._on_log)
         try:
-            self.client.connect(BROKER_HOST, BROKER_PORT, keepalive=60)
-            self.client.loop_start()
+            self.client = self.mux.acquire()
             self.connected = True
         except Exception as e:
             messagebox.showerror("MQTT", f"Connect failed: {e}")
@@ -103,21 +90,27 @@ class BaseWindow(tk.Toplevel):
 
     def publish(self, topic, payload):
         if self.connected:
-            self.client.publish(topic, payload)
+            self.mux.publish(topic, STAMPER.stamp(topic, payload))
 
-    def _on_message(self, client, userdata, msg):  # למנויים בלבד
-        pass
+    def subscribe(self, topic):
+        # ה-mux מנתב לחלון רק הודעות שתואמות את המסנן שלו
+        if self.connected and topic not in self._subs:
+            self.mux.subscribe(topic, self._on_message)
+            self._subs.append(topic)
 
-    def _on_log(self, client, userdata, level, buf):
+    def _on_message(self, client, userdata, msg):  # למנויים בלבד
         pass
 
     def on_close(self):
         try: self.on_disabled()
         except: pass
         try:
-            if self.client:
-                self.client.loop_stop()
-                self.client.disconnect()
+            for topic in self._subs:
+                self.mux.unsubscribe(topic, self._on_message)
+            self._subs = []
+            if self.connected:
+                self.mux.release()   # החלון האחרון שנסגר סוגר את החיבור
+                self.connected = False
         except: pass
         self.destroy()
 
@@ -139,7 +132,7 @@ class AirEnvWindow(BaseWindow):
             topic = self.topic
             temp = self.e_temp.get().strip()
             hum  = self.e_hum.get().strip()
-            msg  = f"From: AirEnv Temperature: {temp} Humidity: {hum}"
+            msg  = dv.env_payload(temp, hum)
             self.publish(topic, msg)
             self._after_job = self.after(self.pub_every_ms, tick)
         tick()
@@ -157,7 +150,7 @@ class DoughMoistureWindow(BaseWindow):
         def tick():
             topic = self.topic
             m = self.e_val.get().strip()
-            msg = f"Dough Moisture: {m}"
+            msg = dv.dough_payload(m)
             self.publish(topic, msg)
             self._after_job = self.after(self.pub_every_ms, tick)
         tick()
@@ -175,7 +168,7 @@ class DoughRiseWindow(BaseWindow):
         def tick():
             topic = self.topic
             r = self.e_val.get().strip()
-            msg = f"Dough Rise: {r}"
+            msg = dv.rise_payload(r)
             self.publish(topic, msg)
             self._after_job = self.after(self.pub_every_ms, tick)
         tick()
@@ -205,12 +198,12 @@ class ProofTimerWindow(BaseWindow):
         def tick():
             topic = self.topic
             # פרסום הערך הנוכחי — הדאשבורד יספור
-            self.publish(topic, f"Timer remaining: {max(0, self._rem)}")
+            self.publish(topic, dv.timer_payload(max(0, self._rem)))
 
             self._rem = max(0, self._rem - 1)
             if self._rem == 0:
                 # שליחת הודעת Oven Ready פעם אחת לסגירת הלופ והפעלת ההתראה
-                self.publish(topic, "Oven Ready: 1")
+                self.publish(topic, dv.OVEN_READY)
                 self.enabled = False
                 self.btn_enable.config(text="Enable/Connect")
                 return
@@ -219,7 +212,7 @@ class ProofTimerWindow(BaseWindow):
         tick()
 
     def send_beep(self):
-        self.publish(self.topic, "Oven Ready: 1")
+        self.publish(self.topic, dv.OVEN_READY)
 
 # ---------- Alarm (Subscriber) ----------
 class AlarmWindow(BaseWindow):
@@ -242,7 +235,7 @@ class AlarmWindow(BaseWindow):
     def on_enabled(self):
         topic = self.topic
         # נרשמים לטופיק ההתראות
-        self.client.subscribe(topic, qos=0)
+        self.subscribe(topic)
 
         def pump():
             try:
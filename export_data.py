@@ -0,0 +1,194 @@
+# export_data.py — incremental columnar export of iot_data (Parquet, CSV fallback) + loader
+#
+#   python export_data.py export/                      # כל מה שנוסף מאז ההרצה הקודמת
+#   python export_data.py export/ --metric AxisX --metric AxisY --start "2026-01-01 00:00:00"
+#
+# מבנה הפלט (hive partitioning):
+#   export/metric=<metric>/date=<YYYY-MM-DD>/part-<first_id>-<last_id>.parquet
+#   (<metric> מקודד URI — 'BakeryB/AirEnv_Temperature' -> 'BakeryB%2FAirEnv_Temperature', לא תת-תיקייה)
+#   export/_export_state.json   ← last exported id לכל סט סינון (--metric/--start/--end) — המשך מאותה נקודה
+#   ריצה מסוננת לא מקדמת את ה-cursor של ריצה לא מסוננת; שורות שיוצאו פעמיים מסוננות בטעינה לפי id
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+import data_acq as da
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as pads
+except ImportError:   # אין pyarrow → CSV
+    pa = None
+
+STATE_FILE = "_export_state.json"
+COLUMNS = ["id", "ts", "ts_ms", "device_name", "metric", "value", "units"]
+ORDER = ["metric", "ts_ms", "id"]   # ts ברזולוציית שנייה — ts_ms + id שומרים את סדר הדגימות בתוך השנייה
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def _load_state(outdir):
+    try:
+        with open(os.path.join(outdir, STATE_FILE)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    if "last_id" in state:   # פורמט ישן: cursor יחיד → של הייצוא הלא מסונן
+        state.setdefault("cursors", {}).setdefault("all", state.pop("last_id"))
+    state.setdefault("cursors", {})
+    return state
+
+def _state_key(metrics=None, start=None, end=None):
+    """Cursor key of one filter set ('all' when unfiltered)."""
+    if not (metrics or start or end):
+        return "all"
+    return json.dumps({"metric": sorted(metrics or []), "start": start, "end": end}, sort_keys=True)
+
+def _save_state(outdir, state):
+    path = os.path.join(outdir, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)   # אטומי — קריסה באמצע לא משאירה state שבור
+
+def _chunk_frame(rows):
+    """Rows of one chunk -> typed columns (ts parsed once, vectorized)."""
+    cols = dict(zip(COLUMNS, zip(*rows)))
+    return pd.DataFrame({
+        "id":          np.asarray(cols["id"], dtype=np.int64),
+        "ts":          pd.to_datetime(pd.Series(cols["ts"]), format=TS_FORMAT, errors="coerce"),
+        "ts_ms":       np.asarray(cols["ts_ms"], dtype=np.int64),
+        "device_name": pd.Series(cols["device_name"], dtype="string"),
+        "metric":      pd.Series(cols["metric"], dtype="string"),
+        "value":       pd.to_numeric(pd.Series(cols["value"]), errors="coerce").astype(np.float64),
+        "units":       pd.Series(cols["units"], dtype="string"),
+    })
+
+def _write_part(outdir, metric, date, part, fmt):
+    d = os.path.join(outdir, f"metric={quote(metric, safe='')}", f"date={date}")
+    os.makedirs(d, exist_ok=True)
+    name = f"part-{int(part['id'].iloc[0])}-{int(part['id'].iloc[-1])}"
+    part = part.drop(columns=["metric"])   # נשמר בשם התיקייה
+    if fmt == "parquet":
+        path = os.path.join(d, name + ".parquet")
+        pq.write_table(pa.Table.from_pandas(part, preserve_index=False), path)
+    else:
+        path = os.path.join(d, name + ".csv")
+        part.to_csv(path, index=False, date_format=TS_FORMAT)
+    return path
+
+def export(outdir, metrics=None, start=None, end=None, chunk=50000, fmt=None, db_path=None):
+    """
+    Stream iot_data rows with id > last exported id (of this filter set) into
+    partitioned columnar files. Memory is bounded by `chunk` rows. Returns a report dict.
+    """
+    fmt = fmt or ("parquet" if pa is not None else "csv")
+    if fmt == "parquet" and pa is None:
+        raise RuntimeError("pyarrow is not installed — use fmt='csv'")
+    os.makedirs(outdir, exist_ok=True)
+    state = _load_state(outdir)
+    key = _state_key(metrics, start, end)
+    last_id = int(state["cursors"].get(key, 0))
+
+    where, args = ["id > ?"], []
+    if metrics:
+        where.append(f"metric IN ({','.join('?' * len(metrics))})"); args += list(metrics)
+    if start:
+        where.append("ts >= ?"); args.append(start)
+    if end:
+        where.append("ts < ?"); args.append(end)
+    sql = f"SELECT {', '.join(COLUMNS)} FROM iot_data WHERE {' AND '.join(where)} ORDER BY id LIMIT ?"
+
+    t0 = time.perf_counter()
+    rows_out, files = 0, 0
+    conn = da.connect(db_path or da.INIT_DB_NAME)
+    try:
+        while True:
+            rows = conn.execute(sql, [last_id] + args + [chunk]).fetchall()
+            if not rows:
+                break
+            df = _chunk_frame(rows)
+            dates = df["ts"].dt.strftime("%Y-%m-%d").fillna("unknown")
+            for (metric, date), part in df.groupby([df["metric"], dates], sort=False):
+                _write_part(outdir, metric, date, part, fmt)
+                files += 1
+            last_id = int(df["id"].iloc[-1])
+            rows_out += len(df)
+            state["cursors"][key] = last_id
+            _save_state(outdir, state)   # אחרי כל chunk — המשך בטוח אחרי הפסקה
+    finally:
+        conn.close()
+    return {"rows": rows_out, "files": files, "last_id": last_id, "cursor": key, "format": fmt,
+            "seconds": time.perf_counter() - t0}
+
+# ------------------ טעינה חזרה (לעמודות NumPy/pandas, בלי אובייקט לכל שורה) ------------------
+def load_export(outdir, metrics=None, start=None, end=None, columns=("ts", "value")):
+    """Load exported partitions into a DataFrame with a 'metric' column (Parquet or CSV)."""
+    cols = list(dict.fromkeys(list(columns) + ["metric"]))
+    read = list(dict.fromkeys(cols + ["ts_ms", "id"]))   # למיון ולסינון כפילויות
+    if pa is not None and glob.glob(os.path.join(outdir, "metric=*", "date=*", "*.parquet")):
+        ds = pads.dataset(outdir, format="parquet", partitioning="hive",
+                          exclude_invalid_files=True)
+        flt = None
+        if metrics:
+            flt = pads.field("metric").isin(list(metrics))
+        if start is not None:
+            f = pads.field("ts") >= pd.Timestamp(start)
+            flt = f if flt is None else flt & f
+        if end is not None:
+            f = pads.field("ts") < pd.Timestamp(end)
+            flt = f if flt is None else flt & f
+        have = set(ds.schema.names)
+        df = ds.to_table(columns=[c for c in read if c in have], filter=flt).to_pandas()
+    else:
+        frames = []
+        for d in sorted(glob.glob(os.path.join(outdir, "metric=*"))):
+            metric = unquote(os.path.basename(d).split("=", 1)[1])
+            if metrics and metric not in metrics:
+                continue
+            for f in sorted(glob.glob(os.path.join(d, "date=*", "*.csv"))):
+                part = pd.read_csv(f, parse_dates=["ts"], date_format=TS_FORMAT)
+                part["metric"] = metric
+                frames.append(part)
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=cols)
+        if start is not None:
+            df = df[df["ts"] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df["ts"] < pd.Timestamp(end)]
+    if "ts_ms" not in df.columns or df["ts_ms"].isna().any():   # חלקים מייצוא שלפני ts_ms
+        from_ts = (pd.to_datetime(df["ts"]) - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+        df["ts_ms"] = df["ts_ms"].fillna(from_ts) if "ts_ms" in df.columns else from_ts
+    df = df.drop_duplicates(["metric", "id"]) if "id" in df.columns else df
+    df = df.sort_values([c for c in ORDER if c in df.columns], kind="stable").reset_index(drop=True)
+    return df[cols]
+
+def load_columns(outdir, metrics, start=None, end=None):
+    """{metric: np.ndarray of values} in time order — ready for dataAnalyzer (e.g. AxisX/AxisY/AxisZ)."""
+    df = load_export(outdir, metrics, start, end)
+    return {m: df.loc[df["metric"] == m, "value"].to_numpy(dtype=float) for m in metrics}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Incremental columnar export of iot_data")
+    ap.add_argument("outdir")
+    ap.add_argument("--metric", action="append", help="may be repeated (default: all)")
+    ap.add_argument("--start", help='"YYYY-MM-DD HH:MM:SS" (inclusive)')
+    ap.add_argument("--end", help='"YYYY-MM-DD HH:MM:SS" (exclusive)')
+    ap.add_argument("--chunk", type=int, default=50000, help="rows per chunk (bounds memory)")
+    ap.add_argument("--format", choices=["parquet", "csv"], default=None)
+    ap.add_argument("--db", default=None, help="SQLite file (default: init.db_name)")
+    args = ap.parse_args(argv)
+
+    r = export(args.outdir, args.metric, args.start, args.end, args.chunk, args.format, args.db)
+    print(f"{da.timestamp()}  export|> {r['rows']} rows -> {r['files']} {r['format']} files "
+          f"in {r['seconds']:.2f}s (last id {r['last_id']}, cursor {r['cursor']})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# ingest.py — bounded ingest queue between paho's network thread and the manager's parse/DB path
+#
+# on_message (thread הרשת) רק מכניס לתור — כך keepalive ממשיך גם כשה-DB נתקע (VACUUM, דיסק איטי).
+# לכל מחלקת metric תור חסום משלו (ingest_queue_max) ומדיניות עומס משלה (ingest_policy):
+#   drop_oldest : תור מלא → ההודעה הוותיקה ביותר במחלקה נזרקת
+#   latest      : תור מלא → אם יש כבר הודעה ממתינה לאותו topic היא מוחלפת בחדשה (שומרים את האחרונה);
+#                 אחרת כמו drop_oldest
+#   block       : תור מלא → ממתינים עד ingest_block_s, ואז ההודעה החדשה נזרקת (לעולם לא חוסם לנצח).
+#                 אחרי timeout המחלקה "תקועה": הודעות נוספות נזרקות מיד עד שהצרכן מושך ממנה שוב —
+#                 כך thread הרשת לא מצטבר ל-N×ingest_block_s ו-keepalive ממשיך
+# כל הודעה שנזרקת נספרת: ingest_shed_total{cls=..., reason=...}.
+# הצרכן (IngestWorker או ה-task של מצב async) מושך באצוות, round-robin בין המחלקות — הצפה של
+# מחלקה אחת לא מעכבת את האחרות; הסדר בתוך כל topic נשמר.
+
+import threading
+import time
+from collections import deque
+
+import instrument as im
+
+try:
+    from init import ingest_queue_max, ingest_block_s, ingest_policy
+except Exception:
+    ingest_queue_max, ingest_block_s = 2000, 0.2
+    ingest_policy = {"*": "drop_oldest"}
+
+POLICIES = ("drop_oldest", "latest", "block")
+
+class IngestQueue:
+    """
+    Per-class bounded queues of (topic, payload, t_recv) with an overload
+    policy per class. put() never blocks longer than block_s.
+    """
+
+    def __init__(self, classify, policies=None, max_items: int = ingest_queue_max, block_s: float = ingest_block_s):
+        self.classify = classify                  # topic -> class name
+        self.policies = dict(ingest_policy if policies is None else policies)
+        for cls, p in self.policies.items():
+            if p not in POLICIES:
+                raise ValueError(f"ingest policy for {cls!r} must be one of {POLICIES}, got {p!r}")
+        self.max_items = max(1, int(max_items))
+        self.block_s = float(block_s)
+        self.accepted = 0
+        self.shed = {}        # (cls, reason) -> n
+        self.closed = False
+        self._q = {}          # cls -> deque of [topic, payload, t_recv]
+        self._pending = {}    # cls -> {topic: entry} (latest בלבד — ההודעה הממתינה לכל topic)
+        self._rr = []         # סדר round-robin של המחלקות
+        self._stalled = set() # מחלקות block שה-timeout שלהן פג והצרכן עוד לא התקדם בהן
+        self._size = 0
+        self._cv = threading.Condition()
+
+    def policy_of(self, cls):
+        return self.policies.get(cls, self.policies.get("*", "drop_oldest"))
+
+    def _shed(self, cls, reason, n=1):
+        self.shed[(cls, reason)] = self.shed.get((cls, reason), 0) + n
+        im.inc("ingest_shed_total", n, cls=cls, reason=reason)
+
+    def _drop_oldest(self, cls, q):
+        old = q.popleft()
+        self._size -= 1
+        pend = self._pending.get(cls)
+        if pend is not None and pend.get(old[0]) is old:
+            del pend[old[0]]
+        self._shed(cls, "dropped_oldest")
+
+    def put(self, topic, payload, t_recv=None) -> bool:
+        """Enqueue one message (network thread). False = the new message was shed."""
+        cls = self.classify(topic)
+        policy = self.policy_of(cls)
+        with self._cv:
+            if self.closed:
+                self._shed(cls, "closed")
+                return False
+            q = self._q.get(cls)
+            if q is None:
+                q = self._q[cls] = deque()
+                self._rr.append(cls)
+                if policy == "latest":
+                    self._pending[cls] = {}
+            if len(q) >= self.max_items:
+                if policy == "latest":
+                    entry = self._pending[cls].get(topic)
+                    if entry is not None:            # מחליפים את הממתינה — המקום בתור נשמר
+                        entry[1], entry[2] = payload, t_recv
+                        self._shed(cls, "coalesced")
+                        return True
+                    self._drop_oldest(cls, q)
+                elif policy == "block":
+                    if cls in self._stalled:
+                        self._shed(cls, "block_timeout")
+                        return False
+                    deadline = time.monotonic() + self.block_s
+                    while len(q) >= self.max_items and not self.closed:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            self._stalled.add(cls)
+                            self._shed(cls, "block_timeout")
+                            return False
+                        self._cv.wait(left)
+                    if self.closed:
+                        self._shed(cls, "closed")
+                        return False
+                else:
+                    self._drop_oldest(cls, q)
+            entry = [topic, payload, t_recv]
+            q.append(entry)
+            if policy == "latest":
+                self._pending[cls][topic] = entry
+            self._size += 1
+            self.accepted += 1
+            self._cv.notify_all()
+            return True
+
+    def get_batch(self, max_n: int = 256, timeout: float | None = None):
+        """Up to max_n (topic, payload, t_recv), round-robin across classes. [] on timeout / closed and empty."""
+        with self._cv:
+            if not self._size and not self.closed:
+                self._cv.wait(timeout)
+            out = []
+            while self._size and len(out) < max_n:
+                for cls in self._rr:
+                    q = self._q[cls]
+                    if not q:
+                        continue
+                    entry = q.popleft()
+                    self._size -= 1
+                    self._stalled.discard(cls)
+                    pend = self._pending.get(cls)
+                    if pend is not None and pend.get(entry[0]) is entry:
+                        del pend[entry[0]]
+                    out.append(tuple(entry))
+                    if len(out) >= max_n:
+                        break
+            if out:
+                self._cv.notify_all()   # מפנה מקום למפיקים של מחלקות block
+            return out
+
+    def qsize(self) -> int:
+        return self._size
+
+    def shed_total(self) -> int:
+        return sum(self.shed.values())
+
+    def close(self):
+        """Stop accepting; consumers drain what is left and then get []."""
+        with self._cv:
+            self.closed = True
+            self._cv.notify_all()
+
+class IngestWorker:
+    """Consumer thread: get_batch → handle(topic, payload, t_recv) for each message."""
+
+    def __init__(self, q: IngestQueue, handle, batch: int = 256, name: str = "ingest-worker"):
+        self.q, self.handle, self.batch = q, handle, batch
+        self.processed = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            items = self.q.get_batch(self.batch, timeout=0.5)
+            if not items:
+                if self.q.closed:
+                    return
+                continue
+            for topic, payload, t_recv in items:
+                try:
+                    self.handle(topic, payload, t_recv)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"ingest|> error on {topic}: {e}")
+                self.processed += 1
+
+    def stop(self, timeout: float | None = None) -> bool:
+        """Close the queue and wait for the backlog to drain. False if it did not finish in time."""
+        self.q.close()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -2,23 +2,59 @@
 
 import os
 import socket
+import time
 
-# 0 = שרת פנימי, 1 = HiveMQ public
+# 0 = שרת פנימי, 1 = HiveMQ public, 3 = ברוקר מקומי (python broker.py — בלי אינטרנט, לבנצ'מרקים)
 nb = 1
+# שמות בלבד — הרזולוציה (DNS) נעשית ב-resolve_broker, רק לברוקר הנבחר ורק בשימוש ראשון
 brokers = [
-    str(socket.gethostbyname("vmm1.saaintertrade.com")),
-    str(socket.gethostbyname("broker.hivemq.com")),
+    "vmm1.saaintertrade.com",
+    "broker.hivemq.com",
     "18.194.176.210",  # תוקן רווח שגוי ב-IP
+    "127.0.0.1",       # broker.py
 ]
-ports = [80, 1883, 1883]
-usernames = ["", "", ""]
-passwords = ["", "", ""]
+ports = [80, 1883, 1883, 1883]
+usernames = ["", "", "", ""]
+passwords = ["", "", "", ""]
 
-broker_ip   = brokers[nb]
+broker_host = brokers[nb]
 broker_port = int(ports[nb])  # חשוב: מספר (int)
 username    = usernames[nb]
 password    = passwords[nb]
 
+# nb = 3: True = המנהל/הדשבורד/האמולטורים מפעילים את broker.py בתוך התהליך אם אף אחד לא מאזין עדיין
+embedded_broker = False
+broker_report_s = 10.0        # sec — דוח קצבים לכל topic של broker.py (0 = כבוי)
+
+broker_dns_ttl = 300          # שניות שמירת תוצאת DNS
+local_broker   = "127.0.0.1"  # נפילה לברוקר מקומי כשאין רזולבר/רשת
+
+_resolved = {}   # host -> (ip, expires_at)
+
+def resolve_broker(host: str | None = None) -> str:
+    """Resolve the selected broker lazily, cached for broker_dns_ttl seconds.
+    On DNS failure returns the last known IP, else local_broker."""
+    host = host or broker_host
+    now = time.monotonic()
+    hit = _resolved.get(host)
+    if hit and hit[1] > now:
+        return hit[0]
+    try:
+        ip = socket.gethostbyname(host)
+    except OSError as e:
+        ip = hit[0] if hit else local_broker
+        print(f"init|> DNS lookup for {host} failed ({e}); using {ip}")
+        _resolved[host] = (ip, now + min(broker_dns_ttl, 30))   # לנסות שוב מוקדם יותר
+        return ip
+    _resolved[host] = (ip, now + broker_dns_ttl)
+    return ip
+
+def __getattr__(name):
+    # תאימות לאחור: `from init import broker_ip` עדיין עובד, אבל נפתר רק כשניגשים אליו
+    if name == "broker_ip":
+        return resolve_broker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # זמן חיבור (0 = ללא הגבלת זמן)
 conn_time = 0
 wait_time = 5
@@ -34,15 +70,14 @@ comm_topic = "pr/Proofing/BakeryA/"
 # ProofTimer     -> pr/Proofing/BakeryA/timer-1/pub
 # התראות מנהל   -> pr/Proofing/BakeryA/alarm   (ללא /pub)
 
-# ===== פרופיל התפחה (ספי אזהרה/יעדים) =====
-PROOF_TEMP_MIN   = 27.0   # °C
-PROOF_TEMP_MAX   = 32.0
-PROOF_HUM_MIN    = 70.0   # %RH
-PROOF_HUM_MAX    = 85.0
-DOUGH_MOIST_MIN  = 55.0   # % לחות בבצק (חיישן קיבולי/מודל)
-DOUGH_MOIST_MAX  = 65.0
-RISE_TARGET_PCT  = 75.0   # יעד תפיחה באחוזים
+# ===== ספי התפחה =====
+# מקור יחיד: rules.json (range / target / rate / duration) — נטען ע"י המנהל והדשבורד, ונטען מחדש כשהקובץ משתנה
+rules_file     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+rules_reload_s = 2.0      # sec — בדיקת mtime של הקובץ לכל היותר פעם ב-N
+
 ALERT_COOLDOWN   = 60     # שניות בין התראות מאותו סוג
+ALERT_HYSTERESIS = 0.05   # חלק מרוחב הטווח — ביטול התראה רק כשהערך חזר פנימה מעבר לפס הזה
+ALERT_REPEAT_S   = 0      # תזכורת לחריגה נמשכת כל N שניות (0 = רק במעבר מצב)
 
 # ===== כללי (אם לא משתמשים – להשאיר) =====
 isplot = False
@@ -51,17 +86,82 @@ percen_thr = 0.05
 Fs = 2048.0
 deviation_percentage = 10
 max_eucl = 0.5
+Axes_Threshold = None    # ספי בסיס ל-X/Y/Z; None = נלמדים מחלון נע (dataAnalyzer.VibrationDetector)
+vib_window_blocks = 30   # גודל החלון הנע (בבלוקים)
+vib_monitor_on    = True   # המנהל מריץ את dataAnalyzer.vib_monitor ב-thread (בלי scipy/matplotlib — מושבת)
+vib_poll_s        = 1.0    # sec — קריאת דגימות AxisX/Y/Z חדשות מה-DB
+vib_alarm_publish = True   # פרסום verdicts של הרעידות ל-alarm topic (לא תלוי ב-SEND_EXTERNAL_ALARMS)
 
 # ===== מרווחי עבודה =====
 acqtime   = 60.0  # sec
 manag_time = 10   # sec
 
+# מצב asyncio של המנהל (python manager.py --async): לכל משימה קצב משלה
+manager_async   = False
+db_check_period = manag_time   # sec — בדיקת ספים מחזורית מול המטמון/DB
+actuator_period = 1.0          # sec — מקסימום המתנה לאירוע שינוי התקן (השכמה מיידית באירוע)
+
+# תור קליטה (ingest.py): thread הרשת של paho רק מכניס לתור; פענוח + DB ב-thread נפרד.
+# DB תקוע לא עוצר keepalive — בעומס זורקים לפי מדיניות המחלקה (ונספר ב-ingest_shed_total)
+ingest_queue_max = 2000     # הודעות ממתינות לכל מחלקה
+ingest_block_s   = 0.2      # מדיניות block: המתנה מקסימלית לפני זריקה
+ingest_policy = {           # מחלקה -> drop_oldest / latest (מחליף הודעה ממתינה לאותו topic) / block
+    "env": "latest", "dough": "latest", "rise": "latest", "volume": "latest",
+    "timer": "block", "oven": "block",      # אירועים (Done / Oven Ready) — לא לאבד בקלות
+    "*": "drop_oldest",
+}
+
+# מנהל מרובה חדרים (python manager.py --shards N): supervisor + N תהליכי worker
+rooms          = ["BakeryA", "BakeryB"]   # חדרים ידועים תחת pr/Proofing/ (ל-mode "rooms")
+manager_shards = 1          # 1 = מנהל יחיד (כמו קודם)
+shard_mode     = "rooms"    # "rooms" — כל worker נרשם רק לחדרים שלו (round-robin על rooms)
+                            # "hash"  — כולם נרשמים לכל העץ ומסננים לפי crc32(room) % N (חדרים לא ידועים מראש)
+                            # "shared"— $share/<shard_group>/... ; הברוקר מחלק הודעות בין ה-workers
+shard_group    = "proofing-managers"
+shard_stats_period = 5.0    # sec — כל worker מדווח בריאות ל-supervisor
+shard_stale_s      = 30.0   # sec בלי דיווח → ה-worker נחשב תקוע ומופעל מחדש
+shard_backoff_max  = 30.0   # sec — המתנה מקסימלית בין הפעלות חוזרות של worker שקורס
+
+# ===== מדידה ולוג (instrument.py) =====
+metrics_enabled  = True   # מוני שלבים + היסטוגרמות השהייה
+metrics_port     = 9108   # http://127.0.0.1:<port>/metrics (Prometheus); 0 = כבוי. shard i → port+1+i
+dashboard_metrics_port = 9107   # /metrics של proofing_dashboard.py
+log_level        = "info" # debug / info / warning / error / off
+log_sample_every = 100    # ב-debug: רק כל N-ית שורה לכל הודעה נכתבת
+
+# ===== מעקב השהייה מקצה לקצה (tracing.py) =====
+trace_enabled      = False  # אמולטורים/loadgen מוסיפים להודעה " |trace=<seq>;<t_send>"; המנהל והדשבורד מסירים תמיד
+trace_sample_every = 1      # רק כל N-ית הודעה לכל topic מקבלת חותמת
+trace_report_s     = 30.0   # sec — דוח השהייה לפי hop ולפי מכשיר בלוג (0 = רק ביציאה)
+
 # ===== מסד נתונים =====
 BASE_DIR = os.path.dirname(__file__)
 db_name  = os.path.join(BASE_DIR, "data", "ProofingGuard.db")
 # אתחול סכימה וזרעים (להריץ פעם אחת כשמשנים את סוגי המכשירים)
 db_init  = False   # הפוך ל-True → הרץ data_acq.py → החזר ל-False
 
+# כותב רקע ל-iot_data: חיבור אחד קבוע + executemany
+db_batch_rows = 200     # flush אחרי N שורות...
+db_batch_ms   = 250     # ...או אחרי T מילישניות — המוקדם מביניהם
+db_queue_max  = 10000   # תור חסום; put ימתין כשהכותב מפגר
+
+# PRAGMA לכל חיבור (WAL: קוראים לא חוסמים את הכותב של המנהל)
+db_journal_mode = "WAL"
+db_synchronous  = "NORMAL"    # OFF / NORMAL / FULL — NORMAL בטוח מספיק ב-WAL
+db_cache_size   = -16000      # שלילי = KiB (כ-16MB)
+db_mmap_size    = 64 * 1024 * 1024   # 0 = כבוי
+
+# rollups (min/max/avg/count/last) לכל metric — רזולוציות בשניות, חייבות לחלק יממה
+rollup_resolutions = (60, 900, 3600)   # 1 דק׳, 15 דק׳, שעה
+
+# שמירת נתונים (ימים) — "*" = ברירת מחדל לכל metric שלא מופיע במפורש
+retention_raw_days    = {"*": 7}
+retention_rollup_days = {60: 30, 900: 365, 3600: 365}   # לפי רזולוציה (שניות)
+retention_alert_days  = 90
+prune_period_s   = 3600   # כל כמה זמן רץ ה-pruner ברקע
+prune_chunk_rows = 500    # שורות לטרנזקציה — קצר, כדי לא לעכב את הכותב
+prune_vacuum_pages = 2000 # PRAGMA incremental_vacuum(N) בכל ריצה
+
 # ===== שאריות מהמערכת הישנה (לא בשימוש בפרופינג) =====
 # נשארים כאן כדי לא לשבור קוד ישן אם הוא עוד קורא להם.
 sensitivityMax = 0.02
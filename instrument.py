@@ -0,0 +1,205 @@
+# instrument.py — lightweight per-stage counters/latency histograms + Prometheus /metrics + gated logging
+#
+#   import instrument as im
+#   t0 = im.now(); ...; im.observe("dispatch", im.now() - t0)
+#   im.inc("messages_total", topic_class="env")
+#   im.serve(9108)                          # curl http://127.0.0.1:9108/metrics
+#   if im.log_on("debug"): ic(...)          # בלי עלות פורמט כשהרמה כבויה
+#
+# עלות לקריאה: perf_counter + bisect + lock קצר (~1us). אין תלות חיצונית (http.server מהספרייה הסטנדרטית).
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from init import metrics_enabled, metrics_port, log_level, log_sample_every
+except Exception:   # הדשבורד רץ גם בלי init.py
+    metrics_enabled, metrics_port, log_level, log_sample_every = True, 0, "info", 100
+
+PREFIX = "proofing_"
+
+# גבולות bucket בשניות: 10us .. 5s
+BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+           1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+now = time.perf_counter
+
+class Histogram:
+    """Fixed-bucket latency histogram (non-cumulative counts; cumulated in render)."""
+
+    __slots__ = ("counts", "sum", "n", "lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # האחרון = +Inf
+        self.sum = 0.0
+        self.n = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.n += 1
+
+    def quantile(self, q):
+        """Upper bucket bound holding quantile q (הערכה גסה, לדיווח בלבד)."""
+        with self.lock:
+            counts, n = list(self.counts), self.n
+        if not n:
+            return 0.0
+        target, acc = q * n, 0
+        for i, c in enumerate(counts):
+            acc += c
+            if acc >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+_lock = threading.Lock()
+_hists = {}      # stage -> Histogram
+_counters = {}   # (name, labels) -> value
+_gauges = {}     # name -> (fn, help)
+
+def histogram(stage):
+    h = _hists.get(stage)
+    if h is None:
+        with _lock:
+            h = _hists.setdefault(stage, Histogram())
+    return h
+
+def observe(stage, seconds):
+    """Record one latency sample (seconds) for a pipeline stage."""
+    if metrics_enabled:
+        histogram(stage).observe(seconds)
+
+class timed:
+    """Context manager: `with timed("db_write"): ...`."""
+
+    __slots__ = ("stage", "t0")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = now()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, now() - self.t0)
+        return False
+
+def inc(name, n=1, **labels):
+    """Add n to counter `name` (labels optional)."""
+    if not metrics_enabled:
+        return
+    key = (name, tuple(sorted(labels.items())) if labels else ())
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+def gauge(name, fn, help=""):
+    """Register a gauge read lazily at scrape time (fn() -> number)."""
+    _gauges[name] = (fn, help)
+
+def reset():
+    with _lock:
+        _hists.clear(); _counters.clear()
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in pairs) + "}"
+
+def render():
+    """All metrics in Prometheus text exposition format (0.0.4)."""
+    out = []
+    with _lock:
+        counters = sorted(_counters.items())
+        hists = sorted(_hists.items())
+    seen = set()
+    for (name, labels), v in counters:
+        if name not in seen:
+            out.append(f"# TYPE {PREFIX}{name} counter")
+            seen.add(name)
+        out.append(f"{PREFIX}{name}{_labels(labels)} {v}")
+    if hists:
+        out.append(f"# HELP {PREFIX}stage_seconds Latency per pipeline stage")
+        out.append(f"# TYPE {PREFIX}stage_seconds histogram")
+    for stage, h in hists:
+        with h.lock:
+            counts, total, n = list(h.counts), h.sum, h.n
+        acc = 0
+        for le, c in zip(BUCKETS, counts):
+            acc += c
+            out.append(f'{PREFIX}stage_seconds_bucket{{stage="{stage}",le="{le:g}"}} {acc}')
+        out.append(f'{PREFIX}stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {n}')
+        out.append(f'{PREFIX}stage_seconds_sum{{stage="{stage}"}} {total:.9f}')
+        out.append(f'{PREFIX}stage_seconds_count{{stage="{stage}"}} {n}')
+    for name, (fn, help) in sorted(_gauges.items()):
+        try:
+            v = float(fn())
+        except Exception:
+            continue
+        if help:
+            out.append(f"# HELP {PREFIX}{name} {help}")
+        out.append(f"# TYPE {PREFIX}{name} gauge")
+        out.append(f"{PREFIX}{name} {v:g}")
+    return "\n".join(out) + "\n"
+
+def summary():
+    """{stage: (count, p50_s, p99_s)} — לדיווח בלוג/בנצ'מרק."""
+    with _lock:
+        hists = list(_hists.items())
+    return {s: (h.n, h.quantile(0.5), h.quantile(0.99)) for s, h in hists}
+
+# ------------------ HTTP /metrics ------------------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass   # בלי שורת לוג לכל scrape
+
+def serve(port=None, host="127.0.0.1"):
+    """Serve /metrics on a daemon thread; returns the server (None when port is 0)."""
+    port = metrics_port if port is None else port
+    if not port:
+        return None
+    srv = ThreadingHTTPServer((host, int(port)), _Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics-http", daemon=True).start()
+    return srv
+
+# ------------------ לוג מדורג + דגימה ------------------
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "off": 100}
+_level = LEVELS.get(str(log_level).lower(), 20)
+_tick = 0
+
+def set_log_level(level, sample_every=None):
+    global _level, log_sample_every
+    _level = LEVELS.get(str(level).lower(), 20)
+    if sample_every is not None:
+        log_sample_every = max(1, int(sample_every))
+
+def log_on(level="debug"):
+    """
+    True if a log line at `level` should be written. debug lines are also
+    sampled: only every log_sample_every-th one passes.
+    """
+    global _tick
+    lv = LEVELS.get(level, 20)
+    if lv < _level:
+        return False
+    if lv > LEVELS["debug"] or log_sample_every <= 1:
+        return True
+    _tick += 1
+    return _tick % log_sample_every == 0
@@ -0,0 +1,229 @@
+# loadgen.py — headless high-rate load generator built on the emulator device models (devices.py)
+#
+#   python loadgen.py --rooms 500 --duration 60                     # 2000 מכשירים, קצב ה-GUI (0.5–1 msg/s)
+#   python loadgen.py --rooms 1000 --rate 5 --procs 4 --scenario heatwave
+#   python loadgen.py --rooms 2000 --rate 10 --sink                 # בלי רשת — רק קצב המחולל עצמו
+#   python loadgen.py --host 127.0.0.1 --port 1883                  # מול ברוקר מקומי
+#   python loadgen.py --host 127.0.0.1 --port 1883 --trace --trace-every 10   # השהייה מקצה לקצה (tracing.py)
+#
+# כל תהליך: לולאת asyncio אחת עם heap של מועדי פרסום (לא task לכל מכשיר) + חיבור MQTT משותף אחד (mqtt_mux).
+# --procs N מחלק את החדרים בין N תהליכים (spawn); הדוח מסכם את כולם.
+# החדר הראשון הוא חדר הבית (של comm_topic) — מנהל יחיד רשום רק אליו; לשאר החדרים:
+#   python manager.py --shards N   עם shard_mode = "hash" או "shared" ב-init.py
+
+import argparse
+import asyncio
+import heapq
+import multiprocessing as mp
+import queue
+import random
+import sys
+import time
+
+import devices as dv
+import tracing
+
+# ------------------ מתזמן ------------------
+async def run_devices(devs, publish, duration, report=None, report_s=5.0, seed=0):
+    """
+    Publish every device on its own period until `duration` seconds pass.
+    report(stats) is called every report_s. Returns the final stats dict.
+    """
+    rnd = random.Random(seed)
+    heap = [(d.next_due, i) for i, d in enumerate(devs)]
+    heapq.heapify(heap)
+    stats = {"sent": 0, "errors": 0, "by_kind": {}, "lag_max": 0.0, "late": 0, "elapsed": 0.0}
+    by_kind = stats["by_kind"]
+    t0 = time.monotonic()
+    next_report = report_s
+    burst = 0
+    while heap:
+        now = time.monotonic() - t0
+        if now >= duration:
+            break
+        if report and now >= next_report:
+            stats["elapsed"] = now
+            report(stats)
+            next_report += report_s
+        due, i = heap[0]
+        if due > now:
+            burst = 0
+            await asyncio.sleep(min(due, next_report, duration) - now)
+            continue
+        heapq.heappop(heap)
+        d = devs[i]
+        for payload in d.step(due, rnd):
+            try:
+                publish(d.topic, payload)
+                stats["sent"] += 1
+                by_kind[d.kind] = by_kind.get(d.kind, 0) + 1
+            except Exception:
+                stats["errors"] += 1
+        lag = now - due
+        if lag > d.period:   # מפגרים ביותר ממחזור שלם — המחולל לא עומד בקצב
+            stats["late"] += 1
+        if lag > stats["lag_max"]:
+            stats["lag_max"] = lag
+        heapq.heappush(heap, (due + d.period, i))
+        burst += 1
+        if burst >= 1000:    # לא להרעיב את ה-loop (ולידו thread הרשת של paho)
+            burst = 0
+            await asyncio.sleep(0)
+    stats["elapsed"] = time.monotonic() - t0
+    return stats
+
+# ------------------ יעד פרסום ------------------
+class Sink:
+    """Counting publisher that never touches the network (measures the generator itself)."""
+
+    def __init__(self):
+        self.n = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.n += 1
+
+def _publisher(args):
+    if args.sink:
+        return Sink(), None
+    from mqtt_mux import MqttMux
+    mux = MqttMux(client_id=f"loadgen-{args.worker}-{random.randrange(1, 10**6)}", host=args.host, port=args.port)
+    mux.acquire()
+    return mux, mux.release
+
+# ------------------ worker ------------------
+def room_names(n, prefix="Room", home=True):
+    """n room names; with home=True the first one is HOME_ROOM (the room a single manager subscribes to)."""
+    names = [f"{prefix}{i:04d}" for i in range(n)]
+    if home and names:
+        names[0] = dv.HOME_ROOM
+    return names
+
+def worker(args, rooms, out_q=None):
+    devs = dv.build_devices(rooms, kinds=args.kinds, period=(1.0 / args.rate if args.rate else None),
+                            scenario=args.scenario, seed=args.seed + args.worker)
+    target = sum(1.0 / d.period for d in devs)
+    pub, close = _publisher(args)
+    stamper = tracing.Stamper(enabled=args.trace or tracing.trace_enabled, every=args.trace_every)
+    publish = (lambda t, p: pub.publish(t, stamper.stamp(t, p))) if stamper.enabled else pub.publish
+
+    def report(st):
+        msg = {"worker": args.worker, "sent": st["sent"], "elapsed": st["elapsed"], "lag_max": st["lag_max"],
+               "late": st["late"], "errors": st["errors"], "target": target, "final": False}
+        if out_q is not None:
+            out_q.put(msg)
+        else:
+            _print_progress([msg])
+
+    try:
+        st = asyncio.run(run_devices(devs, publish, args.duration, report, args.report_s, args.seed))
+    finally:
+        if close:
+            close()
+    st.update(worker=args.worker, target=target, devices=len(devs), final=True)
+    if out_q is not None:
+        out_q.put(st)
+    return st
+
+def _worker_main(args, rooms, out_q):
+    try:
+        worker(args, rooms, out_q)
+    except Exception as e:
+        out_q.put({"worker": args.worker, "error": str(e), "final": True})
+
+# ------------------ דוחות ------------------
+def _print_progress(msgs):
+    sent = sum(m["sent"] for m in msgs)
+    elapsed = max(m["elapsed"] for m in msgs) or 1e-9
+    target = sum(m["target"] for m in msgs)
+    print(f"loadgen|> t={elapsed:6.1f}s  sent={sent:>9}  rate={sent / elapsed:9.0f} msg/s  "
+          f"(target {target:.0f})  lag_max={max(m['lag_max'] for m in msgs) * 1000:.0f} ms  "
+          f"late={sum(m['late'] for m in msgs)}", flush=True)
+
+def print_summary(results):
+    ok = [r for r in results if "error" not in r]
+    for r in results:
+        if "error" in r:
+            print(f"loadgen|> worker {r['worker']} failed: {r['error']}")
+    if not ok:
+        return
+    sent = sum(r["sent"] for r in ok)
+    elapsed = max(r["elapsed"] for r in ok) or 1e-9
+    target = sum(r["target"] for r in ok)
+    kinds = {}
+    for r in ok:
+        for k, n in r["by_kind"].items():
+            kinds[k] = kinds.get(k, 0) + n
+    print(f"devices       : {sum(r['devices'] for r in ok)}  ({len(ok)} process(es))")
+    print(f"published     : {sent}  in {elapsed:.1f} s")
+    print(f"achieved rate : {sent / elapsed:.0f} msg/s  (target {target:.0f} msg/s, "
+          f"{100.0 * sent / elapsed / target if target else 0:.0f}%)")
+    print(f"max lag       : {max(r['lag_max'] for r in ok) * 1000:.1f} ms   late: {sum(r['late'] for r in ok)}   "
+          f"errors: {sum(r['errors'] for r in ok)}")
+    for k in sorted(kinds):
+        print(f"kind {k:<8} : {kinds[k]:>9}  ({kinds[k] / elapsed:.0f} msg/s)")
+
+# ------------------ main ------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        description="Headless load generator for the proofing manager/dashboard",
+        epilog=f"A single manager subscribes only to the home room ({dv.HOME_ROOM}). To ingest every "
+               f"room, run 'manager.py --shards N' with shard_mode = \"hash\" or \"shared\" in init.py.")
+    ap.add_argument("--rooms", type=int, default=100, help="number of emulated rooms (4 devices each)")
+    ap.add_argument("--room-prefix", dest="room_prefix", default="Room", help="name prefix of the other rooms")
+    ap.add_argument("--home-room", dest="home_room", action=argparse.BooleanOptionalAction, default=True,
+                    help=f"make the first room the home room ({dv.HOME_ROOM}), which a single manager ingests")
+    ap.add_argument("--kinds", default="env,dough,rise,timer", help="device kinds per room")
+    ap.add_argument("--rate", type=float, default=0.0, help="msg/s per device (0 = the GUI periods)")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds")
+    ap.add_argument("--scenario", default="steady", choices=sorted(dv.SCENARIOS))
+    ap.add_argument("--procs", type=int, default=1, help="worker processes (rooms split between them)")
+    ap.add_argument("--host", default=None, help="broker host (default: init.py broker)")
+    ap.add_argument("--port", type=int, default=None)
+    ap.add_argument("--sink", action="store_true", help="count instead of publishing (no network)")
+    ap.add_argument("--trace", action="store_true", help="stamp payloads for end-to-end latency (tracing.py)")
+    ap.add_argument("--trace-every", dest="trace_every", type=int, default=tracing.trace_sample_every,
+                    help="stamp every N-th message per topic")
+    ap.add_argument("--report-s", dest="report_s", type=float, default=5.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    args.kinds = tuple(k for k in args.kinds.split(",") if k)
+    for k in args.kinds:
+        if k not in dv.DEVICE_SEGMENTS:
+            ap.error(f"unknown kind {k!r}; choose from {sorted(dv.DEVICE_SEGMENTS)}")
+
+    rooms = room_names(args.rooms, args.room_prefix, args.home_room)
+    procs = max(1, min(args.procs, len(rooms)))
+    if procs == 1:
+        args.worker = 0
+        print_summary([worker(args, rooms)])
+        return 0
+
+    ctx = mp.get_context("spawn")   # כמו ה-ShardSupervisor — אותה התנהגות ב-Windows וב-Linux
+    out_q = ctx.Queue()
+    ps = []
+    for w in range(procs):
+        wa = argparse.Namespace(**vars(args)); wa.worker = w
+        p = ctx.Process(target=_worker_main, args=(wa, rooms[w::procs], out_q), daemon=True)
+        p.start(); ps.append(p)
+    latest, final = {}, {}
+    deadline = time.monotonic() + args.duration + 60
+    while len(final) < procs and time.monotonic() < deadline:
+        try:
+            m = out_q.get(timeout=1.0)
+        except queue.Empty:
+            if not any(p.is_alive() for p in ps):
+                break
+            continue
+        if m.get("final"):
+            final[m["worker"]] = m
+        else:
+            latest[m["worker"]] = m
+            if len(latest) == procs and m["worker"] == procs - 1:
+                _print_progress(list(latest.values()))
+    for p in ps:
+        p.join(timeout=5)
+    print_summary(list(final.values()))
+    return 0 if final and all("error" not in r for r in final.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
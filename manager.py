@@ -1,15 +1,28 @@
 # Manager for Proofing System (Bakery) – DB writer + alarm logic
 
 import re
+import sys
 import time
+import os
 import random
+import asyncio
+import threading
+import zlib
+import multiprocessing as mp
 from datetime import datetime
 
 import paho.mqtt.client as mqtt
 from icecream import ic
 
-from init import *           # comm_topic, broker_ip, broker_port, db_name, manag_time, etc.
-import data_acq as da        # add_IOT_data, fetch_data, timestamp, check_changes, update_IOT_status
+from init import *           # comm_topic, resolve_broker, broker_port, db_name, manag_time, etc.
+import data_acq as da        # add_IOT_data, close_IOT_writer, get_latest_value, timestamp, fetch/ack_device_events
+import instrument as im      # מוני שלבים/השהייה + /metrics + לוג מדורג
+from alarms import AlarmEngine
+from rules import load_rules
+from broker import ensure_broker   # embedded_broker: ברוקר מקומי בתוך התהליך (offline / בנצ'מרק)
+import tracing                     # חותמות trace אופציונליות: השהייה מקצה לקצה לפי hop
+from tracing import TRACER
+from ingest import IngestQueue, IngestWorker   # תור חסום בין thread הרשת לפענוח/DB
 
 def time_format():
     return f'{datetime.now()}  Manager|> '
@@ -27,18 +40,30 @@ ALARM_RETAIN = False
 TOPIC_BASE = comm_topic.rstrip('/')
 ALARM_TOPIC = f"{TOPIC_BASE}/alarm"
 
-# ------------------ ספי התפחה (ניתן להתאים לפי הצורך) ------------------
-AIR_TEMP_RANGE     = (27.0, 32.0)    # °C טמפ' אוויר בחלון ההתפחה
-AIR_HUM_RANGE      = (70.0, 85.0)    # % לחות יחסית באוויר
-DOUGH_MOIST_RANGE  = (60.0, 75.0)    # % לחות/מוליכות בבצק (מד סימבולי)
-HYDRATION_RANGE    = (0.55, 0.80)    # יחס מים/קמח
-VOLUME_TARGET_MIN  = 1.80            # פי כמה מנפח התחלתי (מדד יחסי)
-PROOF_MAX_HOURS    = 3.0             # ש׳ מקסימום להתפחה
-OVEN_READY_TEMP    = 180.0           # °C תנור מוכן
+# חדרים: '<TOPIC_ROOT>/<room>/<dev>/pub'. החדר של comm_topic הוא "הבית" — שמות ה-metrics שלו ללא קידומת
+TOPIC_ROOT, HOME_ROOM = TOPIC_BASE.rsplit('/', 1)
+_ctx = threading.local()   # החדר של ההודעה שבטיפול (לכל thread בנפרד — async מריץ בדיקות ב-to_thread)
+
+def current_room():
+    return getattr(_ctx, 'room', HOME_ROOM)
+
+def room_of(topic):
+    """'pr/Proofing/BakeryB/env-1/pub' -> 'BakeryB' (HOME_ROOM for topics outside TOPIC_ROOT)."""
+    if topic.startswith(TOPIC_ROOT + '/'):
+        return topic[len(TOPIC_ROOT) + 1:].split('/', 1)[0] or HOME_ROOM
+    return HOME_ROOM
+
+def metric_name(name, room=None):
+    room = room or current_room()
+    return name if room == HOME_ROOM else f"{room}/{name}"
+
+# ------------------ ספי התפחה: rules.json (משותף לדשבורד, נטען מחדש כשהקובץ משתנה) ------------------
+RULES = load_rules()
 
 # ------------------ Callbacks ------------------
 def on_log(client, userdata, level, buf):
-    ic("log: " + buf)
+    if im.log_on("debug"):
+        ic("log: " + buf)
 
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
@@ -50,10 +75,16 @@ def on_disconnect(client, userdata, rc, properties=None):
     ic("DisConnected result code " + str(rc))
 
 def on_message(client, userdata, msg):
+    t0 = im.now()
     topic = msg.topic
     m_decode = str(msg.payload.decode("utf-8", "ignore"))
-    ic("message from: " + topic, m_decode)
-    insert_and_evaluate(client, topic, m_decode)
+    if im.log_on("debug"):   # לוג לכל הודעה רק ב-debug, ובדגימה
+        ic("message from: " + topic, m_decode)
+    if INGEST is not None:
+        INGEST.put(topic, m_decode, tracing.now())   # לא חוסם את thread הרשת (מעבר ל-ingest_block_s)
+    else:
+        insert_and_evaluate(client, topic, m_decode)
+    im.observe("receive", im.now() - t0)
 
 # ------------------ MQTT init ------------------
 def client_init(cname):
@@ -75,182 +106,336 @@ def client_init(cname):
     client.on_message = on_message
     if username != "":
         client.username_pw_set(username, password)
+    ensure_broker()
+    broker_ip = resolve_broker()
     ic("Connecting to broker ", broker_ip)
     client.connect(broker_ip, int(broker_port))  # connect to broker
     return client
 
 # ------------------ עזרי פרסום ------------------
 def enable(client, topic, msg, retain=False):
-    ic(topic + ' ' + msg)
+    if im.log_on("info"):
+        ic(topic + ' ' + msg)
+    t0 = im.now()
     client.publish(topic, msg, qos=0, retain=retain)
+    im.observe("publish", im.now() - t0)
+    im.inc("published_total")
 
 def alarm(client, msg):
-    # לוג תמיד — כדי שתראה מה *היה* נשלח
-    ic(f"ALARM -> {ALARM_TOPIC}: {msg}")
+    room = current_room()
+    topic = ALARM_TOPIC if room == HOME_ROOM else f"{TOPIC_ROOT}/{room}/alarm"
+    im.inc("alarms_total", room=room)
+    # לוג (ברמת info) — כדי שתראה מה *היה* נשלח
+    if im.log_on("info"):
+        ic(f"ALARM -> {topic}: {msg}")
     # פרסום בפועל רק אם הדגל דלוק
     if SEND_EXTERNAL_ALARMS:
-        enable(client, ALARM_TOPIC, msg, retain=ALARM_RETAIN)
+        enable(client, topic, msg, retain=ALARM_RETAIN)
+
+ALARMS = AlarmEngine()   # מצב לכל (metric, cond); היסטוריה נכתבת ל-iot_alerts ב-check_DB_for_change
 
 # ------------------ פירוק הודעות + כתיבה ל-DB + בדיקת ספים ------------------
 _num = r'([-+]?\d+(?:\.\d+)?)'  # מספר עשרוני/שלם
 
-def insert_and_evaluate(client, topic, payload):
-    """
-    מזהה את סוג ההודעה לפי ה־topic/תוכן, כותב ל־DB ומתריע אם ערכים מחוץ לספים.
-    מאפשר גם תאימות לאחור (DHT / ElecMeter).
-    """
-
+# תבניות מקומפלות פעם אחת (אין קומפילציית regex בנתיב החם)
+RE_TEMPERATURE = re.compile(r'Temperature:\s*' + _num)
+RE_HUMIDITY    = re.compile(r'Humidity:\s*' + _num)
+RE_MOISTURE    = re.compile(r'Moisture:\s*' + _num)
+RE_HYDRATION   = re.compile(r'Hydration:\s*' + _num)
+RE_VOLUME      = re.compile(r'Volume:\s*' + _num)
+RE_RISE        = re.compile(r'Rise:\s*' + _num)
+RE_TIMER_DONE  = re.compile(r'Done|Finish|End', re.I)
+RE_TIMER_HMS   = re.compile(r'(\d+):(\d{2}):(\d{2})')
+RE_TIMER_UNIT  = re.compile(_num + r'\s*(h|hr|hrs|hour|hours|min|m|minutes?)', re.I)
+RE_OVEN_TEMP   = re.compile(r'(OvenTemp|Temp):\s*' + _num, re.I)
+RE_VIB_AXIS    = re.compile(r'(Axis[XYZ]):\s*([-+0-9.eE,]+)')
+
+# ---- parsers: כל אחד מחזיר True אם זיהה וטיפל בהודעה ----
+# ---- ספים: RULES (כל הכללים של ה-metric) → AlarmEngine → פרסום רק במעבר מצב ----
+def evaluate(client, base, value):
+    """Run every rule of `base` on one reading and publish resulting transitions."""
+    key = metric_name(base)
+    for cond, bad, ok, text, text_ok in RULES.check(base, key, value, da.now_ms() / 1000.0):
+        msg = ALARMS.check(key, cond, value, bad, ok, text, text_ok)
+        if msg:
+            alarm(client, msg)
+
+def parse_env(client, payload):
+    # "From: AirEnv Temperature: <num> Humidity: <num>"
     wrote_something = False
-
-    # --- AirEnv: "From: AirEnv Temperature: <num> Humidity: <num>"
-    if topic.endswith('/env-1/pub') or 'AirEnv' in payload:
-        mt = re.search(r'Temperature:\s*' + _num, payload)
-        mh = re.search(r'Humidity:\s*'    + _num, payload)
-        if mt:
-            t = float(mt.group(1))
-            da.add_IOT_data('AirEnv_Temperature', da.timestamp(), t); wrote_something = True
-            if not (AIR_TEMP_RANGE[0] <= t <= AIR_TEMP_RANGE[1]):
-                alarm(client, f"Air temperature out of range: {t:.1f}°C (target {AIR_TEMP_RANGE[0]}–{AIR_TEMP_RANGE[1]}°C)")
-        if mh:
-            h = float(mh.group(1))
-            da.add_IOT_data('AirEnv_Humidity', da.timestamp(), h); wrote_something = True
-            if not (AIR_HUM_RANGE[0] <= h <= AIR_HUM_RANGE[1]):
-                alarm(client, f"Air humidity out of range: {h:.0f}% (target {AIR_HUM_RANGE[0]}–{AIR_HUM_RANGE[1]}%)")
-        if wrote_something:
-            return
-
-    # --- DoughMoisture: "From: DoughMoisture Moisture: <num%> Hydration: <num>"
-    if topic.endswith('/dough-1/pub') or 'DoughMoisture' in payload or 'Moisture:' in payload:
-        mm = re.search(r'Moisture:\s*'   + _num, payload)
-        mh = re.search(r'Hydration:\s*'  + _num, payload)
-        if mm:
-            m = float(mm.group(1))
-            da.add_IOT_data('DoughMoisture', da.timestamp(), m); wrote_something = True
-            if not (DOUGH_MOIST_RANGE[0] <= m <= DOUGH_MOIST_RANGE[1]):
-                alarm(client, f"Dough moisture out of range: {m:.0f}% (target {DOUGH_MOIST_RANGE[0]}–{DOUGH_MOIST_RANGE[1]}%)")
-        if mh:
-            hy = float(mh.group(1))
-            da.add_IOT_data('Hydration', da.timestamp(), hy); wrote_something = True
-            if not (HYDRATION_RANGE[0] <= hy <= HYDRATION_RANGE[1]):
-                alarm(client, f"Hydration ratio out of range: {hy:.2f} (target {HYDRATION_RANGE[0]}–{HYDRATION_RANGE[1]})")
-        if wrote_something:
-            return
-
-    # --- VolumeSensor: "From: VolumeSensor Volume: <num>"
-    if topic.endswith('/vol-1/pub') or 'VolumeSensor' in payload or 'Volume:' in payload:
-        mv = re.search(r'Volume:\s*' + _num, payload)
-        if mv:
-            v = float(mv.group(1))
-            da.add_IOT_data('DoughVolume', da.timestamp(), v); wrote_something = True
-            if v >= VOLUME_TARGET_MIN:
-                alarm(client, f"Dough has proofed enough (volume ×{v:.2f} ≥ {VOLUME_TARGET_MIN}).")
-        if wrote_something:
-            return
-
-    # --- Timer/Oven:
-    # דוגמאות נתמכות:
-    # "From: Timer Remaining: 120 min"  | "Timer: 1:30:00" | "Timer: Done"
-    # "From: Oven OvenTemp: 185"        | "Oven: 185"
-    if topic.endswith('/timer-1/pub') or 'Timer' in payload:
-        if re.search(r'Done|Finish|End', payload, re.I):
-            alarm(client, "Proofing time completed. Proceed to baking.")
-            return
-        # H:MM:SS
-        m_hms = re.search(r'(\d+):(\d{2}):(\d{2})', payload)
-        if m_hms:
-            hours = int(m_hms.group(1)) + int(m_hms.group(2))/60 + int(m_hms.group(3))/3600
-            da.add_IOT_data('TimerHours', da.timestamp(), hours); wrote_something = True
-            if hours > PROOF_MAX_HOURS:
-                alarm(client, f"Proofing time exceeded {hours:.2f} h (> {PROOF_MAX_HOURS} h).")
-            return
+    mt = RE_TEMPERATURE.search(payload)
+    mh = RE_HUMIDITY.search(payload)
+    if mt:
+        t = float(mt.group(1))
+        da.add_IOT_data(metric_name('AirEnv_Temperature'), da.timestamp(), t); wrote_something = True
+        evaluate(client, 'AirEnv_Temperature', t)
+    if mh:
+        h = float(mh.group(1))
+        da.add_IOT_data(metric_name('AirEnv_Humidity'), da.timestamp(), h); wrote_something = True
+        evaluate(client, 'AirEnv_Humidity', h)
+    return wrote_something
+
+def parse_dough(client, payload):
+    # "Dough Moisture: <num>" | "From: DoughMoisture Moisture: <num%> Hydration: <num>"
+    wrote_something = False
+    mm = RE_MOISTURE.search(payload)
+    mh = RE_HYDRATION.search(payload)
+    if mm:
+        m = float(mm.group(1))
+        da.add_IOT_data(metric_name('DoughMoisture'), da.timestamp(), m); wrote_something = True
+        evaluate(client, 'DoughMoisture', m)
+    if mh:
+        hy = float(mh.group(1))
+        da.add_IOT_data(metric_name('Hydration'), da.timestamp(), hy); wrote_something = True
+        evaluate(client, 'Hydration', hy)
+    return wrote_something
+
+def parse_volume(client, payload):
+    # "From: VolumeSensor Volume: <num>"
+    mv = RE_VOLUME.search(payload)
+    if not mv:
+        return False
+    v = float(mv.group(1))
+    da.add_IOT_data(metric_name('DoughVolume'), da.timestamp(), v)
+    evaluate(client, 'DoughVolume', v)
+    return True
+
+def parse_rise(client, payload):
+    # "Dough Rise: <num>"  (אחוז תפיחה)
+    mr = RE_RISE.search(payload)
+    if not mr:
+        return False
+    r = float(mr.group(1))
+    da.add_IOT_data(metric_name('DoughRise'), da.timestamp(), r)
+    evaluate(client, 'DoughRise', r)
+    return True
+
+def parse_timer(client, payload):
+    # "From: Timer Remaining: 120 min" | "Timer: 1:30:00" | "Timer: Done"
+    if RE_TIMER_DONE.search(payload):
+        msg = ALARMS.event(metric_name('TimerHours'), 'done', "Proofing time completed. Proceed to baking.")
+        if msg:
+            alarm(client, msg)
+        return True
+    # H:MM:SS
+    m_hms = RE_TIMER_HMS.search(payload)
+    if m_hms:
+        hours = int(m_hms.group(1)) + int(m_hms.group(2))/60 + int(m_hms.group(3))/3600
+    else:
         # Remaining/Elapsed with units
-        m_num_unit = re.search(_num + r'\s*(h|hr|hrs|hour|hours|min|m|minutes?)', payload, re.I)
-        if m_num_unit:
-            val = float(m_num_unit.group(1))
-            unit = m_num_unit.group(2).lower()
-            hours = val if unit.startswith('h') else (val / 60.0)
-            da.add_IOT_data('TimerHours', da.timestamp(), hours); wrote_something = True
-            if hours > PROOF_MAX_HOURS:
-                alarm(client, f"Proofing time exceeded {hours:.2f} h (> {PROOF_MAX_HOURS} h).")
-            return
+        m_num_unit = RE_TIMER_UNIT.search(payload)
+        if not m_num_unit:
+            return False
+        val = float(m_num_unit.group(1))
+        unit = m_num_unit.group(2).lower()
+        hours = val if unit.startswith('h') else (val / 60.0)
+    da.add_IOT_data(metric_name('TimerHours'), da.timestamp(), hours)
+    evaluate(client, 'TimerHours', hours)
+    return True
+
+def parse_oven(client, payload):
+    # "From: Oven OvenTemp: 185" | "Oven: 185"
+    mo = RE_OVEN_TEMP.search(payload)
+    if not mo:
+        return False
+    # ההחזרה של re כאן נותנת מספר בקבוצה האחרונה — ניקח אותה באופן כללי:
+    t = float(mo.groups()[-1])
+    da.add_IOT_data(metric_name('OvenTemp'), da.timestamp(), t)
+    evaluate(client, 'OvenTemp', t)
+    return True
+
+def parse_vibration(client, payload):
+    # "From: Vibration AxisX: <v>,<v>,... AxisY: ... AxisZ: ..."  (בלוק דגימות לציר — dataAnalyzer קורא AxisX/Y/Z)
+    wrote_something = False
+    ts = da.timestamp()
+    for axis, vals in RE_VIB_AXIS.findall(payload):
+        name = metric_name(axis)
+        for v in vals.split(','):
+            if v:
+                da.add_IOT_data(name, ts, v); wrote_something = True   # id שומר את סדר הדגימות בתוך הבלוק
+    return wrote_something
+
+# === תאימות לאחור (אם נשארו אמולטורים ישנים) ===
+def parse_legacy_dht(client, payload):
+    # DHT case: 'From: DHT-1 Temperature: 25 Humidity: 40'
+    try:
+        value = payload.split(' Temperature: ')[1].split(' Humidity: ')[0]
+        dev = payload.split('From: ')[1].split(' Temperature: ')[0]
+    except Exception:
+        return False
+    da.add_IOT_data(metric_name(dev), da.timestamp(), value)
+    return True
 
-    if topic.endswith('/oven-1/pub') or 'Oven' in payload:
-        mo = re.search(r'(OvenTemp|Temp):\s*' + _num, payload, re.I)
-        if mo:
-            # ההחזרה של re כאן נותנת מספר בקבוצה האחרונה — ניקח אותה באופן כללי:
-            val = mo.groups()[-1]
-            t = float(val)
-            da.add_IOT_data('OvenTemp', da.timestamp(), t); wrote_something = True
-            if t >= OVEN_READY_TEMP:
-                alarm(client, f"Oven reached target temperature: {t:.0f}°C (≥ {OVEN_READY_TEMP:.0f}°C).")
-            return
+def parse_legacy_meter(client, payload):
+    # Elec Meter case: '... Electricity: <num> Sensitivity: <num>'
+    elec = payload.split(' Electricity: ')[1].split(' Sensitivity: ')[0]
+    sens = payload.split(' Sensitivity: ')[1]
+    da.add_IOT_data(metric_name('ElectricityMeter'), da.timestamp(), elec)
+    da.add_IOT_data(metric_name('SensitivityMeter'), da.timestamp(), sens)
+    return True
 
-    # === תאימות לאחור (אם נשארו אמולטורים ישנים) ===
+class TopicRouter:
+    """
+    Dispatch by exact device segment of the topic ('{TOPIC_BASE}/<dev>/pub')
+    via a dict lookup; payload sniffing is only a fallback. Counts hits and
+    misses per route.
+    """
 
-    # DHT case: 'From: DHT-1 Temperature: 25 Humidity: 40'
-    if 'DHT' in payload and ' Temperature: ' in payload:
-        try:
-            value = payload.split(' Temperature: ')[1].split(' Humidity: ')[0]
-            dev = payload.split('From: ')[1].split(' Temperature: ')[0]
-            da.add_IOT_data(dev, da.timestamp(), value)
-            return
-        except Exception:
-            pass
+    def __init__(self, routes, fallbacks):
+        self.routes = dict(routes)          # dev segment -> parser
+        self.fallbacks = list(fallbacks)    # [(name, predicate, parser)]
+        self.stats = {}                     # route name -> {'hit': n, 'miss': n}
+        for name in list(self.routes) + [f[0] for f in self.fallbacks] + ['unrouted']:
+            self.stats.setdefault(name, {'hit': 0, 'miss': 0})
+
+    @staticmethod
+    def device_of(topic):
+        parts = topic.rsplit('/', 2)
+        if len(parts) == 3 and parts[2] == 'pub':
+            return parts[1]
+        return parts[-1]
+
+    def _count(self, name, ok):
+        self.stats[name]['hit' if ok else 'miss'] += 1
+
+    def dispatch(self, client, topic, payload):
+        dev = self.device_of(topic)
+        parser = self.routes.get(dev)
+        if parser is not None:
+            ok = parser(client, payload)
+            self._count(dev, ok)
+            if ok:
+                return True
+        for name, predicate, parser in self.fallbacks:
+            if predicate(payload):
+                ok = parser(client, payload)
+                self._count(name, ok)
+                if ok:
+                    return True
+        self._count('unrouted', False)
+        return False
+
+ROUTER = TopicRouter(
+    routes={
+        'env-1':    parse_env,
+        'doughH-1': parse_dough,
+        'dough-1':  parse_dough,   # שם ישן
+        'rise-1':   parse_rise,
+        'timer-1':  parse_timer,
+        'oven-1':   parse_oven,
+        'vol-1':    parse_volume,
+        'vib-1':    parse_vibration,
+    },
+    fallbacks=[
+        ('sniff:env',    lambda p: 'AirEnv' in p, parse_env),
+        ('sniff:dough',  lambda p: 'DoughMoisture' in p or 'Moisture:' in p, parse_dough),
+        ('sniff:volume', lambda p: 'VolumeSensor' in p or 'Volume:' in p, parse_volume),
+        ('sniff:rise',   lambda p: 'Rise:' in p, parse_rise),
+        ('sniff:timer',  lambda p: 'Timer' in p, parse_timer),
+        ('sniff:oven',   lambda p: 'Oven' in p, parse_oven),
+        ('sniff:vib',    lambda p: 'Vibration' in p and 'Axis' in p, parse_vibration),
+        ('sniff:dht',    lambda p: 'DHT' in p and ' Temperature: ' in p, parse_legacy_dht),
+        ('sniff:meter',  lambda p: 'Meter' in p and ' Electricity: ' in p and ' Sensitivity: ' in p, parse_legacy_meter),
+    ],
+)
+
+im.gauge("unrouted_messages", lambda: ROUTER.stats['unrouted']['miss'], "messages no parser accepted")
+
+# ------------------ תור קליטה (ingest.py) ------------------
+# מחלקת metric לפי מקטע ההתקן ב-topic — לכל מחלקה מדיניות עומס משלה (ingest_policy ב-init.py)
+INGEST_CLASSES = {
+    'env-1': 'env', 'doughH-1': 'dough', 'dough-1': 'dough', 'rise-1': 'rise',
+    'timer-1': 'timer', 'oven-1': 'oven', 'vol-1': 'volume', 'vib-1': 'vib',
+}
+INGEST = None   # IngestQueue — נוצר ב-start_ingest (בלעדיו on_message מעבד ישירות, כמו קודם)
+
+def ingest_class(topic):
+    return INGEST_CLASSES.get(TopicRouter.device_of(topic), 'other')
+
+def ingest_one(client, topic, payload, t_recv):
+    im.observe("ingest_wait", tracing.now() - t_recv)   # זמן המתנה בתור
+    insert_and_evaluate(client, topic, payload, t_recv)
+
+def start_ingest(client, worker=True):
+    """Create the bounded ingest queue (and its consumer thread unless worker=False, as in async mode)."""
+    global INGEST
+    INGEST = IngestQueue(ingest_class)
+    im.gauge("ingest_queue_depth", INGEST.qsize, "messages waiting for the ingest worker")
+    if not worker:
+        return None
+    return IngestWorker(INGEST, lambda topic, payload, t_recv: ingest_one(client, topic, payload, t_recv)).start()
 
-    # Elec Meter case: '... Electricity: <num> Sensitivity: <num>'
-    if 'Meter' in payload and ' Electricity: ' in payload and ' Sensitivity: ' in payload:
-        elec = payload.split(' Electricity: ')[1].split(' Sensitivity: ')[0]
-        sens = payload.split(' Sensitivity: ')[1]
-        da.add_IOT_data('ElectricityMeter', da.timestamp(), elec)
-        da.add_IOT_data('SensitivityMeter', da.timestamp(), sens)
+def stop_ingest(worker, timeout=5.0):
+    if worker is None:
         return
+    if not worker.stop(timeout):
+        ic(f"shutdown: {INGEST.qsize()} messages left undrained")
+    if INGEST.shed_total():
+        ic(f"ingest shed: {dict((f'{c}/{r}', n) for (c, r), n in INGEST.shed.items())}")
+
+def insert_and_evaluate(client, topic, payload, t_recv=None):
+    """
+    מזהה את סוג ההודעה לפי ה־topic (ואם אין התאמה — לפי התוכן), כותב ל־DB ומתריע אם ערכים מחוץ לספים.
+    מאפשר גם תאימות לאחור (DHT / ElecMeter).
+    t_recv — tracing.now() של הגעת ההודעה (כשהיא עברה תור לפני כן, במצב async).
+    """
+    _ctx.room = room_of(topic)
+    payload, trace = tracing.split(payload)   # הפרסרים לא רואים את החותמת
+    if trace:
+        dev = TRACER.received(topic, trace)
+        TRACER.record("mgr_receive", dev, trace, t_recv)
+    t0 = im.now()
+    ok = ROUTER.dispatch(client, topic, payload)
+    im.observe("dispatch", im.now() - t0)   # פענוח + כתיבה לתור + בדיקת ספים (count = מספר ההודעות)
+    if trace and ok:
+        TRACER.record("mgr_parse", dev, trace)
+        da.on_IOT_persisted(lambda committed: committed and TRACER.record("mgr_persist", dev, trace))
+    return ok
+
+def report_traces(client=None, final=False):
+    """דוח השהייה מקצה לקצה (trace_report_s), ובסוף הריצה — תמיד, אם היו הודעות עם חותמת."""
+    if final:
+        if TRACER.traced:
+            print(TRACER.report(), flush=True)
+    else:
+        TRACER.maybe_report()
 
 # ------------------ בדיקות מחזוריות מול ה-DB ------------------
-def _last_float(table_name, dev_name):
-    df = da.fetch_data(db_name, table_name, dev_name)
-    if df is None or len(df) == 0:
-        return None
-    try:
-        return float(df['value'].iloc[-1])
-    except Exception:
-        return None
+def check_DB_for_change(client, rooms=None):
+    """בדיקת ספים לכל חדר ש-process זה אחראי עליו (ברירת מחדל: חדר הבית)."""
+    t0 = im.now()
+    RULES.maybe_reload()   # rules.json השתנה → כללים חדשים בלי restart
+    for room in rooms or (HOME_ROOM,):
+        _ctx.room = room
+        _check_room(client)
+    _ctx.room = HOME_ROOM
+    ALARMS.flush()   # מעברי מצב שהצטברו (מכל הנתיבים) — טרנזקציה אחת
+    im.observe("threshold_check", im.now() - t0)
+
+def _check_room(client):
+    # הערך האחרון של כל metric שיש לו כללים — אצווה אחת דרך המסכות של RULES; אותם מפתחות כמו
+    # בנתיב ההודעות, כך שחריגה שכבר פורסמה לא תפורסם שוב בכל מחזור
+    bases, keys, values, stamps = [], [], [], []
+    for base in RULES.rules.metrics():
+        key = metric_name(base)
+        ts, v = da.get_latest(key, db_name)
+        if v is None:
+            continue
+        bases.append(base); keys.append(key); values.append(v); stamps.append(da.ts_to_ms(ts) / 1000.0)
+    if not bases:
+        return
+    res = RULES.evaluate_batch(bases, keys, values, stamps)
+    for key, cond, v, bad, ok, text, text_ok in RULES.findings(res):
+        msg = ALARMS.check(key, cond, v, bad, ok, text, text_ok)
+        if msg:
+            alarm(client, msg)
 
-def check_DB_for_change(client):
-    # AirEnv
-    t = _last_float('data', 'AirEnv_Temperature')
-    if t is not None and not (AIR_TEMP_RANGE[0] <= t <= AIR_TEMP_RANGE[1]):
-        alarm(client, f"Air temperature out of range: {t:.1f}°C (target {AIR_TEMP_RANGE[0]}–{AIR_TEMP_RANGE[1]}°C)")
-    h = _last_float('data', 'AirEnv_Humidity')
-    if h is not None and not (AIR_HUM_RANGE[0] <= h <= AIR_HUM_RANGE[1]):
-        alarm(client, f"Air humidity out of range: {h:.0f}% (target {AIR_HUM_RANGE[0]}–{AIR_HUM_RANGE[1]}%)")
-
-    # Dough moisture / hydration
-    m = _last_float('data', 'DoughMoisture')
-    if m is not None and not (DOUGH_MOIST_RANGE[0] <= m <= DOUGH_MOIST_RANGE[1]):
-        alarm(client, f"Dough moisture out of range: {m:.0f}% (target {DOUGH_MOIST_RANGE[0]}–{DOUGH_MOIST_RANGE[1]}%)")
-    hy = _last_float('data', 'Hydration')
-    if hy is not None and not (HYDRATION_RANGE[0] <= hy <= HYDRATION_RANGE[1]):
-        alarm(client, f"Hydration ratio out of range: {hy:.2f} (target {HYDRATION_RANGE[0]}–{HYDRATION_RANGE[1]})")
-
-    # Volume
-    v = _last_float('data', 'DoughVolume')
-    if v is not None and v >= VOLUME_TARGET_MIN:
-        alarm(client, f"Dough has proofed enough (volume ×{v:.2f} ≥ {VOLUME_TARGET_MIN}).")
-
-    # Timer
-    th = _last_float('data', 'TimerHours')
-    if th is not None and th > PROOF_MAX_HOURS:
-        alarm(client, f"Proofing time exceeded {th:.2f} h (> {PROOF_MAX_HOURS} h).")
-
-    # Oven
-    ot = _last_float('data', 'OvenTemp')
-    if ot is not None and ot >= OVEN_READY_TEMP:
-        alarm(client, f"Oven reached target temperature: {ot:.0f}°C (≥ {OVEN_READY_TEMP:.0f}°C).")
+EVENT_CONSUMER = "manager"
 
 def check_Data(client):
-    """שליחת פקודות לאקטואטורים אם שונו ברשומת iot_devices (special='changed')."""
+    """שליחת פקודות לאקטואטורים לפי אירועי שינוי חדשים ב-outbox (device_events) מעבר ל-cursor של המנהל."""
     try:
-        rows = da.check_changes('iot_devices')  # מחזיר רשימות dict-ים
+        rows, last_id = da.fetch_device_events(EVENT_CONSUMER)
         for row in rows:
             topic = row.get('dev_pub_topic') or f"{TOPIC_BASE}/actuator"
             dev_type = (row.get('dev_type') or '').lower()
@@ -261,36 +446,396 @@ def check_Data(client):
                     enable(client, ALARM_TOPIC, msg, retain=ALARM_RETAIN)
                 else:
                     ic(f"[suppressed external alarm] {ALARM_TOPIC} {msg}")
-                da.update_IOT_status(int(row['id']))
             else:
                 msg = 'actuated'
                 enable(client, topic, msg, retain=False)
-                da.update_IOT_status(int(row['id']))
+        if last_id:
+            # אישור כל האצווה בטרנזקציה אחת
+            da.ack_device_events(EVENT_CONSUMER, last_id, [row['id'] for row in rows])
     except Exception as e:
         ic(f"check_Data error: {e}")
 
+# ------------------ ניטור רעידות (dataAnalyzer.vib_monitor) ------------------
+def start_vib_monitor(client):
+    """Run dataAnalyzer.vib_monitor on a daemon thread (vib_monitor_on). Returns its stop Event, or None."""
+    if not vib_monitor_on:
+        return None
+    # dataAnalyzer עושה "from manager import *" — כש-manager רץ כ-__main__ לא לטעון אותו פעם שנייה
+    sys.modules.setdefault("manager", sys.modules[__name__])
+    try:
+        import dataAnalyzer
+    except ImportError as e:   # scipy / matplotlib לא מותקנים
+        ic(f"vibration monitor disabled: {e}")
+        return None
+    stop = threading.Event()
+    threading.Thread(target=dataAnalyzer.vib_monitor, args=(client,),
+                     kwargs={"poll_s": vib_poll_s, "stop": stop}, name="vib-monitor", daemon=True).start()
+    return stop
+
+def stop_vib_monitor(stop):
+    if stop is not None:
+        stop.set()
+
 # ------------------ Main loop ------------------
+def _serve_metrics(port):
+    try:
+        if im.serve(port):
+            ic(f"metrics on http://127.0.0.1:{port}/metrics")
+    except OSError as e:
+        ic(f"metrics endpoint disabled: {e}")
+
 def main():
+    _serve_metrics(metrics_port)
+    da.ensure_schema()   # לפני ה-watcher (cursor) וה-pruner — גם על DB חדש/ישן
     cname = "Manager-"
     client = client_init(cname)
+    ingest = start_ingest(client)
     client.loop_start()
     # Subscribe לכל העץ תחת בסיס הנושא
     client.subscribe(f"{TOPIC_BASE}/#")
 
+    ALARMS.load()   # חריגות פעילות מהריצה הקודמת — בלי raise כפול
+    watcher = da.DeviceEventWatcher()
+    pruner = da.RetentionPruner(); pruner.start()
+    vib = start_vib_monitor(client)
+    next_check = 0.0
     try:
+        check_Data(client)               # אירועים שהצטברו בזמן שהמנהל היה למטה
         while conn_time == 0:
-            check_DB_for_change(client)  # בדיקת חריגות מחזורית
-            time.sleep(manag_time)
-            check_Data(client)           # הפעלת אקטואטורים לפי DB
-            time.sleep(3)
+            if time.monotonic() >= next_check:
+                check_DB_for_change(client)  # בדיקת חריגות מחזורית
+                report_traces(client)
+                next_check = time.monotonic() + manag_time
+            # מתעוררים מיד כשנרשם שינוי בהתקן — לא מחכים ל-manag_time
+            if watcher.wait(max(0.0, next_check - time.monotonic())):
+                check_Data(client)       # הפעלת אקטואטורים לפי DB
         ic("con_time ending")
     except KeyboardInterrupt:
         client.disconnect()
         ic("interrrupted by keyboard")
 
+    stop_vib_monitor(vib)
+    watcher.close()
+    pruner.stop(timeout=5)
     client.loop_stop()
     client.disconnect()
+    stop_ingest(ingest)     # מה שכבר בתור מעובד לפני סגירת הכותב
+    ALARMS.flush()
+    da.close_IOT_writer()   # ריקון התור לפני יציאה — בלי לאבד שורות
+    report_traces(final=True)
     ic("End manager run script")
 
+# ------------------ מצב asyncio ------------------
+# paho (thread רשת) -> asyncio.Queue -> ingest task; בדיקות ספים ואקטואטורים כמשימות מתוזמנות.
+# כל המשימות כותבות דרך אותו IOTDataWriter של data_acq.
+
+def ingest_batch(q, client, max_n=256, timeout=0.5) -> int:
+    """Pull one batch and parse/store it. Blocking (get_batch, the writer's bounded queue, rules) — thread only."""
+    items = q.get_batch(max_n, timeout)
+    for topic, payload, t_recv in items:
+        try:
+            ingest_one(client, topic, payload, t_recv)
+        except Exception as e:
+            ic(f"ingest error: {e}")
+    return len(items)
+
+async def _ingest(q, client):
+    while True:
+        # אצווה שלמה ב-thread אחד — IOTDataWriter.put חוסם כשתור הכתיבה מלא, וה-event loop לא נעצר
+        if not await asyncio.to_thread(ingest_batch, q, client):
+            if q.closed:
+                return   # נסגר והתרוקן
+
+async def _every(period, fn, client):
+    while True:
+        try:
+            await asyncio.to_thread(fn, client)   # sqlite חוסם — לא על ה-event loop
+        except Exception as e:
+            ic(f"{fn.__name__} error: {e}")
+        await asyncio.sleep(period)
+
+async def _actuators(client, watcher):
+    await asyncio.to_thread(check_Data, client)
+    while True:
+        # ממתינים לאירוע שינוי (או לפחות פעם ב-actuator_period)
+        await asyncio.to_thread(watcher.wait, actuator_period)
+        await asyncio.to_thread(check_Data, client)
+
+async def main_async(drain_timeout=5.0):
+    def on_message_async(client, userdata, msg):
+        payload = msg.payload.decode("utf-8", "ignore")
+        INGEST.put(msg.topic, payload, tracing.now())   # תור חסום עם מדיניות עומס (ingest.py)
+
+    _serve_metrics(metrics_port)
+    da.ensure_schema()
+    ALARMS.load()   # חריגות פעילות מהריצה הקודמת — בלי raise כפול
+    watcher = da.DeviceEventWatcher()
+    pruner = da.RetentionPruner(); pruner.start()
+    client = client_init("Manager-")
+    client.on_message = on_message_async
+    start_ingest(client, worker=False)
+    client.loop_start()
+    client.subscribe(f"{TOPIC_BASE}/#")
+    vib = start_vib_monitor(client)   # thread משלו — לולאה חוסמת (sqlite + FFT), לא על ה-event loop
+
+    ingest_task = asyncio.create_task(_ingest(INGEST, client), name="ingest")
+    tasks = [
+        ingest_task,
+        asyncio.create_task(_every(db_check_period, check_DB_for_change, client), name="thresholds"),
+        asyncio.create_task(_actuators(client, watcher), name="actuators"),
+        asyncio.create_task(_every(db_check_period, report_traces, client), name="traces"),
+    ]
+    try:
+        if conn_time:
+            await asyncio.sleep(conn_time)
+            ic("con_time ending")
+        else:
+            await asyncio.gather(*tasks)
+    finally:
+        client.loop_stop()   # לא נכנסות הודעות חדשות
+        INGEST.close()
+        try:
+            await asyncio.wait_for(asyncio.shield(ingest_task), drain_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            ic(f"shutdown: {INGEST.qsize()} messages left undrained")
+        if INGEST.shed_total():
+            ic(f"ingest shed: {dict((f'{c}/{r}', n) for (c, r), n in INGEST.shed.items())}")
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        stop_vib_monitor(vib)
+        client.disconnect()
+        watcher.close()
+        pruner.stop(timeout=5)
+        ALARMS.flush()
+        da.close_IOT_writer()
+        report_traces(final=True)
+        ic("End manager run script (async)")
+
+# ------------------ מצב shards (מנהל מרובה חדרים) ------------------
+# supervisor (התהליך הראשי) מריץ N תהליכי worker. כל worker: לקוח MQTT משלו, IOTDataWriter משלו
+# לאותו קובץ SQLite (WAL מסדר את הכותבים), ודיווח בריאות תקופתי ל-supervisor דרך mp.Queue.
+# worker 0 בלבד מריץ את האקטואטורים (device_events) ואת ה-RetentionPruner — כדי שלא יופעלו פעמיים.
+
+def shard_of(room, n_shards):
+    """Stable room -> shard (crc32, not hash(): זהה בכל התהליכים)."""
+    return zlib.crc32(room.encode("utf-8")) % n_shards
+
+def shard_rooms(shard, n_shards, room_list=None):
+    """Known rooms owned by shard: round-robin על הרשימה הממוינת — חלוקה מאוזנת."""
+    return sorted(room_list or rooms)[shard::n_shards]
+
+def shard_subscriptions(shard, n_shards, mode=None):
+    mode = mode or shard_mode
+    if mode == "rooms":
+        return [f"{TOPIC_ROOT}/{r}/#" for r in shard_rooms(shard, n_shards)]
+    if mode == "shared":
+        return [f"$share/{shard_group}/{TOPIC_ROOT}/#"]
+    if mode == "hash":
+        return [f"{TOPIC_ROOT}/#"]
+    raise ValueError(f"unknown shard_mode {mode!r}")
+
+def shard_worker(shard, n_shards, stats_q, stop, mode=None):
+    """Entry point of one worker process (top-level — נדרש ל-spawn)."""
+    mode = mode or shard_mode
+    ic.configureOutput(prefix=lambda: f'{datetime.now()}  Manager[{shard}]|> ')
+    owned = shard_rooms(shard, n_shards) if mode == "rooms" else []
+    counts = {'messages': 0, 'skipped': 0}
+    seen_rooms = set(owned)
+
+    def on_message_shard(client, userdata, msg):
+        t0 = im.now()
+        room = room_of(msg.topic)
+        if mode == "hash" and shard_of(room, n_shards) != shard:
+            counts['skipped'] += 1   # של worker אחר
+            return
+        counts['messages'] += 1
+        seen_rooms.add(room)
+        INGEST.put(msg.topic, msg.payload.decode("utf-8", "ignore"), tracing.now())
+        im.observe("receive", im.now() - t0)
+
+    if metrics_port:
+        _serve_metrics(metrics_port + 1 + shard)
+    da.ensure_schema()   # כל ה-workers עוברים דרך migrate_schema (BEGIN IMMEDIATE) — רק הראשון מגר
+    client = client_init(f"Manager-{shard}-")
+    client.on_message = on_message_shard
+    ingest = start_ingest(client)
+    client.loop_start()
+    for topic in shard_subscriptions(shard, n_shards, mode):
+        client.subscribe(topic)
+    ic(f"shard {shard}/{n_shards} ({mode}) rooms={owned}")
+
+    owner = shard == 0
+    ALARMS.load()
+    watcher = da.DeviceEventWatcher() if owner else None
+    pruner = da.RetentionPruner() if owner else None
+    if pruner:
+        pruner.start()
+    vib = start_vib_monitor(client) if owner else None
+    started = time.monotonic()
+    next_check = next_stats = 0.0
+    try:
+        if owner:
+            check_Data(client)
+        while not stop.is_set():
+            now = time.monotonic()
+            if now >= next_check:
+                check_DB_for_change(client, sorted(seen_rooms))
+                report_traces(client)
+                next_check = now + manag_time
+            if now >= next_stats:
+                w = da._writer
+                try:
+                    stats_q.put_nowait({
+                        'shard': shard, 'pid': os.getpid(), 'uptime_s': now - started,
+                        **counts,
+                        'errors': ingest.errors,
+                        'shed': INGEST.shed_total(),
+                        'ingest_depth': INGEST.qsize(),
+                        'rooms': sorted(seen_rooms),
+                        'rows_written': w.rows_written if w else 0,
+                        'writer_errors': w.errors if w else 0,
+                        'queue_depth': w._q.qsize() if w else 0,
+                        'unrouted': ROUTER.stats['unrouted']['miss'],
+                    })
+                except Exception:
+                    pass   # supervisor עסוק — הדיווח הבא יגיע
+                next_stats = now + shard_stats_period
+            timeout = min(next_check, next_stats) - time.monotonic()
+            if owner:
+                if watcher.wait(max(0.0, min(timeout, actuator_period))):
+                    check_Data(client)
+            else:
+                stop.wait(max(0.0, timeout))
+    except KeyboardInterrupt:
+        pass   # Ctrl+C מגיע לכל הקבוצה — ה-supervisor מנהל את הסגירה
+    finally:
+        stop_vib_monitor(vib)
+        client.loop_stop()
+        client.disconnect()
+        stop_ingest(ingest)
+        if watcher:
+            watcher.close()
+        if pruner:
+            pruner.stop(timeout=5)
+        ALARMS.flush()
+        da.close_IOT_writer()
+        report_traces(final=True)
+
+class ShardSupervisor:
+    """
+    Start n_shards worker processes, restart the ones that exit or stop
+    reporting (exponential backoff up to shard_backoff_max), and aggregate
+    their periodic health reports.
+    """
+
+    def __init__(self, n_shards, mode=None):
+        self.n = int(n_shards)
+        self.mode = mode or shard_mode
+        ensure_broker()   # ב-supervisor ולא ב-worker — כדי שהפעלה חוזרת של worker לא תפיל את הברוקר
+        self._mp = mp.get_context("spawn")   # אותה התנהגות ב-Windows וב-Linux; בלי fork של threads
+        self.stats_q = self._mp.Queue(maxsize=10 * self.n)
+        self.stop_evt = self._mp.Event()
+        self.procs = [None] * self.n
+        self.health = [{} for _ in range(self.n)]
+        self.last_report = [0.0] * self.n
+        self.restarts = [0] * self.n
+        self._backoff = [1.0] * self.n
+        self._not_before = [0.0] * self.n
+
+    def _start(self, i):
+        p = self._mp.Process(target=shard_worker, args=(i, self.n, self.stats_q, self.stop_evt, self.mode),
+                             name=f"manager-shard-{i}", daemon=False)
+        p.start()
+        self.procs[i] = p
+        self.last_report[i] = time.monotonic()   # חסד עד הדיווח הראשון
+
+    def _drain_stats(self, timeout):
+        try:
+            rep = self.stats_q.get(timeout=timeout)
+        except Exception:
+            return
+        while rep is not None:
+            i = rep['shard']
+            self.health[i] = rep
+            self.last_report[i] = time.monotonic()
+            if rep['uptime_s'] > 60:
+                self._backoff[i] = 1.0   # רץ יציב — מאפסים backoff
+            try:
+                rep = self.stats_q.get_nowait()
+            except Exception:
+                rep = None
+
+    def _supervise_once(self):
+        now = time.monotonic()
+        for i, p in enumerate(self.procs):
+            alive = p is not None and p.is_alive()
+            if alive and now - self.last_report[i] > shard_stale_s:
+                ic(f"shard {i} (pid {p.pid}) stopped reporting — terminating")
+                p.terminate(); p.join(5)
+                alive = False
+            if alive or now < self._not_before[i]:
+                continue
+            if p is not None:
+                self.restarts[i] += 1
+                ic(f"shard {i} exited (code {p.exitcode}); restart #{self.restarts[i]} in {self._backoff[i]:.0f}s")
+                self.procs[i] = None
+                self._not_before[i] = now + self._backoff[i]
+                self._backoff[i] = min(self._backoff[i] * 2, shard_backoff_max)
+                continue
+            self._start(i)
+
+    def summary(self):
+        """Aggregated health across shards."""
+        keys = ('messages', 'skipped', 'errors', 'rows_written', 'writer_errors', 'queue_depth', 'unrouted',
+                'shed', 'ingest_depth')
+        total = {k: sum(h.get(k, 0) for h in self.health) for k in keys}
+        total['alive'] = sum(1 for p in self.procs if p is not None and p.is_alive())
+        total['shards'] = self.n
+        total['restarts'] = sum(self.restarts)
+        return total
+
+    def run(self, duration=0):
+        for i in range(self.n):
+            self._start(i)
+        deadline = time.monotonic() + duration if duration else None
+        next_log = time.monotonic() + shard_stats_period
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                self._drain_stats(timeout=0.5)
+                self._supervise_once()
+                if time.monotonic() >= next_log:
+                    ic(f"shards: {self.summary()}")
+                    next_log = time.monotonic() + shard_stats_period
+        except KeyboardInterrupt:
+            ic("interrrupted by keyboard")
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10.0):
+        self.stop_evt.set()
+        for p in self.procs:
+            if p is not None:
+                p.join(timeout)
+                if p.is_alive():
+                    p.terminate(); p.join(2)
+        self._drain_stats(timeout=0)
+        ic(f"End manager supervisor: {self.summary()}")
+
+def _arg_int(flag, default):
+    argv = sys.argv[1:]
+    if flag in argv and argv.index(flag) + 1 < len(argv):
+        return int(argv[argv.index(flag) + 1])
+    return default
+
 if __name__ == "__main__":
-    main()
+    n_shards = _arg_int("--shards", manager_shards)
+    if n_shards > 1:
+        ShardSupervisor(n_shards).run(conn_time)
+    elif manager_async or "--async" in sys.argv[1:]:
+        try:
+            asyncio.run(main_async())
+        except KeyboardInterrupt:
+            ic("interrrupted by keyboard")
+    else:
+        main()
@@ -0,0 +1,178 @@
+# mqtt_mux.py — one shared MQTT connection per process, multiplexed between many emulated devices
+#
+#   mux = get_mux()
+#   mux.acquire()                                   # חיבור TCP + thread רשת אחד, לא משנה כמה מכשירים
+#   mux.publish(topic, payload)
+#   mux.subscribe(f"{TOPIC_BASE}/alarm", handler)   # handler(client, userdata, msg) — כמו on_message של paho
+#   mux.unsubscribe(f"{TOPIC_BASE}/alarm", handler)
+#   mux.release()                                   # המשתמש האחרון סוגר את החיבור
+#
+# ניתוב הודעה נכנסת: topic → רשימת handlers (exact dict + wildcards דרך topic_matches_sub),
+# נשמרת במטמון לכל topic עד שינוי המנויים הבא. הרשמה חוזרת לכל המסננים אחרי reconnect.
+
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from broker import ensure_broker
+
+try:
+    from init import resolve_broker, broker_port, username, password
+except Exception:
+    def resolve_broker():
+        return "broker.hivemq.com"
+    broker_port, username, password = 1883, "", ""
+
+def make_client(client_id: str, on_message=None, on_log=None):
+    client = mqtt.Client(
+        client_id=client_id,
+        clean_session=True,
+        protocol=mqtt.MQTTv311,
+        transport="tcp",
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+    )
+    if on_message: client.on_message = on_message
+    if on_log:     client.on_log     = on_log
+    return client
+
+class MqttMux:
+    """
+    A single paho client shared by every emulated device in the process.
+    Devices acquire()/release() it (reference counted), publish through it,
+    and register per-filter handlers that incoming messages are fanned out to.
+    """
+
+    def __init__(self, client_id: str | None = None, host: str | None = None, port: int | None = None):
+        self.client_id = client_id or f"emu-mux-{int(time.time()*1000) % 100000}"
+        self.host = host
+        self.port = int(port or broker_port)
+        self.client = None
+        self.connected = False
+        self.users = 0
+        self.published = 0
+        self.delivered = 0
+        self._subs = {}     # filter -> [handler, ...]
+        self._exact = {}    # filter בלי wildcards -> handlers (ניתוב O(1))
+        self._wild = []     # [(filter, handlers)]
+        self._route = {}    # topic -> handlers (מטמון; מתאפס בכל שינוי מנויים)
+        self._lock = threading.Lock()
+
+    # ---- חיבור משותף ----
+    def acquire(self):
+        """Connect on first use; later calls only bump the user count. Raises on connect failure."""
+        with self._lock:
+            if self.client is None:
+                client = make_client(self.client_id, on_message=self._on_message)
+                client.on_connect = self._on_connect
+                client.on_disconnect = self._on_disconnect
+                if username:
+                    client.username_pw_set(username, password)
+                if self.host is None:
+                    ensure_broker()
+                client.connect(self.host or resolve_broker(), self.port, keepalive=60)
+                client.loop_start()
+                self.client = client
+            self.users += 1
+            return self.client
+
+    def release(self):
+        """Drop one user; the last one stops the network thread and disconnects."""
+        with self._lock:
+            self.users = max(0, self.users - 1)
+            if self.users or self.client is None:
+                return
+            client, self.client, self.connected = self.client, None, False
+        try:
+            client.loop_stop()
+            client.disconnect()
+        except Exception:
+            pass
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        self.connected = not reason_code.is_failure
+        if self.connected:
+            with self._lock:
+                filters = list(self._subs)
+            for f in filters:   # clean_session — הברוקר שכח את המנויים
+                client.subscribe(f, qos=0)
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        self.connected = False
+
+    # ---- פרסום ----
+    def publish(self, topic, payload, qos=0, retain=False):
+        client = self.client
+        if client is None:
+            return None
+        self.published += 1
+        return client.publish(topic, payload, qos=qos, retain=retain)
+
+    # ---- מנויים + ניתוב ----
+    def _rebuild(self):
+        self._exact = {f: list(h) for f, h in self._subs.items() if "+" not in f and "#" not in f}
+        self._wild = [(f, list(h)) for f, h in self._subs.items() if "+" in f or "#" in f]
+        self._route = {}
+
+    def subscribe(self, topic_filter: str, handler, qos=0):
+        with self._lock:
+            handlers = self._subs.setdefault(topic_filter, [])
+            first = not handlers
+            handlers.append(handler)
+            self._rebuild()
+            client = self.client
+        if first and client is not None:
+            client.subscribe(topic_filter, qos=qos)
+
+    def unsubscribe(self, topic_filter: str, handler=None):
+        """Remove `handler` (or all handlers) from a filter; the broker unsubscribe goes out when none remain."""
+        with self._lock:
+            handlers = self._subs.get(topic_filter)
+            if handlers is None:
+                return
+            if handler is None:
+                handlers.clear()
+            elif handler in handlers:
+                handlers.remove(handler)
+            last = not handlers
+            if last:
+                del self._subs[topic_filter]
+            self._rebuild()
+            client = self.client
+        if last and client is not None:
+            client.unsubscribe(topic_filter)
+
+    def handlers_for(self, topic: str):
+        hs = self._route.get(topic)
+        if hs is None:
+            hs = list(self._exact.get(topic, ()))
+            for f, fh in self._wild:
+                if mqtt.topic_matches_sub(f, topic):
+                    hs.extend(fh)
+            hs = list(dict.fromkeys(hs))   # handler שתואם כמה מסננים מקבל את ההודעה פעם אחת
+            self._route[topic] = hs
+        return hs
+
+    def _on_message(self, client, userdata, msg):
+        for h in self.handlers_for(msg.topic):
+            try:
+                h(client, userdata, msg)
+            except Exception as e:   # מכשיר אחד שנכשל לא מפיל את השאר
+                print(f"mux|> handler for {msg.topic} failed: {e}")
+            self.delivered += 1
+
+    def stats(self):
+        return {"users": self.users, "connected": self.connected, "filters": len(self._subs),
+                "published": self.published, "delivered": self.delivered}
+
+_MUX = None
+_MUX_LOCK = threading.Lock()
+
+def get_mux() -> MqttMux:
+    """Process-wide shared multiplexer."""
+    global _MUX
+    if _MUX is None:
+        with _MUX_LOCK:
+            if _MUX is None:
+                _MUX = MqttMux()
+    return _MUX
@@ -1,27 +1,29 @@
 # proofing_dashboard.py — Dough Proofing Dashboard
 # Alerts + beep on any threshold violation; alarm text goes to ALARMS (not Timer/Oven).
 
-import re, sys, time
+import re, sys, time, queue
 import tkinter as tk
 from tkinter import ttk
 import paho.mqtt.client as mqtt
 
+import instrument as im   # receive / ui_frame latency + /metrics
+from rules import load_rules   # ספי התפחה מ-rules.json (אותו מקור כמו המנהל)
+from broker import ensure_broker
+import tracing                 # חותמות trace אופציונליות: ui_receive / ui_render
+from tracing import TRACER
+
 try:
     from init import (
-        broker_ip, broker_port, comm_topic,
-        PROOF_TEMP_MIN, PROOF_TEMP_MAX,
-        PROOF_HUM_MIN, PROOF_HUM_MAX,
-        DOUGH_MOIST_MIN, DOUGH_MOIST_MAX,
-        RISE_TARGET_PCT
+        resolve_broker, broker_port, comm_topic, dashboard_metrics_port
     )
 except Exception:
-    broker_ip = "broker.hivemq.com"
+    def resolve_broker():
+        return "broker.hivemq.com"
     broker_port = 1883
     comm_topic = "pr/Proofing/BakeryA/"
-    PROOF_TEMP_MIN, PROOF_TEMP_MAX = 27.0, 32.0
-    PROOF_HUM_MIN,  PROOF_HUM_MAX  = 70.0, 85.0
-    DOUGH_MOIST_MIN, DOUGH_MOIST_MAX = 55.0, 65.0
-    RISE_TARGET_PCT = 75.0
+    dashboard_metrics_port = 0
+
+RULES = load_rules()
 
 TOPIC_BASE = comm_topic.rstrip("/")
 TOPICS = {
@@ -32,6 +34,12 @@ TOPICS = {
     "alarm": f"{TOPIC_BASE}/alarm",
 }
 
+# שדה בדשבורד -> metric ב-rules.json (אותו evaluator, hysteresis ו-duration כמו המנהל)
+FIELD_METRIC = {"temp": "AirEnv_Temperature", "hum": "AirEnv_Humidity", "dough": "DoughMoisture", "rise": "DoughRise"}
+
+# קצב רענון ה-UI: כל הקריאות שהגיעו בפריים מתמזגות לערך האחרון לכל שדה
+UI_FRAME_MS = 100
+
 def safe_beep(root):
     try:
         if sys.platform.startswith("win"):
@@ -93,104 +101,140 @@ class Dashboard(tk.Tk):
         ).grid(row=row, column=0, columnspan=3, sticky="w")
         row += 1
 
-        # טמפרטורה
-        ttk.Label(
-            self,
-            text=f"    • Temp: {PROOF_TEMP_MIN}-{PROOF_TEMP_MAX}°C",
-            foreground="#555"
-        ).grid(row=row, column=0, columnspan=3, sticky="w")
-        row += 1
-
-        # לחות
-        ttk.Label(
-            self,
-            text=f"    • Humidity: {PROOF_HUM_MIN}-{PROOF_HUM_MAX}%",
-            foreground="#555"
-        ).grid(row=row, column=0, columnspan=3, sticky="w")
-        row += 1
-
-        # לחות בצק
-        ttk.Label(
-            self,
-            text=f"    • Dough Moisture: {DOUGH_MOIST_MIN}-{DOUGH_MOIST_MAX}%",
-            foreground="#555"
-        ).grid(row=row, column=0, columnspan=3, sticky="w")
-        row += 1
-
-        # אחוז תפיחה
-        ttk.Label(
-            self,
-            text=f"    • Rise: ≥ {RISE_TARGET_PCT}%",
-            foreground="#555"
-        ).grid(row=row, column=0, columnspan=3, sticky="w")
-        row += 1
-
-        # anti-spam (מצב אחרון)
-        self.last_alarm = {"temp": False, "hum": False, "dough": False, "rise": False}
+        # טמפרטורה / לחות / לחות בצק / אחוז תפיחה — מתעדכנים כש-rules.json נטען מחדש
+        self.var_targets = {}
+        for key in ("temp", "hum", "dough", "rise"):
+            self.var_targets[key] = tk.StringVar()
+            ttk.Label(
+                self,
+                textvariable=self.var_targets[key],
+                foreground="#555"
+            ).grid(row=row, column=0, columnspan=3, sticky="w")
+            row += 1
+        self.refresh_targets()
+
+        # anti-spam: (metric, cond) שמורמים כרגע — משתנה רק כש-bad / ok של הכלל מתקיים (hysteresis)
+        self.raised = {}
         # “חימוש” — ההתראה תופעל רק אחרי שמתקבלת מדידה חיה ראשונה
         self.armed = {"env": False, "dough": False, "rise": False}
 
+        # תור קריאות מ-thread הרשת של paho; רק pump (ב-thread של Tk) נוגע בווידג'טים
+        self.ui_q = queue.Queue()
+        self._pump_job = self.after(UI_FRAME_MS, self.pump)
+
+    def limits(self, metric: str):
+        """(min, max) of the metric's range rule; unbounded when there is none."""
+        return RULES.rules.range_of(metric) or (float("-inf"), float("inf"))
+
+    def rise_target(self) -> float:
+        t = RULES.rules.target_of("DoughRise")
+        return float("-inf") if t is None else t
+
+    def refresh_targets(self):
+        t_lo, t_hi = self.limits("AirEnv_Temperature")
+        h_lo, h_hi = self.limits("AirEnv_Humidity")
+        d_lo, d_hi = self.limits("DoughMoisture")
+        self.var_targets["temp"].set(f"    • Temp: {t_lo}-{t_hi}°C")
+        self.var_targets["hum"].set(f"    • Humidity: {h_lo}-{h_hi}%")
+        self.var_targets["dough"].set(f"    • Dough Moisture: {d_lo}-{d_hi}%")
+        self.var_targets["rise"].set(f"    • Rise: ≥ {self.rise_target()}%")
+
+    def post(self, field: str, value, trace=None):
+        """Thread-safe: queue a parsed reading for the next UI frame. trace = (device, stamp) or None."""
+        self.ui_q.put((field, value, trace))
+
+    def pump(self):
+        """Drain the queue, keep only the latest value per field, redraw once."""
+        t0 = im.now()
+        if RULES.maybe_reload():
+            self.refresh_targets()
+        latest, traces = {}, {}
+        try:
+            while True:
+                field, value, trace = self.ui_q.get_nowait()
+                if trace:
+                    traces[field] = trace   # רק הערך האחרון בפריים מצויר — רק הוא נמדד ב-ui_render
+                if field == "timer" and field in latest:
+                    # לא לאבד beep שהגיע באמצע הפריים
+                    value = (value[0], value[1] or latest[field][1])
+                latest[field] = value
+        except queue.Empty:
+            pass
+
+        for field, value in latest.items():
+            if field == "env":
+                first = not self.armed["env"]
+                self.armed["env"] = True
+                self.update_env(*value, suppress_alarm=first)
+            elif field == "dough":
+                first = not self.armed["dough"]
+                self.armed["dough"] = True
+                self.update_dough_moist(value, suppress_alarm=first)
+            elif field == "rise":
+                first = not self.armed["rise"]
+                self.armed["rise"] = True
+                self.update_rise(value, suppress_alarm=first)
+            elif field == "timer":
+                self.update_timer(*value)
+            elif field == "alarm":
+                self.var_alarm.set(value)
+        if latest:
+            im.observe("ui_frame", im.now() - t0)
+        if traces:
+            self.update_idletasks()   # הציור בפועל — לפני מדידת ui_render
+            for dev, trace in traces.values():
+                TRACER.record("ui_render", dev, trace)
+        TRACER.maybe_report()
+        self._pump_job = self.after(UI_FRAME_MS, self.pump)
+
     def set_bg(self, widget, ok: bool):
         try: widget.configure(background=("#d1ffd1" if ok else "#ffd6d6"))
         except: pass
 
-    def _alarm_transition(self, key: str, now_bad: bool, msg_bad: str, msg_ok: str | None = None):
-        was_bad = self.last_alarm.get(key, False)
-        if now_bad and not was_bad:
-            self.var_alarm.set(msg_bad)
-            safe_beep(self)
-        elif (not now_bad) and was_bad:
-            if msg_ok:
-                self.var_alarm.set(msg_ok)
-        self.last_alarm[key] = now_bad
+    def judge(self, field: str, value: float, suppress_alarm: bool = False) -> set:
+        """
+        Run the field's compiled rules (RULES.check — same evaluator as the manager)
+        and apply raise/clear transitions. Returns the conds raised after this reading.
+        """
+        metric = FIELD_METRIC[field]
+        now_bad = set()
+        for cond, bad, ok, text, text_ok in RULES.check(metric, metric, value, time.time()):
+            if suppress_alarm:   # מדידה ראשונה: צובעים לפי הערך, בלי התראה ובלי לשנות מצב
+                if bad:
+                    now_bad.add(cond)
+                continue
+            key = (metric, cond)
+            if bad and not self.raised.get(key):
+                self.raised[key] = True
+                msg = text() if text else None
+                if msg:
+                    self.var_alarm.set(msg)
+                safe_beep(self)
+            elif ok and self.raised.get(key):
+                self.raised[key] = False
+                msg = text_ok() if text_ok else None
+                if msg:
+                    self.var_alarm.set(msg)
+        return now_bad | {c for (m, c), on in self.raised.items() if m == metric and on}
 
     # ---- הוספת suppress_alarm להודעה הראשונה ----
     def update_env(self, temp, hum, suppress_alarm: bool = False):
         self.var_temp.set(f"{temp:.1f}")
         self.var_hum.set(f"{hum:.0f}")
         self.pb_hum["value"] = max(0, min(100, hum))
-
-        ok_t = PROOF_TEMP_MIN <= temp <= PROOF_TEMP_MAX
-        ok_h = PROOF_HUM_MIN  <= hum  <= PROOF_HUM_MAX
-
-        self.set_bg(self.e_temp, ok_t)
-        self.set_bg(self.e_hum,  ok_h)
-
-        if not suppress_alarm:
-            self._alarm_transition(
-                "temp", not ok_t,
-                f"Air temperature out of range: {temp:.1f}°C (target {PROOF_TEMP_MIN}–{PROOF_TEMP_MAX}°C)",
-                "Air temperature back in range"
-            )
-            self._alarm_transition(
-                "hum", not ok_h,
-                f"Air humidity out of range: {hum:.0f}% (target {PROOF_HUM_MIN}–{PROOF_HUM_MAX}%)",
-                "Air humidity back in range"
-            )
+        self.set_bg(self.e_temp, not self.judge("temp", temp, suppress_alarm))
+        self.set_bg(self.e_hum,  not self.judge("hum", hum, suppress_alarm))
 
     def update_dough_moist(self, m, suppress_alarm: bool = False):
         self.var_dhm.set(f"{m:.0f}")
         self.pb_dhm["value"] = max(0, min(100, m))
-        ok = DOUGH_MOIST_MIN <= m <= DOUGH_MOIST_MAX
-        self.set_bg(self.e_dhm, ok)
-        if not suppress_alarm:
-            self._alarm_transition(
-                "dough", not ok,
-                f"Dough moisture out of range: {m:.0f}% (target {DOUGH_MOIST_MIN}–{DOUGH_MOIST_MAX}%)",
-                "Dough moisture back in range"
-            )
+        self.set_bg(self.e_dhm, not self.judge("dough", m, suppress_alarm))
 
     def update_rise(self, r, suppress_alarm: bool = False):
         self.var_rise.set(f"{r:.0f}")
         self.pb_rise["value"] = max(0, min(100, r))
-        ok = r >= RISE_TARGET_PCT
-        self.set_bg(self.e_rise, ok)
-        if not suppress_alarm:
-            self._alarm_transition(
-                "rise", not ok,
-                f"Dough rise below target: {r:.0f}% (target ≥ {RISE_TARGET_PCT}%)",
-                "Dough rise reached target"
-            )
+        # כלל ה-target מורם כשהתפחה *מתחת* ליעד (כמו קודם) — ה-clear הוא "reached"
+        self.set_bg(self.e_rise, not self.judge("rise", r, suppress_alarm))
 
     def update_timer(self, msg, do_beep=False):
         self.var_timer.set(msg)
@@ -218,6 +262,12 @@ def run():
     oven_ready_re = re.compile(r"Oven\s+Ready:\s*1", re.I)
 
     def on_message(client, userdata, msg):
+        t0 = im.now()
+        handle(msg)
+        im.observe("receive", im.now() - t0)
+        im.inc("messages_total")
+
+    def handle(msg):
         topic = msg.topic
 
         # התעלמות מהודעות Retained ישנות
@@ -228,43 +278,40 @@ def run():
             text = msg.payload.decode("utf-8", "ignore")
         except:
             return
+        text, stamp = tracing.split(text)
+        tr = None
+        if stamp:
+            tr = (TRACER.received(topic, stamp), stamp)
+            TRACER.record("ui_receive", tr[0], stamp)
 
+        # רק פענוח + הכנסה לתור; העדכון עצמו נעשה ב-ui.pump על ה-thread של Tk
         if topic == TOPICS["env"]:
             m = env_re.search(text)
             if m:
-                t = float(m.group(1)); h = float(m.group(3))
-                first = not ui.armed["env"]
-                ui.armed["env"] = True
-                ui.update_env(t, h, suppress_alarm=first)
+                ui.post("env", (float(m.group(1)), float(m.group(3))), tr)
 
         elif topic == TOPICS["dough"]:
             m = moist_re.search(text)
             if m:
-                val = float(m.group(1))
-                first = not ui.armed["dough"]
-                ui.armed["dough"] = True
-                ui.update_dough_moist(val, suppress_alarm=first)
+                ui.post("dough", float(m.group(1)), tr)
 
         elif topic == TOPICS["rise"]:
             m = rise_re.search(text)
             if m:
-                val = float(m.group(1))
-                first = not ui.armed["rise"]
-                ui.armed["rise"] = True
-                ui.update_rise(val, suppress_alarm=first)
+                ui.post("rise", float(m.group(1)), tr)
 
         elif topic == TOPICS["timer"]:
             if oven_ready_re.search(text):
-                ui.update_timer("Oven Ready ✓", do_beep=True)
+                ui.post("timer", ("Oven Ready ✓", True), tr)
             else:
                 m = timer_rem_re.search(text)
                 if m:
                     sec = int(m.group(1))
-                    ui.update_timer(f"{sec} sec remaining", do_beep=(sec == 0))
+                    ui.post("timer", (f"{sec} sec remaining", sec == 0), tr)
 
         elif topic == TOPICS["alarm"]:
             # אם מקור חיצוני שולח טקסט התראה – מציגים אותו ישירות ב-ALARM
-            ui.var_alarm.set(text)
+            ui.post("alarm", text, tr)
 
     client = mqtt.Client(
         client_id=f"Dashboard-{int(time.time()*1000)%100000}",
@@ -276,10 +323,17 @@ def run():
     client.on_connect = on_connect
     client.on_message = on_message
 
-    client.connect(broker_ip, int(broker_port), keepalive=60)
+    try:
+        im.serve(dashboard_metrics_port)
+    except OSError as e:
+        print(f"dashboard|> metrics endpoint disabled: {e}")
+    ensure_broker()
+    client.connect(resolve_broker(), int(broker_port), keepalive=60)
     client.loop_start()
     ui.mainloop()
     client.loop_stop(); client.disconnect()
+    if TRACER.traced:
+        print(TRACER.report())
 
 if __name__ == "__main__":
     run()
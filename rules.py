@@ -0,0 +1,341 @@
+# rules.py — declarative threshold rules (rules.json) → compiled evaluator (scalar + NumPy batch) with hot reload
+#
+# סוגי כללים (לכל אחד metric + kind):
+#   range    : min / max                          → cond "low" / "high"
+#   target   : op (> >= < <=) + value             → cond "target" (או "cond" מפורש)
+#   rate     : max_per_min (|Δvalue| לדקה)        → cond "rate"
+#   duration : op + value + for_s (רציף לפחות)    → cond "duration"
+# שדות אופציונליים: label, unit, fmt, text, text_ok, hysteresis, cond, name, enabled.
+#
+# לכל ממצא: (cond, bad, ok) — bad = תנאי הרמה, ok = תנאי ביטול (מחמיר יותר, hysteresis).
+# bad=False וגם ok=False = "אין מידע/בתוך הפס" → AlarmEngine משאיר את המצב כמו שהוא.
+
+import json
+import operator
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    from init import rules_file, rules_reload_s, ALERT_HYSTERESIS
+except Exception:   # הדשבורד רץ גם בלי init.py
+    rules_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+    rules_reload_s, ALERT_HYSTERESIS = 2.0, 0.05
+
+OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+NP_OPS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}
+KINDS = ("range", "target", "rate", "duration")
+
+DEFAULT_TEXT = {
+    "range":    ("{label} out of range: {value:{fmt}}{unit} (target {min}–{max}{unit})",
+                 "{label} back in range: {value:{fmt}}{unit}"),
+    "target":   ("{label} {op} {target}{unit}: {value:{fmt}}{unit}", None),
+    "rate":     ("{label} changing too fast: {rate:+.2f}{unit}/min (limit ±{limit}{unit}/min)",
+                 "{label} rate back to normal: {rate:+.2f}{unit}/min"),
+    "duration": ("{label} {op} {target}{unit} for {minutes:.0f} min (limit {limit_min:.0f} min)",
+                 "{label} no longer {op} {target}{unit}: {value:{fmt}}{unit}"),
+}
+
+class Rule:
+    """One compiled rule (immutable after compile_rules)."""
+
+    __slots__ = ("id", "metric", "kind", "cond", "lo", "hi", "op", "target", "limit", "for_s",
+                 "band", "fields", "text", "text_ok")
+
+    def fmt(self, template, **extra):
+        return template.format(**self.fields, **extra) if template else None
+
+def _num(spec, name, i):
+    try:
+        return float(spec[name])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"rule #{i} ({spec.get('metric')}): '{name}' must be a number") from None
+
+def compile_rules(spec) -> "RuleSet":
+    """Validate a rules document ({"rules": [...]}) and compile it. Raises ValueError."""
+    rules, seen = [], set()
+    for i, s in enumerate(spec.get("rules", [])):
+        if not s.get("enabled", True):
+            continue
+        kind, metric = s.get("kind"), s.get("metric")
+        if kind not in KINDS or not metric:
+            raise ValueError(f"rule #{i}: needs 'metric' and kind in {KINDS}")
+        r = Rule()
+        r.id = s.get("name") or f"{metric}/{kind}/{i}"
+        r.metric, r.kind = metric, kind
+        r.lo = r.hi = r.target = r.limit = r.for_s = None
+        r.op = s.get("op", ">=")
+        if r.op not in OPS:
+            raise ValueError(f"rule #{i} ({metric}): op must be one of {list(OPS)}")
+        h = float(s.get("hysteresis", ALERT_HYSTERESIS))
+        if kind == "range":
+            r.lo, r.hi = _num(s, "min", i), _num(s, "max", i)
+            if r.lo > r.hi:
+                raise ValueError(f"rule #{i} ({metric}): min > max")
+            r.band = h * (r.hi - r.lo)
+            conds = ("low", "high")
+        elif kind == "target":
+            r.target = _num(s, "value", i)
+            r.band = h * abs(r.target)
+            conds = (s.get("cond", "target"),)
+        elif kind == "rate":
+            r.limit = _num(s, "max_per_min", i)
+            r.band = h * r.limit
+            conds = (s.get("cond", "rate"),)
+        else:
+            r.target, r.for_s = _num(s, "value", i), _num(s, "for_s", i)
+            r.band = 0.0
+            conds = (s.get("cond", "duration"),)
+        r.cond = conds[0]
+        for c in conds:
+            if (metric, c) in seen:   # אותו מפתח התראה משני כללים — חייב "cond" שונה
+                raise ValueError(f"rule #{i}: duplicate alarm key ({metric}, {c}) — set a distinct 'cond'")
+            seen.add((metric, c))
+        text, text_ok = DEFAULT_TEXT[kind]
+        r.text, r.text_ok = s.get("text", text), s.get("text_ok", text_ok)
+        r.fields = {"label": s.get("label", metric), "unit": s.get("unit", ""), "fmt": s.get("fmt", ".1f"),
+                    "op": r.op, "min": r.lo, "max": r.hi, "target": r.target, "limit": r.limit,
+                    "limit_min": (r.for_s or 0) / 60.0}
+        rules.append(r)
+    return RuleSet(rules)
+
+class RuleSet:
+    """Compiled rules grouped by metric — replaced as a whole on reload."""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.by_metric = {}
+        for r in self.rules:
+            self.by_metric.setdefault(r.metric, []).append(r)
+
+    def metrics(self):
+        return list(self.by_metric)
+
+    def range_of(self, metric):
+        """(min, max) of the metric's range rule, or None."""
+        for r in self.by_metric.get(metric, ()):
+            if r.kind == "range":
+                return r.lo, r.hi
+        return None
+
+    def target_of(self, metric):
+        for r in self.by_metric.get(metric, ()):
+            if r.kind == "target":
+                return r.target
+        return None
+
+class RuleEvaluator:
+    """
+    Evaluate readings against the current RuleSet. Keeps the per-key state
+    that rate (previous reading) and duration (run start) rules need; the
+    RuleSet itself is swapped atomically when the file changes.
+    """
+
+    def __init__(self, path: str | None = None, reload_s: float = rules_reload_s):
+        self.path = path or rules_file
+        self.reload_s = float(reload_s)
+        self.reloads = 0
+        self.last_error = None
+        self._mtime = None
+        self._next_check = 0.0
+        self._prev = {}    # key -> (value, ts)        (rate)
+        self._runs = {}    # (key, rule.id) -> start ts (duration)
+        self._lock = threading.Lock()   # check / evaluate_batch / reload — מכמה threads
+        self.rules = self._load()
+
+    # ---- טעינה ----
+    def _load(self) -> RuleSet:
+        self._mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding="utf-8") as f:
+            return compile_rules(json.load(f))
+
+    def maybe_reload(self, force: bool = False) -> bool:
+        """Recompile if the file changed (checked at most every reload_s). Bad files keep the old rules."""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + self.reload_s
+        try:
+            if not force and os.stat(self.path).st_mtime == self._mtime:
+                return False
+            rules = self._load()
+        except (OSError, ValueError) as e:   # json.JSONDecodeError הוא ValueError
+            if str(e) != self.last_error:
+                print(f"rules|> reload of {self.path} failed, keeping previous rules: {e}")
+            self.last_error = str(e)
+            return False
+        with self._lock:
+            self.rules = rules
+            live = {r.id for r in rules.rules}
+            self._runs = {k: v for k, v in self._runs.items() if k[1] in live}
+        self.last_error = None
+        self.reloads += 1
+        print(f"rules|> loaded {len(rules.rules)} rules from {self.path}")
+        return True
+
+    # ---- קריאה בודדת (הנתיב החם של המנהל — בלי NumPy) ----
+    def check(self, metric: str, key: str, value: float, ts: float):
+        """
+        Findings for one reading: [(cond, bad, ok, text, text_ok)]; text/text_ok are
+        callables (formatted only on a transition). key = metric name incl. room.
+        """
+        with self._lock:   # thread הקליטה והלולאה המחזורית חולקים את _prev / _runs
+            return self._check(metric, key, value, ts)
+
+    def _check(self, metric, key, value, ts):
+        rules = self.rules.by_metric.get(metric)
+        if not rules:
+            return ()
+        out = []
+        for r in rules:
+            k = r.kind
+            if k == "range":
+                text = lambda r=r: r.fmt(r.text, value=value)
+                text_ok = lambda r=r: r.fmt(r.text_ok, value=value)
+                out.append(("low", value < r.lo, value >= r.lo + r.band, text, text_ok))
+                out.append(("high", value > r.hi, value <= r.hi - r.band, text, text_ok))
+            elif k == "target":
+                bad = OPS[r.op](value, r.target)
+                ok = value < r.target - r.band if r.op[0] == ">" else value > r.target + r.band
+                out.append((r.cond, bad, ok, lambda r=r: r.fmt(r.text, value=value),
+                            lambda r=r: r.fmt(r.text_ok, value=value)))
+            elif k == "rate":
+                prev = self._prev.get(key)
+                if prev is None or ts <= prev[1]:
+                    continue   # אין קצב לחשב — לא משנה מצב
+                rate = (value - prev[0]) / (ts - prev[1]) * 60.0
+                out.append((r.cond, abs(rate) > r.limit, abs(rate) <= r.limit - r.band,
+                            lambda r=r, rate=rate: r.fmt(r.text, value=value, rate=rate),
+                            lambda r=r, rate=rate: r.fmt(r.text_ok, value=value, rate=rate)))
+            else:
+                rk = (key, r.id)
+                if OPS[r.op](value, r.target):
+                    start = self._runs.setdefault(rk, ts)
+                    dur = ts - start
+                    out.append((r.cond, dur >= r.for_s, False,
+                                lambda r=r, dur=dur: r.fmt(r.text, value=value, minutes=dur / 60.0), None))
+                else:
+                    self._runs.pop(rk, None)
+                    out.append((r.cond, False, True, None, lambda r=r: r.fmt(r.text_ok, value=value)))
+        self._prev[key] = (value, ts)
+        return out
+
+    # ---- אצווה (NumPy): הרבה קריאות, מסכות לכל סוג כלל ----
+    def evaluate_batch(self, metrics, keys, values, ts):
+        """
+        Vectorised evaluation of N readings (same semantics as check(), state carried
+        across calls). Returns dict of arrays over (reading, rule, cond) pairs:
+        row, rule (index into self.rules.rules), cond, bad, ok, aux (rate / run seconds).
+        Rows are ordered by (key, ts).
+        """
+        with self._lock:
+            return self._evaluate_batch(metrics, keys, values, ts)
+
+    def _evaluate_batch(self, metrics, keys, values, ts):
+        values = np.asarray(values, dtype=float)
+        ts = np.asarray(ts, dtype=float)
+        keys = np.asarray(keys, dtype=object)
+        metrics = np.asarray(metrics, dtype=object)
+        ukeys, kcode = np.unique(keys.astype(str), return_inverse=True)
+        order = np.lexsort((ts, kcode))                      # קבוצה לכל key, לפי זמן
+        values, ts, keys, metrics, kcode = values[order], ts[order], keys[order], metrics[order], kcode[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = kcode[1:] != kcode[:-1]                  # הקריאה הראשונה של כל key באצווה
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = first[1:]
+
+        rules = self.rules
+        parts = []
+        for ri, r in enumerate(rules.rules):
+            rows = np.flatnonzero(metrics == r.metric)
+            if not rows.size:
+                continue
+            v, t = values[rows], ts[rows]
+            if r.kind == "range":
+                for cond, bad, ok in (("low", v < r.lo, v >= r.lo + r.band),
+                                      ("high", v > r.hi, v <= r.hi - r.band)):
+                    parts.append((rows, ri, cond, bad, ok, np.zeros(rows.size)))
+            elif r.kind == "target":
+                bad = NP_OPS[r.op](v, r.target)
+                ok = v < r.target - r.band if r.op[0] == ">" else v > r.target + r.band
+                parts.append((rows, ri, r.cond, bad, ok, np.zeros(rows.size)))
+            elif r.kind == "rate":
+                pv, pt = np.roll(v, 1), np.roll(t, 1)
+                for j in np.flatnonzero(first[rows]):        # ההמשך מהאצווה/קריאה הקודמת
+                    pv[j], pt[j] = self._prev.get(keys[rows[j]], (np.nan, np.nan))
+                dt = t - pt
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    rate = np.where(dt > 0, (v - pv) / np.where(dt > 0, dt, 1.0) * 60.0, np.nan)
+                known = ~np.isnan(rate)
+                arate = np.abs(np.nan_to_num(rate))
+                parts.append((rows, ri, r.cond, known & (arate > r.limit),
+                              known & (arate <= r.limit - r.band), rate))
+            else:
+                c = NP_OPS[r.op](v, r.target)
+                f = first[rows]
+                prev_c = np.roll(c, 1); prev_c[f] = False
+                start = np.where(c & ~prev_c, t, np.nan)
+                for j in np.flatnonzero(f & c):               # ריצה שנמשכת מהקריאה הקודמת
+                    s = self._runs.get((keys[rows[j]], r.id))
+                    if s is not None:
+                        start[j] = s
+                idx = np.where(~np.isnan(start), np.arange(rows.size), 0)
+                np.maximum.accumulate(idx, out=idx)           # forward-fill של תחילת הריצה
+                run = np.where(c, t - start[idx], 0.0)
+                parts.append((rows, ri, r.cond, c & (run >= r.for_s), ~c, run))
+                for j in np.flatnonzero(last[rows]):          # מצב לקריאה הבאה
+                    rk = (keys[rows[j]], r.id)
+                    if c[j]:
+                        self._runs[rk] = float(start[idx[j]])
+                    else:
+                        self._runs.pop(rk, None)
+        for j in np.flatnonzero(last):
+            prev = self._prev.get(keys[j])
+            if prev is None or ts[j] > prev[1]:   # קריאה ישנה (למשל מה-DB) לא מחליפה חדשה יותר
+                self._prev[keys[j]] = (float(values[j]), float(ts[j]))
+
+        if not parts:
+            e = np.zeros(0)
+            return {"row": e.astype(int), "rule": e.astype(int), "cond": e.astype(object),
+                    "bad": e.astype(bool), "ok": e.astype(bool), "aux": e,
+                    "order": order, "values": values, "keys": keys, "ruleset": rules}
+        row = np.concatenate([p[0] for p in parts])
+        return {
+            "row":  row,
+            "rule": np.concatenate([np.full(p[0].size, p[1]) for p in parts]),
+            "cond": np.concatenate([np.full(p[0].size, p[2], dtype=object) for p in parts]),
+            "bad":  np.concatenate([p[3] for p in parts]),
+            "ok":   np.concatenate([p[4] for p in parts]),
+            "aux":  np.concatenate([p[5] for p in parts]),
+            "order": order, "values": values, "keys": keys, "ruleset": rules,
+        }
+
+    def findings(self, res, only_changes: bool = True):
+        """
+        Iterate a batch result as (key, cond, value, bad, ok, text, text_ok) in time
+        order, ready for AlarmEngine.check. only_changes drops pairs with bad and
+        ok both False (no state change possible).
+        """
+        rules = res["ruleset"].rules   # אותו RuleSet שחישב את האצווה (גם אם נטען חדש בינתיים)
+        sel = np.flatnonzero(res["bad"] | res["ok"]) if only_changes else np.arange(res["row"].size)
+        sel = sel[np.argsort(res["row"][sel], kind="stable")]
+        for i in sel:
+            row, r = res["row"][i], rules[res["rule"][i]]
+            v, aux = float(res["values"][row]), float(res["aux"][i])
+            extra = {"rate": aux} if r.kind == "rate" else {"minutes": aux / 60.0} if r.kind == "duration" else {}
+            yield (res["keys"][row], res["cond"][i], v, bool(res["bad"][i]), bool(res["ok"][i]),
+                   lambda r=r, v=v, extra=extra: r.fmt(r.text, value=v, **extra),
+                   lambda r=r, v=v, extra=extra: r.fmt(r.text_ok, value=v, **extra))
+
+_default = None
+_default_lock = threading.Lock()
+
+def load_rules(path: str | None = None) -> RuleEvaluator:
+    """Process-wide evaluator for rules_file (נוצר בשימוש הראשון)."""
+    global _default
+    with _default_lock:
+        if _default is None or (path and path != _default.path):
+            _default = RuleEvaluator(path)
+        return _default
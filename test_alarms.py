@@ -0,0 +1,76 @@
+# test_alarms.py — AlarmEngine edges: cooldown, the deferred raise after it, hysteresis, repeat, persistence
+
+import data_acq as da
+from alarms import AlarmEngine
+
+def _check(eng, bad, ok, now, value=0.0):
+    return eng.check("T", "high", value, bad, ok, lambda: f"high {now}", lambda: f"ok {now}", now=now)
+
+def test_edges_only():
+    eng = AlarmEngine(cooldown=0, repeat_s=0, db_path=":memory:")
+    assert _check(eng, True, False, 1) == "high 1"
+    assert _check(eng, True, False, 2) is None          # חריגה נמשכת — בלי פרסום
+    assert _check(eng, False, False, 3) is None         # בתוך פס ה-hysteresis — עדיין פעיל
+    assert eng.active() == [("T", "high", 1, 0.0)]
+    assert _check(eng, False, True, 4) == "ok 4"
+    assert _check(eng, False, True, 5) is None
+    assert eng.active() == []
+    assert eng.counts == {"raise": 1, "clear": 1, "repeat": 0, "suppressed": 0}
+
+def test_flapping_inside_the_cooldown_is_counted_not_published():
+    eng = AlarmEngine(cooldown=60, repeat_s=0, db_path=":memory:")
+    assert _check(eng, True, False, 100) == "high 100"
+    assert _check(eng, False, True, 110) == "ok 110"
+    assert _check(eng, True, False, 120) is None        # raise שנדחה
+    assert _check(eng, False, True, 130) is None        # clear שקט — ה-raise לא פורסם
+    assert eng.counts == {"raise": 1, "clear": 2, "repeat": 0, "suppressed": 1}
+    assert [h[1] for h in eng._history] == ["raise", "clear"]
+
+def test_deferred_raise_is_published_when_the_cooldown_ends():
+    eng = AlarmEngine(cooldown=60, repeat_s=0, db_path=":memory:")
+    _check(eng, True, False, 100)
+    _check(eng, False, True, 110)
+    assert _check(eng, True, False, 120) is None
+    assert _check(eng, True, False, 150) is None        # עדיין בתוך ה-cooldown
+    assert _check(eng, True, False, 160) == "high 160"  # חריגה שנמשכת אחרי ה-cooldown
+    assert _check(eng, True, False, 170) is None
+    assert _check(eng, False, True, 180) == "ok 180"    # ה-raise פורסם — גם ה-clear
+    assert eng.counts["raise"] == 2
+
+def test_repeat():
+    eng = AlarmEngine(cooldown=0, repeat_s=30, db_path=":memory:")
+    assert _check(eng, True, False, 0) == "high 0"
+    assert _check(eng, True, False, 29) is None
+    assert _check(eng, True, False, 30) == "high 30"
+    assert _check(eng, False, False, 90) is None        # בתוך הפס — לא חוזר
+    assert eng.counts["repeat"] == 1
+
+def test_event_once_per_cooldown():
+    eng = AlarmEngine(cooldown=60, db_path=":memory:")
+    assert eng.event("Timer", "done", "done", now=100) == "done"
+    assert eng.event("Timer", "done", "done", now=130) is None
+    assert eng.event("Timer", "done", lambda: "again", now=160) == "again"
+
+def test_flush_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "iot.db")
+    eng = AlarmEngine(cooldown=60, repeat_s=0, db_path=path)
+    _check(eng, True, False, 100, value=31.5)
+    eng.check("H", "low", 40.0, True, False, lambda: "low", None, now=100)
+    eng.check("H", "low", 55.0, False, True, None, lambda: "low ok", now=105)
+    assert eng.flush() == 3
+    assert eng.flush() == 0
+
+    conn = da.connect(path)
+    try:
+        rows = [tuple(r) for r in conn.execute("SELECT level, message, metric, cond, value FROM iot_alerts ORDER BY id")]
+    finally:
+        conn.close()
+    assert rows == [("raise", "high 100", "T", "high", 31.5), ("raise", "low", "H", "low", 40.0),
+                    ("clear", "low ok", "H", "low", 55.0)]
+
+    # אחרי restart: ההתראה הפעילה נטענת — אין raise כפול, וה-clear עדיין מפורסם
+    again = AlarmEngine(cooldown=60, repeat_s=0, db_path=path)
+    assert again.load() == 2
+    assert again.active() == [("T", "high", 100, 31.5)]
+    assert _check(again, True, False, 200) is None
+    assert _check(again, False, True, 210) == "ok 210"
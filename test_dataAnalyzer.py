@@ -0,0 +1,57 @@
+# test_dataAnalyzer.py — top-k threshold vs. the sort-based original, FFT engine, VibrationDetector
+
+import numpy as np
+import pytest
+
+import dataAnalyzer as dz
+
+@pytest.mark.filterwarnings("ignore:Mean of empty slice", "ignore:invalid value")   # k < 2 → NaN, כמו במקור
+@pytest.mark.parametrize("n", [1, 20, 39, 40, 41, 64, 1000, 1024])
+def test_topk_mean_matches_sort_reference(n):
+    A = np.abs(np.random.default_rng(n).normal(size=(3, n)))
+    A[0, : n // 2] = A[0, 0]    # ערכים חוזרים
+    k = int(n * dz.percen_thr)
+    ref = np.array([np.mean(np.sort(a)[-k:-1]) for a in A])
+    np.testing.assert_allclose(dz._topk_mean(A), ref, rtol=1e-12, equal_nan=True)
+
+def test_fft_engine_rejects_short_blocks():
+    with pytest.raises(ValueError, match="at least 2 samples"):
+        dz.FFTEngine(1)
+
+def test_fft_thresholds_match_fft_block():
+    X = np.random.default_rng(0).normal(size=(3, 512))
+    got = dz.get_engine(512).thresholds(X)
+    ref = [dz.fft_block(x, False, False) for x in X]
+    np.testing.assert_allclose(got, np.asarray(ref), rtol=1e-12)
+
+def test_streaming_fft_blocks():
+    X = np.random.default_rng(1).normal(size=(3, 1024))
+    s = dz.StreamingFFT(256, hop=128)
+    rows = np.concatenate([s.push(X[:, :300]), s.push(X[:, 300:])])
+    assert rows.shape == (7, 3)
+    np.testing.assert_allclose(rows[2], dz.get_engine(256).thresholds(X[:, 256:512]), rtol=1e-12)
+
+def test_vibration_detector_learns_then_flags():
+    det = dz.VibrationDetector(window=5, baseline=None, warmup=3)
+    normal = np.array([10.0, 12.0, 8.0])
+    assert [det.update(normal)[0] for _ in range(3)] == [False] * 3    # warmup
+    bad, d, std = det.update(normal * 1.01)
+    assert not bad and d < dz.max_eucl
+    bad, d, _ = det.update(normal * [2.0, 1.0, 1.0])                   # ציר X כפול
+    assert bad and d == pytest.approx(1.0, rel=0.02)
+    np.testing.assert_allclose(det.baseline(), normal, rtol=0.01)     # האנומליה לא נלמדה
+
+def test_vibration_detector_fixed_baseline():
+    det = dz.VibrationDetector(baseline=[1.0, 1.0, 1.0])
+    assert not det.update([1.05, 1.0, 0.95])[0]
+    assert det.update([1.3, 1.0, 1.0])[0]          # stdev של הסטיות > deviation_percentage
+    np.testing.assert_array_equal(det.baseline(), [1.0, 1.0, 1.0])
+
+def test_vib_verdict_publishes_on_its_own_flag(monkeypatch):
+    sent = []
+    client = type("C", (), {"publish": lambda self, topic, msg, qos=0, retain=False: sent.append((topic, msg))})()
+    monkeypatch.setattr(dz, "vib_alarm_publish", True)
+    dz.vib_verdict(client, "vibration anomaly")
+    monkeypatch.setattr(dz, "vib_alarm_publish", False)
+    dz.vib_verdict(client, "vibration normal")
+    assert sent == [(dz.ALARM_TOPIC, "vibration anomaly")]
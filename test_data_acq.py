@@ -0,0 +1,115 @@
+# test_data_acq.py — schema migrations from the baseline layout, monotonic sample ids, column-wise reads
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import data_acq as da
+
+def _baseline_db(path, rows):
+    """The original layout (iot_devices / iot_data / iot_alerts, user_version 0) with some readings."""
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(da.CREATE_IOT_DEVICES_TABLE)
+        conn.execute(da.CREATE_IOT_DATA_TABLE)
+        conn.execute(da.CREATE_IOT_ALERTS_TABLE)
+        conn.executemany("INSERT INTO iot_data (ts, device_name, metric, value, units) VALUES (?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT INTO iot_alerts (ts, level, message) VALUES ('2026-01-01 00:00:00', 'raise', 'old')")
+    conn.close()
+
+def _put(writer, ts, metric, value):
+    writer.put((ts, metric, metric, value, "", da.ts_to_ms(ts)))
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "iot.db")
+
+def test_baseline_db_migrates_to_current_version(db):
+    rows = [(f"2026-01-01 00:00:{i:02d}", "dht", "AirEnv_Temperature" if i % 2 else "AirEnv_Humidity",
+             20.0 + i, "C") for i in range(20)]
+    _baseline_db(db, rows)
+
+    da.ensure_schema(db)
+    da.ensure_schema(db)   # שנייה — no-op
+
+    conn = da.connect(db)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == da.SCHEMA_VERSION
+        got = [tuple(r) for r in conn.execute("SELECT id, ts, device_name, metric, value, units FROM iot_data ORDER BY id")]
+        assert got == [(i + 1,) + r for i, r in enumerate(rows)]
+        ts_ms = [r[0] for r in conn.execute("SELECT ts_ms FROM iot_data ORDER BY id")]
+        assert ts_ms == [da.ts_to_ms(r[0]) for r in rows]
+        assert conn.execute("SELECT last_id FROM iot_seq").fetchone()[0] == len(rows)
+        alert = conn.execute("SELECT message, metric, cond FROM iot_alerts").fetchone()
+        assert tuple(alert) == ("old", None, None)
+        assert conn.execute("SELECT COUNT(*) FROM alarm_state").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+def test_ids_stay_monotonic_after_the_newest_rows_are_deleted(db):
+    da.ensure_schema(db)
+    w = da.IOTDataWriter(db)
+    try:
+        for i in range(5):
+            _put(w, f"2026-01-01 00:00:0{i}", "m", i)
+        w.flush(10)
+        conn = da.connect(db)
+        with conn:
+            conn.execute("DELETE FROM iot_data WHERE id >= 4")   # retention / תיקון ידני מחק את החדשים
+        # שני נתיבי הכתיבה — הכותב וה-trigger של ה-view — חולקים את אותו מונה
+        with conn:
+            conn.execute("INSERT INTO iot_data (ts, device_name, metric, value, units) "
+                         "VALUES ('2026-01-01 00:00:05', 'm', 'm', 5, '')")
+        _put(w, "2026-01-01 00:00:06", "m", 6)
+        w.flush(10)
+        ids = [r[0] for r in conn.execute("SELECT id FROM iot_data ORDER BY ts_ms, id")]
+        conn.close()
+    finally:
+        w.close(10)
+    assert ids == [1, 2, 3, 6, 7]
+
+def test_fetch_frame_columns(db):
+    da.ensure_schema(db)
+    w = da.IOTDataWriter(db)
+    for i in range(6):
+        _put(w, f"2026-01-01 00:00:0{i}", "a", None if i == 2 else float(i))
+        _put(w, f"2026-01-01 00:00:0{i}", "b", 10.0 * i)
+    w.close(10)
+
+    one = da.fetch_frame("a", db_path=db)
+    assert list(one.columns) == ["ts", "value"]
+    assert one["ts"].dtype == "datetime64[ms]" and one["value"].dtype == np.float64
+    np.testing.assert_array_equal(one["value"].to_numpy(), [0, 1, np.nan, 3, 4, 5])
+
+    last = da.fetch_frame("a", limit=2, db_path=db)
+    assert last["value"].tolist() == [4.0, 5.0]
+    np.testing.assert_array_equal(da.fetch_frame("a", downsample=2, db_path=db)["value"].to_numpy(), [0, np.nan, 4])
+
+    wide = da.fetch_frame(["b", "a", "missing"], start="2026-01-01 00:00:01", end="2026-01-01 00:00:04", db_path=db)
+    assert list(wide.columns) == ["b", "a", "missing"]
+    assert wide["b"].tolist() == [10.0, 20.0, 30.0]
+    assert wide["missing"].isna().all()
+    assert len(da.fetch_frame("missing", db_path=db)) == 0
+
+def test_fetch_history_honours_max_points_past_the_coarsest_rollup(db):
+    da.ensure_schema(db)
+    t0 = datetime(2026, 1, 1)
+    batch = []
+    for i in range(2 * 24 * 12):   # יומיים, דגימה כל 5 דקות
+        ts = (t0 + timedelta(minutes=5 * i)).strftime("%Y-%m-%d %H:%M:%S")
+        batch.append((ts, "m", "m", float(i), "", da.ts_to_ms(ts)))
+    conn = da.connect(db)
+    with conn:
+        da.update_rollups(conn, batch)
+    conn.close()
+
+    for max_points in (3, 10, 48):
+        h = da.fetch_history("m", "2026-01-01 00:00:00", "2026-01-03 00:00:00", max_points=max_points, db_path=db)
+        assert len(h) <= max_points + 1
+        assert h["count"].sum() == len(batch)
+        assert h["min"].min() == 0.0 and h["max"].max() == len(batch) - 1
+        assert h["last"].iloc[-1] == len(batch) - 1
+    hourly = da.fetch_history("m", "2026-01-01 00:00:00", "2026-01-03 00:00:00", resolution_s=3600, db_path=db)
+    assert len(hourly) == 48
@@ -0,0 +1,76 @@
+# test_export_data.py — incremental export (per-filter cursors) and the partition round-trip
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import data_acq as da
+import export_data as ex
+
+ROOM_METRIC = "Kitchen/AirEnv_Temperature"   # metric עם חדר — "/" בשם התיקייה
+
+def _fill(db, rows):
+    w = da.IOTDataWriter(db)
+    for ts, metric, value in rows:
+        w.put((ts, "dev", metric, value, "C", da.ts_to_ms(ts)))
+    w.close(10)
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "iot.db")
+    da.ensure_schema(path)
+    return path
+
+@pytest.fixture(params=["csv"] + (["parquet"] if ex.pa is not None else []))
+def fmt(request):
+    return request.param
+
+def test_round_trip_and_incremental_cursor(db, tmp_path, fmt):
+    out = str(tmp_path / "export")
+    _fill(db, [(f"2026-01-01 23:59:{s:02d}", m, float(s)) for s in range(50, 60) for m in ("A", ROOM_METRIC)])
+    rep = ex.export(out, chunk=7, fmt=fmt, db_path=db)
+    assert rep["rows"] == 20 and rep["last_id"] == 20 and rep["cursor"] == "all"
+    assert os.path.isdir(os.path.join(out, "metric=Kitchen%2FAirEnv_Temperature", "date=2026-01-01"))
+
+    _fill(db, [("2026-01-02 00:00:00", ROOM_METRIC, 99.0)])
+    rep = ex.export(out, chunk=7, fmt=fmt, db_path=db)
+    assert rep["rows"] == 1 and rep["last_id"] == 21
+    assert ex.export(out, fmt=fmt, db_path=db)["rows"] == 0
+
+    df = ex.load_export(out, [ROOM_METRIC])
+    assert df["metric"].unique().tolist() == [ROOM_METRIC]
+    assert df["value"].tolist() == [float(s) for s in range(50, 60)] + [99.0]
+    cols = ex.load_columns(out, ["A", ROOM_METRIC], start="2026-01-01 23:59:55", end="2026-01-02 00:00:00")
+    np.testing.assert_array_equal(cols["A"], np.arange(55, 60, dtype=float))
+    np.testing.assert_array_equal(cols[ROOM_METRIC], np.arange(55, 60, dtype=float))
+
+def test_each_filter_set_keeps_its_own_cursor(db, tmp_path):
+    out = str(tmp_path / "export")
+    _fill(db, [(f"2026-01-01 00:00:{s:02d}", m, float(s)) for s in range(5) for m in ("A", "B")])
+    assert ex.export(out, ["A"], fmt="csv", db_path=db)["rows"] == 5
+    # ייצוא לא מסונן לא מדלג על שורות B שקודמות ל-cursor של הסינון A
+    assert ex.export(out, fmt="csv", db_path=db)["rows"] == 10
+    assert ex.export(out, ["B"], fmt="csv", db_path=db)["rows"] == 5
+    with open(os.path.join(out, ex.STATE_FILE)) as f:
+        cursors = json.load(f)["cursors"]
+    assert cursors["all"] == 10 and len(cursors) == 3
+
+def test_old_single_cursor_state_is_migrated(tmp_path):
+    out = tmp_path / "export"
+    out.mkdir()
+    (out / ex.STATE_FILE).write_text(json.dumps({"last_id": 42}))
+    assert ex._load_state(str(out)) == {"cursors": {"all": 42}}
+
+def test_samples_within_one_second_keep_their_order(db, tmp_path, fmt):
+    out = str(tmp_path / "export")
+    w = da.IOTDataWriter(db)
+    base = da.ts_to_ms("2026-01-01 00:00:00")
+    for i, ms in enumerate((900, 100, 500)):   # הגיעו לא לפי הסדר, באותה שנייה
+        w.put(("2026-01-01 00:00:00", "vib", "AxisX", float(i), "", base + ms))
+    w.close(10)
+    ex.export(out, fmt=fmt, db_path=db)
+    df = ex.load_export(out, ["AxisX"], columns=("ts_ms", "value"))
+    assert df["ts_ms"].tolist() == [base + 100, base + 500, base + 900]
+    assert df["value"].tolist() == [1.0, 2.0, 0.0]
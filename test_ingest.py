@@ -0,0 +1,89 @@
+# test_ingest.py — IngestQueue overload policies, per-class fairness, worker shutdown
+
+import threading
+import time
+
+import pytest
+
+from ingest import IngestQueue, IngestWorker
+
+def _by_prefix(topic):
+    return topic.split("/")[0]
+
+def test_drop_oldest_keeps_the_newest_messages():
+    q = IngestQueue(_by_prefix, {"*": "drop_oldest"}, max_items=3)
+    for i in range(5):
+        assert q.put("a/x", i)
+    assert [p for _, p, _ in q.get_batch(10)] == [2, 3, 4]
+    assert q.shed == {("a", "dropped_oldest"): 2}
+    assert q.accepted == 5
+
+def test_latest_coalesces_per_topic_and_keeps_its_place():
+    q = IngestQueue(_by_prefix, {"*": "latest"}, max_items=2)
+    q.put("a/x", 1)
+    q.put("a/y", 1)
+    q.put("a/x", 2)          # מחליף את a/x הממתין
+    q.put("a/x", 3)
+    assert q.qsize() == 2
+    assert [(t, p) for t, p, _ in q.get_batch(10)] == [("a/x", 3), ("a/y", 1)]
+    assert q.shed == {("a", "coalesced"): 2}
+
+    # topic חדש כשהתור מלא → כמו drop_oldest, והממתינה שנזרקה לא נשארת ב-pending
+    q.put("a/x", 4)
+    q.put("a/y", 4)
+    q.put("a/z", 4)
+    q.put("a/x", 5)          # a/x 4 כבר נזרקה — זו הודעה חדשה, לא החלפה
+    assert [(t, p) for t, p, _ in q.get_batch(10)] == [("a/z", 4), ("a/x", 5)]
+    assert q.shed[("a", "dropped_oldest")] == 2
+
+def test_block_times_out_once_then_sheds_immediately_until_the_consumer_moves():
+    q = IngestQueue(_by_prefix, {"*": "block"}, max_items=1, block_s=0.05)
+    assert q.put("a/x", 0)
+    t0 = time.monotonic()
+    assert not q.put("a/x", 1)
+    assert time.monotonic() - t0 >= 0.05
+    assert "a" in q._stalled
+    t0 = time.monotonic()
+    for i in range(10):
+        assert not q.put("a/x", i)      # thread הרשת לא מצטבר ל-N×block_s
+    assert time.monotonic() - t0 < 0.05
+    assert q.shed == {("a", "block_timeout"): 11}
+    assert q.get_batch(10) == [("a/x", 0, None)]
+    assert "a" not in q._stalled
+    assert q.put("a/x", 2)
+
+def test_block_waits_for_the_consumer():
+    q = IngestQueue(_by_prefix, {"*": "block"}, max_items=1, block_s=5.0)
+    q.put("a/x", 0)
+    threading.Timer(0.05, q.get_batch, (1,)).start()
+    assert q.put("a/x", 1)
+    assert q.shed_total() == 0
+
+def test_round_robin_between_classes():
+    q = IngestQueue(_by_prefix, {"*": "drop_oldest"}, max_items=100)
+    for i in range(5):
+        q.put("flood/x", i)
+    q.put("env/x", "e")
+    batch = q.get_batch(2)
+    assert [t for t, _, _ in batch] == ["flood/x", "env/x"]
+
+def test_policy_validation_and_close():
+    with pytest.raises(ValueError):
+        IngestQueue(_by_prefix, {"*": "newest"})
+    q = IngestQueue(_by_prefix, {"*": "drop_oldest"})
+    q.put("a/x", 1)
+    q.close()
+    assert not q.put("a/x", 2)
+    assert q.shed == {("a", "closed"): 1}
+    assert q.get_batch(10) == [("a/x", 1, None)]
+    assert q.get_batch(10, timeout=5) == []    # סגור וריק — לא ממתינים
+
+def test_worker_drains_the_backlog_on_stop():
+    seen = []
+    q = IngestQueue(_by_prefix, {"*": "drop_oldest"}, max_items=1000)
+    w = IngestWorker(q, lambda t, p, r: seen.append(p) if p != 3 else 1 / 0, batch=7).start()
+    for i in range(100):
+        q.put("a/x", i)
+    assert w.stop(5)
+    assert seen == [i for i in range(100) if i != 3]
+    assert w.processed == 100 and w.errors == 1
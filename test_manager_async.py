@@ -0,0 +1,92 @@
+# test_manager_async.py — main_async end to end with a fake MQTT client, and the ingest task off the event loop
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import data_acq as da
+import manager
+from ingest import IngestQueue
+
+class FakeClient:
+    """paho stand-in: loop_start() delivers the queued messages through on_message (like the network thread)."""
+
+    def __init__(self, messages=()):
+        self.messages = list(messages)
+        self.on_message = None
+        self.published, self.subscribed = [], []
+        self.looping = self.disconnected = False
+
+    def loop_start(self):
+        self.looping = True
+        for topic, payload in self.messages:
+            self.on_message(self, None, SimpleNamespace(topic=topic, payload=payload.encode()))
+
+    def loop_stop(self):
+        self.looping = False
+
+    def subscribe(self, topic, qos=0):
+        self.subscribed.append(topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+
+    def disconnect(self):
+        self.disconnected = True
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "iot.db")
+    da.close_IOT_writer()
+    da._latest.clear()
+    monkeypatch.setattr(da, "INIT_DB_NAME", path)
+    monkeypatch.setattr(manager, "db_name", path)
+    monkeypatch.setattr(manager, "ALARMS", manager.AlarmEngine())
+    monkeypatch.setattr(manager, "metrics_port", 0)
+    yield path
+    da.close_IOT_writer()
+
+def test_main_async_ingests_and_shuts_down_cleanly(db, monkeypatch):
+    base = manager.TOPIC_BASE
+    msgs = [(f"{base}/env-1/pub", f"From: AirEnv Temperature: {28 + i % 3}.0 Humidity: 75")
+            for i in range(200)]
+    client = FakeClient(msgs)
+    monkeypatch.setattr(manager, "client_init", lambda cname: client)
+    monkeypatch.setattr(manager, "conn_time", 0.5)
+    before = {t for t in threading.enumerate() if not t.daemon}
+
+    asyncio.run(asyncio.wait_for(manager.main_async(drain_timeout=5.0), 30))
+
+    assert client.subscribed == [f"{base}/#"]
+    assert not client.looping and client.disconnected
+    assert manager.INGEST.closed and manager.INGEST.qsize() == 0
+    assert da._writer is None   # close_IOT_writer ב-shutdown
+    assert {t for t in threading.enumerate() if not t.daemon} <= before
+    conn = da.connect(db)
+    try:
+        n = conn.execute("SELECT COUNT(*) FROM iot_data WHERE metric = 'AirEnv_Temperature'").fetchone()[0]
+    finally:
+        conn.close()
+    assert n == len(msgs)
+
+def test_ingest_task_does_not_block_the_event_loop(monkeypatch):
+    # ingest_one איטי (כמו IOTDataWriter.put על תור מלא) — ה-loop חייב להמשיך לתקתק
+    monkeypatch.setattr(manager, "ingest_one", lambda client, topic, payload, t_recv: time.sleep(0.05))
+    q = IngestQueue(lambda topic: "env")
+    for i in range(10):
+        q.put("t", str(i))
+    q.close()
+
+    async def run():
+        ticks = 0
+        task = asyncio.create_task(manager._ingest(q, None))
+        while not task.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        await task
+        return ticks
+
+    assert asyncio.run(run()) >= 20   # ~0.5 s של עבודה; חסימה של ה-loop הייתה נותנת ~0-1
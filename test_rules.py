@@ -0,0 +1,108 @@
+# test_rules.py — scalar check() and NumPy evaluate_batch() agree; batches keep the RuleSet they were computed with
+
+import json
+
+import numpy as np
+import pytest
+
+from rules import RuleEvaluator, compile_rules
+
+RULES = {"rules": [
+    {"metric": "T", "kind": "range", "min": 20, "max": 30, "hysteresis": 0.1},
+    {"metric": "T", "kind": "rate", "max_per_min": 3, "hysteresis": 0.1},
+    {"metric": "H", "kind": "target", "op": "<", "value": 70, "hysteresis": 0.02, "cond": "dry"},
+    {"metric": "H", "kind": "duration", "op": ">=", "value": 85, "for_s": 120},
+]}
+
+def _write(path, spec):
+    path.write_text(json.dumps(spec), encoding="utf-8")
+    return str(path)
+
+def _readings(n=400, seed=1):
+    rng = np.random.default_rng(seed)
+    keys = {"T": ["T@A", "T@B"], "H": ["H@A", "H@B"]}
+    out, t = [], 1000.0
+    for _ in range(n):
+        metric = "T" if rng.random() < 0.5 else "H"
+        key = keys[metric][rng.integers(2)]
+        t += float(rng.integers(5, 40))
+        v = float(rng.normal(25, 6)) if metric == "T" else float(rng.uniform(60, 95))
+        out.append((metric, key, v, t))
+    return out
+
+def _scalar(ev, readings):
+    got = set()
+    for metric, key, v, t in readings:
+        for cond, bad, ok, _, _ in ev.check(metric, key, v, t):
+            if bad or ok:
+                got.add((key, t, cond, bool(bad), bool(ok)))
+    return got
+
+def _batch(ev, readings):
+    got = set()
+    m, k, v, t = (list(c) for c in zip(*readings))
+    res = ev.evaluate_batch(m, k, v, t)
+    ts = np.asarray(t)[res["order"]]
+    for i in np.flatnonzero(res["bad"] | res["ok"]):
+        row = res["row"][i]
+        got.add((res["keys"][row], float(ts[row]), res["cond"][i], bool(res["bad"][i]), bool(res["ok"][i])))
+    return got
+
+def test_batch_matches_scalar(tmp_path):
+    path = _write(tmp_path / "rules.json", RULES)
+    readings = _readings()
+    scalar = _scalar(RuleEvaluator(path), readings)
+
+    # האצווה מקבלת את הקריאות מעורבבות ובשני חלקים — המצב (rate / duration) עובר בין הקריאות
+    ev = RuleEvaluator(path)
+    half = len(readings) // 2
+    rng = np.random.default_rng(2)
+    batch = set()
+    for part in (readings[:half], readings[half:]):
+        batch |= _batch(ev, [part[i] for i in rng.permutation(len(part))])
+
+    assert {c for _, _, c, _, _ in scalar} == {"low", "high", "rate", "dry", "duration"}
+    assert batch == scalar
+
+def test_duration_needs_a_continuous_run(tmp_path):
+    ev = RuleEvaluator(_write(tmp_path / "rules.json", RULES))
+    states = [[(c, bad, ok) for c, bad, ok, _, _ in ev.check("H", "H@A", v, t) if c == "duration"][0]
+              for v, t in ((90, 0), (90, 100), (90, 130), (80, 140), (90, 150), (90, 260))]
+    assert states == [("duration", False, False), ("duration", False, False), ("duration", True, False),
+                      ("duration", False, True), ("duration", False, False), ("duration", False, False)]
+
+def test_findings_use_the_ruleset_of_the_batch(tmp_path):
+    path = _write(tmp_path / "rules.json", RULES)
+    ev = RuleEvaluator(path)
+    res = ev.evaluate_batch(["T"], ["T@A"], [35.0], [1.0])
+
+    _write(tmp_path / "rules.json", {"rules": [{"metric": "X", "kind": "range", "min": 0, "max": 1}]})
+    assert ev.maybe_reload(force=True)
+    assert ev.rules.metrics() == ["X"]
+
+    found = list(ev.findings(res))
+    assert [(key, cond, bad, ok) for key, cond, _, bad, ok, _, _ in found] == [("T@A", "low", False, True),
+                                                                            ("T@A", "high", True, False)]
+    assert found[1][5]() == "T out of range: 35.0 (target 20.0–30.0)"
+
+def test_bad_reload_keeps_the_previous_rules(tmp_path):
+    path = tmp_path / "rules.json"
+    ev = RuleEvaluator(_write(path, RULES))
+    path.write_text("{ not json", encoding="utf-8")
+    assert not ev.maybe_reload(force=True)
+    assert ev.last_error and sorted(ev.rules.metrics()) == ["H", "T"]
+
+@pytest.mark.parametrize("rule", [
+    {"metric": "T", "kind": "range", "min": 5, "max": 1},
+    {"metric": "T", "kind": "target", "op": "=", "value": 1},
+    {"metric": "T", "kind": "rate"},
+    {"kind": "range", "min": 0, "max": 1},
+])
+def test_compile_rejects_bad_rules(rule):
+    with pytest.raises(ValueError):
+        compile_rules({"rules": [rule]})
+
+def test_compile_rejects_duplicate_alarm_keys():
+    with pytest.raises(ValueError, match="duplicate"):
+        compile_rules({"rules": [{"metric": "T", "kind": "target", "value": 1},
+                                 {"metric": "T", "kind": "target", "value": 2}]})
@@ -0,0 +1,139 @@
+# tracing.py — optional end-to-end latency tracing: emulator publish → manager → dashboard
+#
+# השולח (emulators_gui / loadgen) מוסיף לסוף ההודעה חותמת:   "<payload> |trace=<seq>;<t_send>"
+#   seq    — מונה לכל topic (פער = הודעה שאבדה בדרך)
+#   t_send — time.monotonic() בשליחה (שעון משותף לכל התהליכים על אותה מכונה)
+# המקבל (manager / dashboard) מסיר את החותמת לפני הפענוח — הודעה בלי חותמת עוברת כרגיל.
+#
+# hops:  mgr_receive → mgr_parse → mgr_persist (commit ב-DB)      ui_receive → ui_render
+# כל hop נמדד מ-t_send; ההתפלגות נשמרת לפי hop (גם ב-/metrics כ-stage "e2e_<hop>") ולפי מכשיר.
+
+import threading
+import time
+
+import instrument as im
+
+try:
+    from init import trace_enabled, trace_sample_every, trace_report_s, comm_topic
+except Exception:
+    trace_enabled, trace_sample_every, trace_report_s = False, 1, 30.0
+    comm_topic = "pr/Proofing/BakeryA/"
+
+TAG = " |trace="
+TOPIC_ROOT = comm_topic.rstrip("/").rsplit("/", 1)[0]
+
+HOPS = ("mgr_receive", "mgr_parse", "mgr_persist", "ui_receive", "ui_render")   # סדר הדוח
+
+now = time.monotonic
+
+# ------------------ צד השולח ------------------
+class Stamper:
+    """Appends trace stamps to every `every`-th payload per topic."""
+
+    def __init__(self, enabled: bool = trace_enabled, every: int = trace_sample_every):
+        self.enabled = bool(enabled)
+        self.every = max(1, int(every))
+        self._n = {}     # topic -> הודעות שעברו (לדגימה)
+        self._seq = {}   # topic -> seq אחרון שנשלח
+        self._lock = threading.Lock()
+
+    def stamp(self, topic: str, payload: str) -> str:
+        if not self.enabled:
+            return payload
+        with self._lock:
+            n = self._n.get(topic, 0)
+            self._n[topic] = n + 1
+            if n % self.every:
+                return payload
+            seq = self._seq.get(topic, 0) + 1
+            self._seq[topic] = seq
+        return f"{payload}{TAG}{seq};{now():.6f}"
+
+# ------------------ צד המקבל ------------------
+def split(payload: str):
+    """'<payload> |trace=12;345.678901' -> ('<payload>', (12, 345.678901)); no/bad stamp -> (payload, None)."""
+    i = payload.rfind(TAG)
+    if i < 0:
+        return payload, None
+    try:
+        seq, t_send = payload[i + len(TAG):].split(";", 1)
+        return payload[:i], (int(seq), float(t_send))
+    except ValueError:
+        return payload[:i], None   # חותמת פגומה — מסירים ומתעלמים
+
+def device_of(topic: str) -> str:
+    """'pr/Proofing/BakeryB/env-1/pub' -> 'BakeryB/env-1'."""
+    t = topic[len(TOPIC_ROOT) + 1:] if topic.startswith(TOPIC_ROOT + "/") else topic
+    return t[:-4] if t.endswith("/pub") else t
+
+class Tracer:
+    """Per-process latency recorder: hop histograms + per-(hop, device) histograms + seq-gap counts."""
+
+    def __init__(self, report_s: float = trace_report_s):
+        self.report_s = float(report_s or 0)
+        self.per_hop = {}      # hop -> im.Histogram
+        self.per_device = {}   # (hop, device) -> im.Histogram
+        self.last_seq = {}     # device -> seq אחרון שהתקבל
+        self.lost = {}         # device -> הודעות חסרות לפי פערי seq
+        self.traced = 0
+        self._lock = threading.Lock()
+        self._next_report = now() + self.report_s if self.report_s else float("inf")
+
+    def received(self, topic: str, trace):
+        """Called once per traced message at a process's first hop: seq-gap check. Returns the device key."""
+        dev = device_of(topic)
+        seq = trace[0]
+        with self._lock:
+            self.traced += 1
+            prev = self.last_seq.get(dev)
+            if prev is not None and seq > prev + 1:
+                self.lost[dev] = self.lost.get(dev, 0) + (seq - prev - 1)
+            if prev is None or seq > prev:
+                self.last_seq[dev] = seq
+        return dev
+
+    def record(self, hop: str, dev: str, trace, t=None):
+        dt = (now() if t is None else t) - trace[1]
+        im.observe(f"e2e_{hop}", dt)
+        h, hh = self.per_device.get((hop, dev)), self.per_hop.get(hop)
+        if h is None or hh is None:
+            with self._lock:
+                h = self.per_device.setdefault((hop, dev), im.Histogram())
+                hh = self.per_hop.setdefault(hop, im.Histogram())
+        h.observe(dt)
+        hh.observe(dt)
+
+    def report(self, top: int = 5) -> str:
+        """Latency distribution per hop, the slowest devices per hop, and seq gaps."""
+        with self._lock:
+            items = list(self.per_device.items())
+            per_hop = dict(self.per_hop)
+            lost = dict(self.lost)
+            traced = self.traced
+        if not traced:
+            return "trace|> no traced messages"
+        hops = {}
+        for (hop, dev), h in items:
+            hops.setdefault(hop, []).append((dev, h))
+        out = [f"trace|> {traced} traced messages, {len(self.last_seq)} devices, "
+               f"{sum(lost.values())} lost (seq gaps)"]
+        for hop in sorted(hops, key=lambda h: (HOPS.index(h) if h in HOPS else len(HOPS), h)):
+            st = per_hop[hop]
+            out.append(f"trace|> {hop:<12} n={st.n:<8} p50<={st.quantile(0.5) * 1e3:8.2f} ms  "
+                       f"p99<={st.quantile(0.99) * 1e3:8.2f} ms  mean={st.sum / max(st.n, 1) * 1e3:8.2f} ms")
+            slow = sorted(hops[hop], key=lambda dh: -dh[1].sum / max(dh[1].n, 1))[:top]
+            for dev, h in slow:
+                out.append(f"trace|>    {dev:<28} n={h.n:<6} mean={h.sum / max(h.n, 1) * 1e3:8.2f} ms  "
+                           f"p99<={h.quantile(0.99) * 1e3:8.2f} ms  lost={lost.get(dev, 0)}")
+        return "\n".join(out)
+
+    def maybe_report(self):
+        """Print report() every report_s (called from the periodic loops)."""
+        t = now()
+        if t < self._next_report:
+            return
+        self._next_report = t + self.report_s
+        if self.traced:
+            print(self.report(), flush=True)
+
+TRACER = Tracer()